@@ -1,6 +1,16 @@
 import os
 import sqlite3
+import sys
 import streamlit as st
+from dotenv import load_dotenv
+
+# Add the processing directory to the system path to import modules
+sys.path.append(os.path.abspath(os.path.join(__file__, "../training/processing")))
+
+# Nạp cấu hình từ .env trước khi import các module đọc biến môi trường
+load_dotenv()
+
+from news_repository import NEWS_PAGE_SIZE, SEARCH_PAGE_SIZE, get_news_repository
 
 # Đường dẫn tới file cơ sở dữ liệu
 db_path = os.path.join('training', 'processing', 'db', 'news_data.db')
@@ -29,7 +39,7 @@ def display_news_item(news_item, is_preview=True):
 
     st.markdown(f"### {news_item['title']}", unsafe_allow_html=True)
     if is_preview:
-        st.markdown(f"{news_item['content'][:200]}...", unsafe_allow_html=True)  # Display a preview of the content
+        st.markdown(f"{news_item['preview']}...", unsafe_allow_html=True)  # Display a preview of the content
         if st.button('Read more', key=news_item['id']):
             st.session_state['selected_news'] = news_item['id']
             st.experimental_rerun()
@@ -41,24 +51,54 @@ def display_news_item(news_item, is_preview=True):
             back_to_list()
             st.experimental_rerun()
 
-# Hàm để hiển thị danh sách tin tức với phân trang
-def display_news_list(news, page_size=5):
-    num_pages = len(news) // page_size + (1 if len(news) % page_size > 0 else 0)
-    if 'page_num' not in st.session_state:
-        st.session_state['page_num'] = 0
+# Hàm để hiển thị danh sách tin tức với phân trang theo keyset:
+# mỗi trang chỉ đọc page_size bài (id < id cuối của trang trước), không đọc content
+def display_news_list(page_size=NEWS_PAGE_SIZE):
+    repository = get_news_repository()
+    # Ngăn xếp con trỏ: id bắt đầu (loại trừ) của các trang đã đi qua, None là trang đầu
+    if 'page_cursors' not in st.session_state:
+        st.session_state['page_cursors'] = [None]
+    cursors = st.session_state['page_cursors']
+    total = repository.count()
+    num_pages = total // page_size + (1 if total % page_size > 0 else 0)
+    st.write(f"{total} news articles in the database, page {len(cursors)}/{max(num_pages, 1)}.")
 
-    start_idx = st.session_state['page_num'] * page_size
-    end_idx = start_idx + page_size
-    for news_item in news[start_idx:end_idx]:
+    news, has_next = repository.latest(before_id=cursors[-1], limit=page_size)
+    for news_item in news:
         display_news_item(news_item)
 
-    if st.session_state['page_num'] > 0:
+    if len(cursors) > 1:
         if st.button('Previous', key='prev'):
-            st.session_state['page_num'] -= 1
+            cursors.pop()
             st.experimental_rerun()
-    if st.session_state['page_num'] < num_pages - 1:
+    if has_next:
         if st.button('Next', key='next'):
-            st.session_state['page_num'] += 1
+            cursors.append(news[-1]['id'])
+            st.experimental_rerun()
+
+# Hàm hiển thị kết quả tìm kiếm toàn văn (bm25) theo trang, mỗi bài kèm đoạn trích
+def display_search_results(query, page_size=SEARCH_PAGE_SIZE):
+    if st.session_state.get('home_search_query') != query:
+        st.session_state['home_search_query'] = query
+        st.session_state['home_search_page'] = 0
+    page = st.session_state['home_search_page']
+    results, total = get_news_repository().search(query, limit=page_size, offset=page * page_size)
+    st.write(f"Found {total} news articles matching \"{query}\".")
+    for result in results:
+        st.markdown(f"### {result['title']}", unsafe_allow_html=True)
+        st.markdown(result['snippet'])
+        if st.button('Read more', key=f"search_{result['id']}"):
+            st.session_state['selected_news'] = result['id']
+            st.experimental_rerun()
+
+    num_pages = (total + page_size - 1) // page_size
+    if page > 0:
+        if st.button('Previous', key='search_prev'):
+            st.session_state['home_search_page'] -= 1
+            st.experimental_rerun()
+    if page < num_pages - 1:
+        if st.button('Next', key='search_next'):
+            st.session_state['home_search_page'] += 1
             st.experimental_rerun()
 
 # Tiêu đề ứng dụng
@@ -101,11 +141,12 @@ if 'selected_news' not in st.session_state:
     st.session_state['selected_news'] = None
 
 if st.session_state['selected_news'] is None:
-    # Lấy danh sách các bài viết, sắp xếp theo id giảm dần
-    news = conn.execute('SELECT id, title, url, content FROM news ORDER BY id DESC').fetchall()
-    st.write(f"Fetched {len(news)} news articles from the database.")
-    # Hiển thị danh sách tin tức với phân trang
-    display_news_list(news)
+    search_query = st.text_input("Tìm kiếm bài viết", placeholder="Nhập từ khoá (có dấu hoặc không dấu)...")
+if st.session_state['selected_news'] is None and search_query.strip():
+    display_search_results(search_query.strip())
+elif st.session_state['selected_news'] is None:
+    # Hiển thị danh sách tin tức mới nhất, mỗi lần chỉ đọc một trang từ cơ sở dữ liệu
+    display_news_list()
 else:
     # Hiển thị chi tiết bài viết
     news_id = st.session_state['selected_news']
@@ -4,15 +4,12 @@ import streamlit as st
 from streamlit_chat import message
 import os
 import sys
-from langchain_community.llms import CTransformers
+import time
+import uuid
 from langchain.chains import RetrievalQA
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain.prompts import PromptTemplate
-from langchain_community.embeddings import GPT4AllEmbeddings
-from langchain_community.vectorstores import FAISS
-from sentence_transformers import SentenceTransformer
-
-# Load SentenceTransformer model for embedding
-MODEL = SentenceTransformer("maiduchuy321/vietnamese-bi-encoder-fine-tuning-for-law-chatbot")
+from dotenv import load_dotenv
 
 # Set page configuration
 st.set_page_config(page_title="Chatbot", page_icon="🦙", layout="wide")
@@ -20,59 +17,113 @@ st.set_page_config(page_title="Chatbot", page_icon="🦙", layout="wide")
 # Add the processing directory to the system path to import modules
 sys.path.append(os.path.abspath(os.path.join(__file__, "../../training/processing")))
 
+# Nạp cấu hình từ .env trước khi import các module đọc biến môi trường
+load_dotenv()
+
+from answer_cache import get_answer_cache, normalize_question
+from inference_client import create_llm, get_embeddings
+from metrics import RequestMetrics, record_metrics
+from warmup import start_warmup, warmup_status
+from embedding_service import check_index_model_id
+from resources import VECTOR_INDEX_WATCH_SECONDS, get_vector_store, reload_vector_store, vector_store_changed
+from hybrid_search import create_retriever
+from context_packer import ContextPacker, PackedRetriever
+from conversation_memory import ConversationMemory, cap_messages
+
 # Configuration for Vector DB path
 VECTOR_DB_PATH = os.path.abspath(os.path.join(__file__, "../../training/processing/data/vectorstores/db_faiss"))
 
-def load_llm(model_file, temperature):
-    """Load LLM với các thiết lập tùy chỉnh."""
-    llm = CTransformers(
-        model=model_file,
-        model_type="llama",
-        max_new_tokens=1024,
-        temperature=temperature
+def load_llm(model_file, temperature, max_new_tokens=1024, top_p=0.9, session_id="default"):
+    """Load LLM với các thiết lập tùy chỉnh (trọng số và hàng đợi sinh được dùng chung giữa các session).
+
+    Nếu đặt INFERENCE_SERVER_URL, model nằm trên server suy luận dùng chung thay vì trong process này.
+    """
+    llm = create_llm(
+        model_file,
+        temperature=temperature,
+        max_new_tokens=max_new_tokens,
+        top_p=top_p,
+        session_id=session_id
     )
     return llm
 
+class StreamHandler(BaseCallbackHandler):
+    """Đẩy từng token vào khung chat của assistant và ghi nhận số đo độ trễ."""
+
+    def __init__(self, placeholder, metrics, count_tokens=None):
+        self.placeholder = placeholder
+        self.metrics = metrics
+        self.count_tokens = count_tokens
+        self.text = ""
+        self._retrieval_started_at = None
+
+    def on_retriever_start(self, serialized, query, **kwargs):
+        self._retrieval_started_at = time.perf_counter()
+
+    def on_retriever_end(self, documents, **kwargs):
+        if self._retrieval_started_at is not None:
+            self.metrics.extra['retrieval_ms'] = round((time.perf_counter() - self._retrieval_started_at) * 1000, 2)
+        # Thời gian rerank (nếu bật) được retriever ghi vào metadata của chunk
+        if documents and 'rerank_ms' in documents[0].metadata:
+            self.metrics.extra['rerank_ms'] = documents[0].metadata['rerank_ms']
+            self.metrics.extra['rerank_status'] = documents[0].metadata['rerank_status']
+        if documents and 'context_tokens' in documents[0].metadata:
+            self.metrics.extra['context_tokens'] = documents[0].metadata['context_tokens']
+            self.metrics.extra['context_chunks'] = documents[0].metadata['context_chunks']
+
+    def on_text(self, text, **kwargs):
+        # LLM báo trạng thái chờ trong hàng đợi sinh; lệnh vẽ này cũng là điểm Streamlit dừng
+        # script khi người dùng rời trang, lúc đó request được huỷ khỏi hàng đợi
+        if 'queue_wait_ms' in kwargs and not self.text:
+            self.placeholder.markdown(f"_{text}_")
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        if self.count_tokens is not None:
+            self.metrics.extra['prompt_tokens'] = self.count_tokens(prompts[0])
+
+    def on_llm_new_token(self, token, **kwargs):
+        chunk = kwargs.get('chunk')
+        if chunk is not None and chunk.generation_info:
+            self.metrics.extra.update(chunk.generation_info)
+        self.metrics.mark_token()
+        self.text += token
+        self.placeholder.markdown(self.text + "▌")
+
+
 def create_prompt(template):
     """Tạo prompt template cho mô hình."""
     prompt = PromptTemplate(template=template, input_variables=["context", "question"])
     return prompt
 
 
-def create_qa_chain(prompt, llm, db):
-    """Tạo chuỗi QA từ mô hình và cơ sở dữ liệu vector."""
-    retriever = db.as_retriever(search_kwargs={"k": 5}, max_tokens_limit=1024)
+def create_qa_chain(prompt, llm, db, search_params=None):
+    """Tạo chuỗi QA từ mô hình và cơ sở dữ liệu vector (tìm lai vector + từ khoá).
 
-    # Kiểm tra xem có dữ liệu từ FAISS không
-    test_query = "khoản 5 Điều 57 Luật Trật tự, an toàn giao thông đường bộ 2024 quy định giấy phép lái xe"
-    results = retriever.get_relevant_documents(test_query)
-    if not results:
-        logging.warning("No relevant documents found in FAISS.")
-    else:
-        logging.info(f"Found {len(results)} relevant documents in FAISS for query '{test_query}'.")
+    Context được gộp chunk chồng lấn và cắt theo ngân sách token của chính model trước khi vào prompt.
+    """
+    retriever = PackedRetriever(
+        base_retriever=create_retriever(db, k=5, search_kwargs=search_params),
+        packer=ContextPacker(llm)
+    )
 
     llm_chain = RetrievalQA.from_chain_type(
         llm=llm,
         chain_type="stuff",
         retriever=retriever,
-        return_source_documents=False,
+        return_source_documents=True,
         chain_type_kwargs={'prompt': prompt}
     )
     return llm_chain
 
 
 def read_vectors_db():
-    """Load cơ sở dữ liệu vector."""
-    model_name = "all-MiniLM-L6-v2.gguf2.f16.gguf"
-    gpt4all_kwargs = {'allow_download': True}
-    embeddings = GPT4AllEmbeddings(
-        model_name=model_name,
-        gpt4all_kwargs=gpt4all_kwargs
-    )
-    # Kiểm tra và log số lượng vector hiện có trong FAISS
+    """Load cơ sở dữ liệu vector (chỉ deserialize một lần cho mỗi process)."""
+    embeddings = get_embeddings()
+    # Kiểm tra và log số lượng vector hiện có trong chỉ mục
     try:
-        db = FAISS.load_local(VECTOR_DB_PATH, embeddings, allow_dangerous_deserialization=True)
-        logging.info(f"Vector database loaded with {db.index.ntotal} vectors.")
+        check_index_model_id(VECTOR_DB_PATH, embeddings.model_id)
+        db = get_vector_store(VECTOR_DB_PATH, embeddings)
+        logging.info(f"Vector database loaded with {db.count} vectors ({db.backend}, generation {db.generation}).")
         return db
     except Exception as e:
         logging.error(f"Failed to load vector database: {e}")
@@ -131,6 +182,10 @@ if 'temperature' not in st.session_state:
     st.session_state['temperature'] = 0.75
 if 'model_selected' not in st.session_state:
     st.session_state['model_selected'] = 'vinallama-7b-chat'
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex
+if 'memory' not in st.session_state:
+    st.session_state['memory'] = ConversationMemory()
 
 # Sidebar options
 st.sidebar.header("Chatbot Settings")
@@ -178,20 +233,96 @@ top_p = st.sidebar.slider(
     help="When decoding text, samples from the top P percentage of most likely tokens; lower to ignore less likely tokens."
 )
 
+# Thế hệ mới của chỉ mục được nạp ở nền và có hiệu lực từ lần chạy lại kế tiếp;
+# khi tắt tự nạp (VECTOR_INDEX_WATCH_SECONDS=0) thì load lại bằng tay cho mọi session
+if VECTOR_INDEX_WATCH_SECONDS <= 0 and vector_store_changed(VECTOR_DB_PATH) and st.sidebar.button("Tải lại chỉ mục vector"):
+    reload_vector_store(VECTOR_DB_PATH)
+    DB = read_vectors_db()
+if DB is not None:
+    st.sidebar.caption(f"Chỉ mục vector: thế hệ {DB.generation}, {DB.count} vector")
+
+# Tham số truy vấn của chỉ mục xấp xỉ: đánh đổi recall lấy độ trễ (xem bench_ann_index.py)
+search_params = {}
+if DB is not None and DB.backend == 'faiss_ann':
+    if DB.params.get('kind') == 'hnsw':
+        search_params['ef_search'] = st.sidebar.slider(
+            'efSearch',
+            min_value=16,
+            max_value=512,
+            value=int(DB.params.get('ef_search', 64)),
+            step=16,
+            help="Size of the HNSW candidate list; higher is more accurate but slower."
+        )
+    else:
+        nlist = int(DB.params.get('nlist', 1))
+        search_params['nprobe'] = st.sidebar.slider(
+            'nprobe',
+            min_value=1,
+            max_value=max(nlist, 2),
+            value=min(int(DB.params.get('nprobe', 8)), nlist),
+            help="Number of IVF clusters scanned per query; higher is more accurate but slower."
+        )
+
 # Load the selected model with the chosen temperature
-LLM = load_llm(st.session_state['model_selected'], st.session_state['temperature'])
+LLM = load_llm(st.session_state['model_selected'], st.session_state['temperature'], max_tokens, top_p,
+               session_id=st.session_state['session_id'])
 
 # Create Prompt
 template = """system\nSử dụng thông tin sau đây để trả lời câu hỏi. Nếu bạn không biết câu trả lời, hãy nói không biết, đừng cố tạo ra câu trả lời\n
 {context}\nuser\n{question}\nassistant"""
 prompt = create_prompt(template)
-LLM_CHAIN = create_qa_chain(prompt, LLM, DB)
+LLM_CHAIN = create_qa_chain(prompt, LLM, DB, search_params)
+# Phần system prompt cố định, dùng chung cho mọi prompt gửi tới model (KV cache của nó được prime sẵn)
+SYSTEM_PREFIX = template.split("{context}")[0]
+# LLM tất định, câu trả lời ngắn: viết lại câu hỏi tiếp nối và tóm tắt hội thoại.
+# Khoá hàng đợi riêng để việc tóm tắt ở nền không chen vào hàng đợi câu hỏi của người dùng
+MEMORY_LLM = load_llm(st.session_state['model_selected'], 0.0, 128, 1.0,
+                      session_id=f"{st.session_state['session_id']}:memory")
+
+# Warm-up nền một lần cho mỗi process: chỉ mục, embedder và phần system prompt cố định
+start_warmup(DB, get_embeddings(), LLM, SYSTEM_PREFIX)
+
+# Cache câu trả lời theo ngữ nghĩa: build lại chỉ mục xoá cả cache, thế hệ mới chỉ xoá câu trả lời có chunk nguồn bị đổi
+ANSWER_CACHE = get_answer_cache()
+if DB is not None:
+    ANSWER_CACHE.set_index_version(DB.build_id, DB.generation, getattr(DB, 'chunk_store', None))
+
+# Trạng thái khởi động
+warmup = warmup_status()
+warmup_labels = {'running': 'đang khởi động', 'ready': 'sẵn sàng', 'failed': 'lỗi khởi động'}
+with st.sidebar.expander(f"Trạng thái: {warmup_labels.get(warmup['status'], warmup['status'])}"):
+    for step_name, step_status in warmup['steps'].items():
+        st.write(f"- {step_name}: {step_status}")
+    if warmup['error']:
+        st.error(warmup['error'])
+    if warmup['elapsed_ms'] is not None:
+        st.caption(f"Hoàn tất sau {warmup['elapsed_ms']} ms")
+
+# Hàng đợi sinh dùng chung của model
+try:
+    scheduler_stats = LLM.queue_stats()
+    st.sidebar.caption(
+        f"Hàng đợi LLM: {scheduler_stats['running']}/{scheduler_stats['max_concurrency']} đang sinh, "
+        f"{scheduler_stats['queued']} đang chờ, chờ trung bình {scheduler_stats['avg_wait_ms']:.0f} ms"
+    )
+except Exception as e:
+    logging.error(f"Failed to read LLM queue stats: {e}")
+    st.sidebar.warning("Không kết nối được tới server suy luận.")
+
+# Số đo độ trễ của câu hỏi gần nhất
+if st.session_state.get('last_metrics'):
+    last_metrics = st.session_state['last_metrics']
+    st.sidebar.caption(
+        f"Lần trả lời trước: TTFT {last_metrics['ttft_ms']} ms, "
+        f"{last_metrics['tokens_per_sec']} tokens/s, tổng {last_metrics['total_ms']} ms"
+    )
 
 # Clear chat history button
 if st.sidebar.button("Xoá lịch sử Chat"):
     st.session_state['generated'] = []
     st.session_state['past'] = []
     st.session_state['chat_dialogue'] = []
+    st.session_state['memory'].clear()
 
 # Display chat messages from history on app rerun
 for message_item in st.session_state.chat_dialogue:
@@ -206,16 +337,51 @@ if prompt := st.chat_input("Mời bạn nhập câu hỏi: "):
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # Generate response
-    response = LLM_CHAIN.invoke({"query": prompt})['result']
-
-    # Nếu không có kết quả trả về, bot sẽ trả về thông báo mặc định
-    if not response or response.lower().strip() == 'không biết':
-        response = "Không có thông tin nào được cung cấp để trả lời câu hỏi này."
-
-    # Hiển thị câu trả lời của bot trong phần hội thoại
+    # Sinh câu trả lời dạng streaming vào khung chat của assistant
     with st.chat_message("assistant"):
-        st.markdown(f"Theo thông tin bạn nhập:\n\n{response}\n\nBạn muốn hỏi gì tiếp theo?")
+        placeholder = st.empty()
+        metrics = RequestMetrics(question=prompt)
+        # Câu hỏi tiếp nối ("còn xe máy thì sao?") được viết lại thành câu hỏi độc lập trước khi tìm kiếm;
+        # câu hỏi tự đủ nghĩa đi thẳng tới bước tìm kiếm
+        memory = st.session_state['memory']
+        question, condense_stats = memory.condense(prompt, MEMORY_LLM, prefix=SYSTEM_PREFIX)
+        metrics.extra.update(condense_stats)
+        if question != prompt:
+            metrics.extra['standalone_question'] = question
+        query_vector = get_embeddings().embed_query(normalize_question(question))
+        cached = ANSWER_CACHE.lookup(query_vector)
+
+        if cached:
+            response, similarity = cached
+            metrics.extra.update({'cache': 'hit', 'cache_similarity': round(similarity, 4)})
+        else:
+            handler = StreamHandler(placeholder, metrics, count_tokens=LLM.get_num_tokens)
+            result = LLM_CHAIN.invoke({"query": question}, config={"callbacks": [handler]})
+            response = result['result']
+            sources = [chunk_id for document in result['source_documents'] for chunk_id in document.metadata.get('chunk_ids', [])]
+            metrics.extra['cache'] = 'miss'
+        metrics.finish()
+        record_metrics(metrics)
+
+        # Nếu không có kết quả trả về, bot sẽ trả về thông báo mặc định
+        if not response or response.lower().strip() == 'không biết':
+            response = "Không có thông tin nào được cung cấp để trả lời câu hỏi này."
+        elif not cached:
+            ANSWER_CACHE.put(question, query_vector, response, sources)
+
+        # Hiển thị câu trả lời hoàn chỉnh của bot trong phần hội thoại
+        placeholder.markdown(f"Theo thông tin bạn nhập:\n\n{response}\n\nBạn muốn hỏi gì tiếp theo?")
+        if question != prompt:
+            st.caption(f"Câu hỏi được hiểu là: {question}")
+        if cached:
+            st.caption(f"Trả lời từ cache trong {metrics.total_ms:.0f} ms (độ tương đồng {similarity:.3f})")
+        else:
+            st.caption(metrics.summary())
 
     # Add assistant response to chat history
     st.session_state.chat_dialogue.append({"role": "assistant", "content": f"Theo thông tin bạn nhập:\n\n{response}\n\nBạn muốn hỏi gì tiếp theo?"})
+    st.session_state['last_metrics'] = metrics.as_dict()
+    # Bộ nhớ hội thoại có giới hạn: lượt cũ được tóm tắt ở luồng nền, lịch sử hiển thị bị cắt bớt
+    memory.add_turn(prompt, response, MEMORY_LLM)
+    memory.summarize_async(MEMORY_LLM, prefix=SYSTEM_PREFIX)
+    cap_messages(st.session_state.chat_dialogue)
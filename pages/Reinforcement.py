@@ -1,15 +1,30 @@
 import streamlit as st
-import sqlite3
 import os
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import GPT4AllEmbeddings
-from langchain.docstore.document import Document
-
-# Đường dẫn tới cơ sở dữ liệu
-DB_PATH = os.path.join('training', 'processing', 'db', 'news_data.db')
-VECTOR_DB_PATH = os.path.join('training', 'processing', 'data', 'vectorstores', 'db_faiss')
-MODEL_NAME = "all-MiniLM-L6-v2.gguf2.f16.gguf"
+import sys
+from dotenv import load_dotenv
+
+# Add the processing directory to the system path to import modules
+sys.path.append(os.path.abspath(os.path.join(__file__, "../../training/processing")))
+
+# Nạp cấu hình từ .env trước khi import các module đọc biến môi trường
+load_dotenv()
+
+from feedback_outbox import get_feedback_indexer, get_feedback_outbox
+from news_repository import SEARCH_PAGE_SIZE, get_news_repository
+
+# Phản hồi được ghi vào outbox, worker nền embed và thêm vào chỉ mục theo lô
+OUTBOX = get_feedback_outbox()
+INDEXER = get_feedback_indexer()
+# Tìm bài viết qua chỉ mục toàn văn news_fts (bm25, không phân biệt dấu)
+NEWS = get_news_repository()
+if 'feedback_items' not in st.session_state:
+    st.session_state['feedback_items'] = []
+if 'reinforcement_search_query' not in st.session_state:
+    st.session_state['reinforcement_search_query'] = ''
+if 'reinforcement_search_page' not in st.session_state:
+    st.session_state['reinforcement_search_page'] = 0
+if 'reinforcement_search_selected' not in st.session_state:
+    st.session_state['reinforcement_search_selected'] = None
 
 # Tạo giao diện
 st.title("Hệ thống Tự Học Tăng Cường")
@@ -29,21 +44,49 @@ with col3:
 # Kiểm tra đầu vào và thực hiện tìm kiếm
 if search_button:
     if title.strip():  # Kiểm tra xem tiêu đề có dữ liệu hay không
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT content FROM news WHERE title LIKE ?", (f"%{title}%",))
-            search_results = cursor.fetchall()
-            if search_results:
-                st.write("Kết quả tìm kiếm:")
-                for result in search_results:
-                    st.write(result[0])
-            else:
-                st.warning("Không tìm thấy bài viết nào với tiêu đề này.")
+        st.session_state['reinforcement_search_query'] = title.strip()
+        st.session_state['reinforcement_search_page'] = 0
+        st.session_state['reinforcement_search_selected'] = None
     else:
         st.warning("Vui lòng nhập tiêu đề để tìm kiếm.")
 
+# Kết quả tìm kiếm theo trang: tiêu đề và đoạn trích, nội dung đầy đủ chỉ được đọc khi chọn bài
+if st.session_state['reinforcement_search_query']:
+    page = st.session_state['reinforcement_search_page']
+    search_results, total = NEWS.search(
+        st.session_state['reinforcement_search_query'], limit=SEARCH_PAGE_SIZE, offset=page * SEARCH_PAGE_SIZE
+    )
+    if total:
+        st.write(f"Kết quả tìm kiếm ({total} bài):")
+        for result in search_results:
+            st.markdown(f"**{result['title']}**")
+            st.write(result['snippet'])
+            if st.button("Xem nội dung", key=f"search_result_{result['id']}"):
+                st.session_state['reinforcement_search_selected'] = result['id']
+        num_pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+        prev_col, page_col, next_col = st.columns([1, 2, 1])
+        with prev_col:
+            if page > 0 and st.button("Trang trước", key='search_prev'):
+                st.session_state['reinforcement_search_page'] -= 1
+                st.experimental_rerun()
+        with page_col:
+            st.caption(f"Trang {page + 1}/{num_pages}")
+        with next_col:
+            if page < num_pages - 1 and st.button("Trang sau", key='search_next'):
+                st.session_state['reinforcement_search_page'] += 1
+                st.experimental_rerun()
+        if st.session_state['reinforcement_search_selected'] is not None:
+            selected = NEWS.get(st.session_state['reinforcement_search_selected'])
+            if selected:
+                st.write(f"Nội dung bài viết \"{selected['title']}\":")
+                st.write(selected['content'])
+    else:
+        st.warning("Không tìm thấy bài viết nào với tiêu đề này.")
+
 # Xử lý nút reset để xóa trắng các trường nhập liệu
 if reset_button:
+    st.session_state['reinforcement_search_query'] = ''
+    st.session_state['reinforcement_search_selected'] = None
     st.experimental_rerun()
 
 # Hiển thị nội dung bài viết
@@ -60,35 +103,32 @@ if user_feedback == "Không chính xác":
 # Lưu phản hồi và cập nhật
 if st.button("Lưu phản hồi và cập nhật"):
     if title and content and (user_feedback == "Chính xác" or corrected_content):
-        # Thêm dữ liệu mới vào bảng news
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO news (title, content) 
-                VALUES (?, ?)
-            """, (title, corrected_content if corrected_content else content))
-            conn.commit()
-
-        st.success("Dữ liệu đã được thêm vào bảng news!")
-
-        # Tạo lại các chunk và cập nhật embedding
-        st.write("Cập nhật các chunk và embedding...")
-
-        # Tạo các Document từ dữ liệu đã thêm
-        document = Document(page_content=corrected_content if corrected_content else content)
-
-        # Tạo các chunk từ Document
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50)
-        chunks = text_splitter.split_documents([document])
-
-        # Tạo lại các embedding từ chunk
-        embeddings = GPT4AllEmbeddings(model_name=MODEL_NAME, gpt4all_kwargs={'allow_download': True})
-
-        if os.path.exists(VECTOR_DB_PATH):
-            db = FAISS.load_local(VECTOR_DB_PATH, embeddings, allow_dangerous_deserialization=True)
-            db.add_documents(chunks)
-            db.save_local(VECTOR_DB_PATH)
-
-        st.success("Embedding đã được cập nhật!")
+        # Bài viết và dòng outbox được ghi trong một transaction, việc embed chạy ở worker nền
+        outbox_id, created = OUTBOX.enqueue(title, corrected_content if corrected_content else content)
+        INDEXER.notify()
+        if outbox_id not in st.session_state['feedback_items']:
+            st.session_state['feedback_items'].append(outbox_id)
+        if created:
+            st.success("Phản hồi đã được lưu và đang chờ cập nhật vào chỉ mục.")
+        else:
+            st.info("Phản hồi này đã được lưu trước đó.")
     else:
         st.error("Vui lòng nhập đầy đủ thông tin trước khi lưu!")
+
+# Trạng thái cập nhật các phản hồi
+status_labels = {'queued': 'đang chờ', 'indexed': 'đã cập nhật', 'failed': 'lỗi'}
+counts = OUTBOX.counts()
+st.caption(
+    f"Hàng đợi phản hồi: {counts['queued']} đang chờ, {counts['indexed']} đã cập nhật, {counts['failed']} lỗi"
+)
+if st.session_state['feedback_items']:
+    st.write("Phản hồi của bạn:")
+    items = OUTBOX.status(st.session_state['feedback_items'])
+    for outbox_id in reversed(st.session_state['feedback_items']):
+        item = items.get(outbox_id)
+        if item:
+            line = f"- {item['title']}: {status_labels.get(item['status'], item['status'])}"
+            if item['error']:
+                line += f" ({item['error']})"
+            st.write(line)
+    st.button("Làm mới trạng thái")
@@ -0,0 +1,253 @@
+# answer_cache.py
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Cache nằm cạnh news_data.db, có thể cấu hình qua .env
+ANSWER_CACHE_PATH = os.getenv('ANSWER_CACHE_PATH', os.path.join(BASE_DIR, 'db', 'answer_cache.db'))
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 7 * 24 * 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 2000))
+SQLITE_MAX_VARIABLES = 900
+
+
+def normalize_question(question: str) -> str:
+    """Chuẩn hoá câu hỏi trước khi embedding: NFC, chữ thường, gộp khoảng trắng."""
+    question = unicodedata.normalize('NFC', question).lower()
+    question = re.sub(r'[?!.\s]+$', '', question.strip())
+    return re.sub(r'\s+', ' ', question)
+
+
+def _normalize_vector(vector: Sequence[float]) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class SemanticAnswerCache:
+    """Cache câu trả lời theo embedding câu hỏi (cosine ≥ ngưỡng), có TTL và giới hạn LRU.
+
+    Dữ liệu được lưu trong SQLite; một bản ma trận embedding được giữ trong bộ nhớ
+    để tra cứu bằng một phép nhân ma trận, và được nạp lại khi process khác ghi vào cache.
+    Mỗi câu trả lời nhớ chunk_id của các chunk nguồn và thế hệ chỉ mục lúc được lưu,
+    để thay đổi nhỏ của chỉ mục chỉ xoá câu trả lời dựa trên chunk đã bị thay hoặc xoá.
+    """
+
+    def __init__(
+        self,
+        db_path: str = ANSWER_CACHE_PATH,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl: int = ANSWER_CACHE_TTL,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+    ) -> None:
+        self.db_path = db_path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._generation: Optional[int] = None
+        self._data_version: Optional[int] = None
+        self._ids: List[int] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                index_version TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                sources TEXT,
+                index_generation INTEGER
+            )
+        """)
+        # Cache của bản cũ chưa có chunk nguồn: bản ghi cũ bị xoá ở thay đổi đầu tiên của chỉ mục
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(answer_cache)')}
+        for column, kind in (('sources', 'TEXT'), ('index_generation', 'INTEGER')):
+            if column not in columns:
+                self._conn.execute(f'ALTER TABLE answer_cache ADD COLUMN {column} {kind}')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_answer_cache_access ON answer_cache (last_access)')
+        self._conn.commit()
+
+    def set_index_version(self, version: str, generation: Optional[int] = None, chunk_store: Any = None) -> None:
+        """Gắn cache với chỉ mục đang phục vụ: `version` là build_id, `generation` là thế hệ của nó.
+
+        build_id đổi (build lại từ đầu): mọi bản ghi của bản build cũ bị xoá. Chỉ thế hệ đổi (delta segment,
+        compaction, cập nhật tăng dần): chỉ xoá bản ghi có chunk nguồn bị thay/xoá sau thế hệ của bản ghi,
+        tra trong `chunk_store`; không có chunk store (Chroma) thì xoá mọi bản ghi của thế hệ cũ hơn.
+        """
+        with self._lock:
+            if version == self._version and (generation is None or generation == self._generation):
+                return
+            if version != self._version:
+                deleted = self._conn.execute(
+                    'DELETE FROM answer_cache WHERE index_version != ?', (version,)
+                ).rowcount
+                self._conn.commit()
+                if deleted:
+                    logger.info(f"Invalidated {deleted} cached answers after index rebuild.")
+                self._version = version
+            if generation is not None:
+                self._invalidate_changed(generation, chunk_store)
+            self._generation = generation
+            self._load()
+
+    def _invalidate_changed(self, generation: int, chunk_store: Any) -> None:
+        """Xoá bản ghi của thế hệ cũ hơn `generation` có chunk nguồn đã đổi, bản ghi còn lại được nâng thế hệ."""
+        rows = self._conn.execute(
+            'SELECT id, sources, COALESCE(index_generation, 0) FROM answer_cache '
+            'WHERE index_version = ? AND COALESCE(index_generation, 0) < ?',
+            (self._version, generation)
+        ).fetchall()
+        if not rows:
+            return
+        stale: List[int] = []
+        by_generation: Dict[int, List[Tuple[int, List[str]]]] = {}
+        for entry_id, sources, entry_generation in rows:
+            sources = json.loads(sources) if sources else []
+            if chunk_store is None or not sources:
+                stale.append(entry_id)
+            else:
+                by_generation.setdefault(entry_generation, []).append((entry_id, sources))
+        for entry_generation, entries in by_generation.items():
+            changed = chunk_store.changed_chunk_ids([chunk_id for _, sources in entries for chunk_id in sources],
+                                                    entry_generation)
+            stale += [entry_id for entry_id, sources in entries if changed.intersection(sources)]
+        for start in range(0, len(stale), SQLITE_MAX_VARIABLES):
+            batch = stale[start:start + SQLITE_MAX_VARIABLES]
+            self._conn.execute(f"DELETE FROM answer_cache WHERE id IN ({','.join('?' * len(batch))})", batch)
+        self._conn.execute(
+            'UPDATE answer_cache SET index_generation = ? WHERE index_version = ? AND COALESCE(index_generation, 0) < ?',
+            (generation, self._version, generation)
+        )
+        self._conn.commit()
+        if stale:
+            logger.info(f"Invalidated {len(stale)} of {len(rows)} cached answers whose source chunks changed "
+                        f"before generation {generation}.")
+
+    def _load(self) -> None:
+        """Nạp ma trận embedding còn hạn của phiên bản chỉ mục hiện tại vào bộ nhớ."""
+        rows = self._conn.execute(
+            'SELECT id, embedding FROM answer_cache WHERE index_version = ? AND created_at >= ?',
+            (self._version, time.time() - self.ttl)
+        ).fetchall()
+        self._ids = [row[0] for row in rows]
+        if rows:
+            self._matrix = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        else:
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _refresh_if_stale(self) -> None:
+        # data_version đổi khi một connection khác (process khác) commit vào file
+        if self._conn.execute('PRAGMA data_version').fetchone()[0] != self._data_version:
+            self._load()
+
+    def lookup(self, query_vector: Sequence[float]) -> Optional[Tuple[str, float]]:
+        """Trả về (câu trả lời, độ tương đồng) nếu có câu hỏi đủ giống, ngược lại None."""
+        if self._version is None:
+            return None
+        vector = _normalize_vector(query_vector)
+        with self._lock:
+            self._refresh_if_stale()
+            if not self._ids or self._matrix.shape[1] != vector.shape[0]:
+                return None
+
+            scores = self._matrix @ vector
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                return None
+
+            entry_id = self._ids[best]
+            row = self._conn.execute(
+                'SELECT answer, created_at FROM answer_cache WHERE id = ?', (entry_id,)
+            ).fetchone()
+            now = time.time()
+            if row is None or row[1] < now - self.ttl:
+                self._purge_expired(now)
+                return None
+
+            self._conn.execute(
+                'UPDATE answer_cache SET last_access = ?, hits = hits + 1 WHERE id = ?', (now, entry_id)
+            )
+            self._conn.commit()
+            self._data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            return row[0], similarity
+
+    def put(self, question: str, query_vector: Sequence[float], answer: str, sources: Sequence[str] = ()) -> None:
+        """Lưu câu trả lời mới (`sources`: chunk_id của context), loại bỏ các bản ghi ít được dùng nhất khi vượt giới hạn."""
+        if self._version is None:
+            return
+        vector = _normalize_vector(query_vector)
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute("""
+                INSERT INTO answer_cache (question, embedding, answer, index_version, created_at, last_access,
+                                          sources, index_generation)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (question, vector.tobytes(), answer, self._version, now, now,
+                  json.dumps(list(dict.fromkeys(sources))), self._generation))
+            evicted = self._evict_lru()
+            self._conn.commit()
+
+            if evicted:
+                self._load()
+            elif self._matrix.size and self._matrix.shape[1] == vector.shape[0]:
+                self._matrix = np.vstack([self._matrix, vector])
+                self._ids.append(cursor.lastrowid)
+                self._data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            else:
+                self._load()
+
+    def _evict_lru(self) -> bool:
+        count = self._conn.execute('SELECT COUNT(*) FROM answer_cache').fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute("""
+                DELETE FROM answer_cache WHERE id IN (
+                    SELECT id FROM answer_cache ORDER BY last_access ASC LIMIT ?
+                )
+            """, (overflow,))
+            return True
+        return False
+
+    def _purge_expired(self, now: float) -> None:
+        self._conn.execute('DELETE FROM answer_cache WHERE created_at < ?', (now - self.ttl,))
+        self._conn.commit()
+        self._load()
+
+    def clear(self) -> None:
+        """Xoá toàn bộ cache."""
+        with self._lock:
+            self._conn.execute('DELETE FROM answer_cache')
+            self._conn.commit()
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+def get_answer_cache(db_path: str = ANSWER_CACHE_PATH) -> SemanticAnswerCache:
+    """Cache dùng chung cho mọi session trong process."""
+    from resources import registry
+    return registry.get("answer_cache", os.path.abspath(db_path), lambda: SemanticAnswerCache(db_path))
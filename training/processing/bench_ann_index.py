@@ -0,0 +1,103 @@
+# bench_ann_index.py
+import argparse
+import time
+
+import numpy as np
+
+from config import config
+from embedding_service import get_embedding_service
+from vector_index import create_index, load_index
+
+
+def load_exact_vectors(index_path, embeddings):
+    """Đọc toàn bộ vector từ chỉ mục chính xác (faiss_flat) đang dùng."""
+    index = load_index(index_path, embeddings)
+    if index.backend != 'faiss_flat':
+        raise SystemExit(f"Benchmark needs the exact faiss_flat index as ground truth, found {index.backend}.")
+    return index.export_vectors()[1]
+
+
+def split_queries(vectors, query_count, seed=0):
+    """Tách một tập truy vấn held-out: các vector này không nằm trong chỉ mục được đo."""
+    order = np.random.default_rng(seed).permutation(len(vectors))
+    return vectors[order[query_count:]], vectors[order[:query_count]]
+
+
+def exact_neighbors(base, queries, k):
+    import faiss
+    index = faiss.IndexFlatL2(base.shape[1])
+    index.add(base)
+    return index.search(queries, k)[1]
+
+
+def measure(index, queries, ground_truth, k, **search_params):
+    """Recall@k so với chỉ mục chính xác và độ trễ từng truy vấn (ms)."""
+    latencies, hits = [], 0
+    for query, expected in zip(queries, ground_truth):
+        started_at = time.perf_counter()
+        _, labels = index.search_vectors(query[None, :], k, **search_params)
+        latencies.append((time.perf_counter() - started_at) * 1000)
+        hits += len(set(labels[0].tolist()) & set(expected.tolist()))
+    return hits / (len(queries) * k), float(np.mean(latencies)), float(np.percentile(latencies, 95))
+
+
+def build_index(embeddings, base, **params):
+    # Nhãn là vị trí trong base để so trực tiếp với kết quả chính xác, không ghi chunk store
+    index = create_index(embeddings, 'faiss_ann', **params)
+    index.add_vectors(base, np.arange(len(base)))
+    started_at = time.perf_counter()
+    index.train()
+    return index, time.perf_counter() - started_at
+
+
+def index_size_mb(index):
+    import faiss
+    return faiss.serialize_index(index.faiss_index).nbytes / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo recall@k và độ trễ của chỉ mục IVF/HNSW so với chỉ mục chính xác.")
+    parser.add_argument('--index-path', default=config.vector_db_path, help="Chỉ mục faiss_flat dùng làm ground truth")
+    parser.add_argument('--queries', type=int, default=500, help="Số vector giữ lại làm truy vấn held-out")
+    parser.add_argument('--questions', help="File câu hỏi (mỗi dòng một câu) dùng làm truy vấn thay cho vector held-out")
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--kinds', nargs='+', default=['ivf_flat', 'ivf_pq', 'hnsw'])
+    parser.add_argument('--nlist', type=int, default=256)
+    parser.add_argument('--m', type=int, default=48, help="Số sub-quantizer của IVF-PQ")
+    parser.add_argument('--hnsw-m', type=int, default=32)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[16, 32, 64, 128, 256])
+    args = parser.parse_args()
+
+    embeddings = get_embedding_service()
+    vectors = load_exact_vectors(args.index_path, embeddings)
+    if args.questions:
+        with open(args.questions, 'r', encoding='utf-8') as f:
+            questions = [line.strip() for line in f if line.strip()]
+        base, queries = vectors, embeddings.embed_array(questions)
+    else:
+        base, queries = split_queries(vectors, args.queries)
+    ground_truth = exact_neighbors(base, queries, args.k)
+
+    exact = create_index(embeddings, 'faiss_flat')
+    exact.add_vectors(base, np.arange(len(base)))
+    print(f"{len(base)} vectors, {len(queries)} queries, dim {base.shape[1]}, k={args.k}")
+    print(f"{'index':>10} {'param':>14} {'recall@k':>9} {'mean ms':>9} {'p95 ms':>9} {'train s':>8} {'size MB':>8}")
+    _, mean_ms, p95_ms = measure(exact, queries, ground_truth, args.k)
+    print(f"{'flat':>10} {'-':>14} {1.0:>9.3f} {mean_ms:>9.3f} {p95_ms:>9.3f} {'-':>8} {index_size_mb(exact):>8.1f}")
+
+    for kind in args.kinds:
+        if kind == 'hnsw':
+            index, train_s = build_index(embeddings, base, kind=kind, M=args.hnsw_m)
+            sweep = [('ef_search', value) for value in args.ef_search]
+        else:
+            index, train_s = build_index(embeddings, base, kind=kind, nlist=args.nlist, m=args.m)
+            sweep = [('nprobe', value) for value in args.nprobe if value <= index.params['nlist']]
+        size_mb = index_size_mb(index)
+        for name, value in sweep:
+            recall, mean_ms, p95_ms = measure(index, queries, ground_truth, args.k, **{name: value})
+            print(f"{kind:>10} {f'{name}={value}':>14} {recall:>9.3f} {mean_ms:>9.3f} {p95_ms:>9.3f} {train_s:>8.1f} {size_mb:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
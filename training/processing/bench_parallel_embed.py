@@ -0,0 +1,52 @@
+# bench_parallel_embed.py
+import argparse
+import os
+import sqlite3
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from config import config
+from parallel_embed import ParallelEmbedder
+
+
+def load_sample_chunks(limit):
+    """Lấy mẫu chunk thật từ bảng news để đo tốc độ embedding."""
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50)
+    chunks = []
+    if os.path.exists(config.db_path):
+        with sqlite3.connect(config.db_path) as conn:
+            for (content,) in conn.execute("SELECT content FROM news WHERE content != '' ORDER BY id"):
+                chunks.extend(text_splitter.split_text(content))
+                if len(chunks) >= limit:
+                    break
+    if not chunks:
+        # Không có dữ liệu: dùng văn bản tổng hợp có độ dài tương đương một chunk
+        chunks = [f"Điều {i} Luật Trật tự, an toàn giao thông đường bộ quy định giấy phép lái xe. " * 6 for i in range(limit)]
+    return chunks[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo khả năng mở rộng của pipeline embedding đa tiến trình.")
+    parser.add_argument('--chunks', type=int, default=2048, help="Số chunk dùng để đo")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    chunks = load_sample_chunks(args.chunks)
+    print(f"{len(chunks)} chunks, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'seconds':>10} {'chunks/s':>10} {'speedup':>8} {'efficiency':>10}")
+
+    baseline = None
+    for workers in sorted(set(args.workers)):
+        with ParallelEmbedder(workers=workers) as embedder:
+            embedder.embed_array(chunks[:workers])  # load model trong mọi worker trước khi đo
+            started_at = time.perf_counter()
+            embedder.embed_array(chunks)
+            elapsed = time.perf_counter() - started_at
+        baseline = baseline or elapsed
+        speedup = baseline / elapsed
+        print(f"{workers:>8} {elapsed:>10.2f} {len(chunks) / elapsed:>10.1f} {speedup:>8.2f} {speedup / workers:>10.0%}")
+
+
+if __name__ == '__main__':
+    main()
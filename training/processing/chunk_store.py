@@ -0,0 +1,299 @@
+# chunk_store.py
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence, Set
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Chunk nằm trong news_data.db, chỉ mục vector chỉ giữ vector và id số của chunk
+CHUNK_STORE_PATH = os.getenv('CHUNK_STORE_PATH', os.path.join(BASE_DIR, 'db', 'news_data.db'))
+
+# Giới hạn số tham số trong một câu lệnh SQLite
+SQLITE_MAX_VARIABLES = 900
+
+
+# Cụm tham chiếu điều luật cần khớp nguyên cụm, ví dụ "khoản 5", "điều 57"
+LEGAL_REFERENCE_PATTERN = re.compile(r'\b(điều|khoản|điểm|chương|mục|nghị định|thông tư)\s+(\w+)', re.IGNORECASE)
+
+
+CHUNKS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chunk_id TEXT NOT NULL,
+        news_id INTEGER,
+        "offset" INTEGER,
+        text TEXT NOT NULL,
+        metadata TEXT NOT NULL,
+        generation INTEGER,
+        retired INTEGER,
+        pending TEXT,
+        retiring TEXT
+    )
+"""
+# Chunk của thế hệ đã publish mới nhất
+LIVE_CONDITION = 'generation IS NOT NULL AND retired IS NULL'
+
+
+def fts_query(text: str) -> str:
+    """Chuyển câu hỏi thành biểu thức FTS5: OR các từ, thêm cụm tham chiếu điều luật dạng phrase."""
+    terms = [f'"{" ".join(match)}"' for match in LEGAL_REFERENCE_PATTERN.findall(text.lower())]
+    terms += [f'"{token}"' for token in re.findall(r'\w+', text.lower())]
+    return ' OR '.join(dict.fromkeys(terms))
+
+
+def news_id_of(metadata: dict) -> Optional[int]:
+    """Id bài viết trong bảng news của chunk (doc_id dạng 'news:<id>'), None với chunk từ file."""
+    doc_id = metadata.get('doc_id') or ''
+    return int(doc_id[len('news:'):]) if doc_id.startswith('news:') else None
+
+
+class ChunkStore:
+    """Bảng chunks trong news_data.db: text và metadata của từng chunk, đọc theo id sau khi tìm vector.
+
+    Cột `id` (tăng dần, không tái sử dụng) chính là nhãn của vector trong chỉ mục FAISS,
+    nên thêm hay xoá chunk chỉ là INSERT/UPDATE vài dòng thay vì ghi lại cả docstore.
+    Bảng FTS5 `chunks_fts` (không dấu, xếp hạng bm25) được trigger giữ đồng bộ để tìm theo từ khoá.
+
+    Mọi thế hệ của chỉ mục dùng chung bảng này, nên dòng không bị sửa tại chỗ mà đi theo vòng đời:
+        pending   chunk mới của tiến trình ghi (cột `pending` = token của nó), chưa thế hệ nào dùng
+        published `generation` = thế hệ đầu tiên chứa chunk
+        retiring  bị thay/xoá trong thay đổi chưa publish (cột `retiring` = token), thế hệ hiện tại vẫn dùng
+        retired   `retired` = thế hệ đầu tiên không còn chunk; bị xoá hẳn khi thế hệ trước đó không còn trên đĩa
+    `publish` chuyển các trạng thái trên trong một transaction, sau khi manifest của thế hệ mới đã được đổi.
+    Một chunk_id vì thế có thể có nhiều dòng (bản cũ cho reader thế hệ cũ, bản mới chờ publish).
+
+    Ghi đi qua một kết nối có khoá; đọc dùng kết nối riêng của từng thread (WAL cho phép đọc song song).
+    """
+
+    def __init__(self, db_path: str = CHUNK_STORE_PATH) -> None:
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._migrate()
+        self.fts_enabled = self._create_fts()
+        self._conn.commit()
+
+    def _migrate(self) -> None:
+        """Tạo bảng chunks; bảng của bản cũ (chunk_id UNIQUE, chưa có vòng đời) được chép sang bảng mới."""
+        self._conn.execute('BEGIN IMMEDIATE')
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(chunks)')}
+        if columns and 'generation' not in columns:
+            self._conn.execute(CHUNKS_SCHEMA.format(table='chunks_v2'))
+            # Chunk của bản cũ đều đang được chỉ mục hiện tại dùng: coi như đã publish
+            self._conn.execute("""
+                INSERT INTO chunks_v2 (id, chunk_id, news_id, "offset", text, metadata, generation)
+                SELECT id, chunk_id, news_id, "offset", text, metadata, 0 FROM chunks
+            """)
+            sequence = self._conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'chunks'").fetchone()
+            self._conn.execute('DROP TABLE chunks')
+            self._conn.execute('ALTER TABLE chunks_v2 RENAME TO chunks')
+            if sequence:
+                # Giữ bộ đếm id: nhãn của chunk đã xoá không được cấp lại cho chunk khác
+                self._conn.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = 'chunks'", sequence)
+            logger.info(f"Migrated table chunks in {self.db_path} to generation-scoped rows")
+        else:
+            self._conn.execute(CHUNKS_SCHEMA.format(table='chunks'))
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_chunks_chunk_id ON chunks (chunk_id)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_chunks_news_id ON chunks (news_id)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_chunks_retired ON chunks (retired) WHERE retired IS NOT NULL')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_chunks_pending ON chunks (pending) WHERE pending IS NOT NULL')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_chunks_retiring ON chunks (retiring) WHERE retiring IS NOT NULL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_publish (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                generation INTEGER NOT NULL,
+                token TEXT NOT NULL
+            )
+        """)
+
+    def _create_fts(self) -> bool:
+        exists = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone()
+        try:
+            self._conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                    text, content='chunks', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+                )
+            """)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite FTS5 unavailable, keyword search disabled: {e}")
+            return False
+        self._conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE OF text ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text);
+            END;
+        """)
+        if not exists:
+            # Bảng chunks đã có dữ liệu từ trước: dựng chỉ mục từ khoá một lần
+            self._conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+        return True
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        return conn
+
+    def __len__(self) -> int:
+        """Số chunk của thế hệ đã publish mới nhất."""
+        return self._conn.execute(f'SELECT COUNT(*) FROM chunks WHERE {LIVE_CONDITION}').fetchone()[0]
+
+    def add(self, chunk_ids: Sequence[str], texts: Sequence[str], metadatas: Sequence[dict], token: str) -> List[int]:
+        """Thêm chunk ở trạng thái pending của tiến trình ghi `token`, trả về id (nhãn vector) theo đúng thứ tự."""
+        ids = []
+        with self._lock:
+            for chunk_id, text, metadata in zip(chunk_ids, texts, metadatas):
+                cursor = self._conn.execute(
+                    'INSERT INTO chunks (chunk_id, news_id, "offset", text, metadata, pending) VALUES (?, ?, ?, ?, ?, ?)',
+                    (
+                        chunk_id,
+                        news_id_of(metadata),
+                        metadata.get('start_index'),
+                        text,
+                        json.dumps({**metadata, 'chunk_id': chunk_id}, ensure_ascii=False, default=str),
+                        token,
+                    )
+                )
+                ids.append(cursor.lastrowid)
+            self._conn.commit()
+        return ids
+
+    def labels(self, chunk_ids: Sequence[str], token: str) -> Dict[str, int]:
+        """Tra id (nhãn vector) hiện hành của các chunk_id, nhìn từ tiến trình ghi `token`.
+
+        Gồm chunk đã publish chưa bị thay, trừ chunk `token` đã đánh dấu retiring, cộng chunk pending của `token`.
+        """
+        found: Dict[str, int] = {}
+        chunk_ids = list(chunk_ids)
+        with self._lock:
+            for start in range(0, len(chunk_ids), SQLITE_MAX_VARIABLES):
+                batch = chunk_ids[start:start + SQLITE_MAX_VARIABLES]
+                rows = self._conn.execute(f"""
+                    SELECT chunk_id, id FROM chunks
+                    WHERE chunk_id IN ({','.join('?' * len(batch))})
+                      AND (({LIVE_CONDITION} AND retiring IS NOT ?) OR pending = ?)
+                    ORDER BY id
+                """, [*batch, token, token]).fetchall()
+                found.update(rows)
+        return found
+
+    def retire(self, labels: Sequence[int], token: str) -> None:
+        """Bỏ chunk khỏi thay đổi của `token`: chunk pending của nó xoá luôn, chunk đã publish thành retiring."""
+        labels = [int(label) for label in labels]
+        with self._lock:
+            for start in range(0, len(labels), SQLITE_MAX_VARIABLES):
+                batch = labels[start:start + SQLITE_MAX_VARIABLES]
+                placeholders = ','.join('?' * len(batch))
+                self._conn.execute(f"DELETE FROM chunks WHERE id IN ({placeholders}) AND pending = ?", [*batch, token])
+                self._conn.execute(
+                    f"UPDATE chunks SET retiring = ? WHERE id IN ({placeholders}) AND pending IS NULL", [token, *batch]
+                )
+            self._conn.commit()
+
+    def publish(self, generation: int, token: str, replace_all: bool = False,
+                retained_generation: Optional[int] = None, cleanup: bool = True) -> bool:
+        """Áp dụng thay đổi của `token` sau khi manifest của thế hệ `generation` đã được đổi.
+
+        replace_all: thế hệ được build lại từ đầu, mọi chunk đã publish trước đó đều bị thay.
+        Thế hệ cũ hơn `retained_generation` đã bị dọn khỏi đĩa, nên chunk bị thay từ thế hệ đó
+        trở về trước không còn reader nào đọc và được xoá hẳn. cleanup: xoá chunk pending và bỏ đánh dấu retiring của tiến trình ghi đã chết
+        (chỉ gọi khi giữ writer lock và không còn thay đổi nào khác đang chờ).
+        Gọi lại với cùng token không làm gì; trả về False trong trường hợp đó.
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                published = self._conn.execute('SELECT token FROM chunk_publish WHERE id = 1').fetchone()
+                if published and published[0] == token:
+                    self._conn.commit()
+                    return False
+                if replace_all:
+                    self._conn.execute(
+                        f'UPDATE chunks SET retired = ?, retiring = NULL WHERE {LIVE_CONDITION}', (generation,)
+                    )
+                self._conn.execute(
+                    'UPDATE chunks SET retired = ?, retiring = NULL WHERE retiring = ?', (generation, token)
+                )
+                self._conn.execute(
+                    'UPDATE chunks SET generation = ?, pending = NULL WHERE pending = ?', (generation, token)
+                )
+                if cleanup:
+                    self._conn.execute('DELETE FROM chunks WHERE pending IS NOT NULL')
+                    self._conn.execute('UPDATE chunks SET retiring = NULL WHERE retiring IS NOT NULL')
+                if retained_generation is not None:
+                    # retired > generation: chỉ mục đã bị xoá và đánh số lại từ đầu
+                    self._conn.execute(
+                        'DELETE FROM chunks WHERE retired <= ? OR retired > ?', (retained_generation, generation)
+                    )
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO chunk_publish (id, generation, token) VALUES (1, ?, ?)', (generation, token)
+                )
+            except Exception:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+        return True
+
+    def get(self, ids: Sequence[int]) -> List[Optional[Document]]:
+        """Đọc Document theo id, giữ nguyên thứ tự; id không còn tồn tại trả về None."""
+        ids = [int(chunk_label) for chunk_label in ids]
+        documents: Dict[int, Document] = {}
+        for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+            batch = ids[start:start + SQLITE_MAX_VARIABLES]
+            rows = self._reader().execute(
+                f"SELECT id, text, metadata FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            for chunk_label, text, metadata in rows:
+                documents[chunk_label] = Document(page_content=text, metadata=json.loads(metadata))
+        return [documents.get(chunk_label) for chunk_label in ids]
+
+    def changed_chunk_ids(self, chunk_ids: Sequence[str], generation: int) -> Set[str]:
+        """chunk_id trong `chunk_ids` đã bị thay hoặc xoá ở thế hệ đã publish sau `generation`."""
+        chunk_ids = list(dict.fromkeys(chunk_ids))
+        live: Dict[str, int] = {}
+        for start in range(0, len(chunk_ids), SQLITE_MAX_VARIABLES):
+            batch = chunk_ids[start:start + SQLITE_MAX_VARIABLES]
+            live.update(self._reader().execute(f"""
+                SELECT chunk_id, MAX(generation) FROM chunks
+                WHERE chunk_id IN ({','.join('?' * len(batch))}) AND {LIVE_CONDITION}
+                GROUP BY chunk_id
+            """, batch).fetchall())
+        return {chunk_id for chunk_id in chunk_ids if chunk_id not in live or live[chunk_id] > generation}
+
+    def search_text(self, query: str, limit: int = 20) -> List[Document]:
+        """Tìm chunk theo từ khoá (FTS5, không phân biệt dấu), sắp theo bm25 tốt nhất trước."""
+        match = fts_query(query)
+        if not self.fts_enabled or not match:
+            return []
+        rows = self._reader().execute("""
+            SELECT chunks.text, chunks.metadata
+            FROM chunks_fts JOIN chunks ON chunks.id = chunks_fts.rowid
+            WHERE chunks_fts MATCH ? AND chunks.generation IS NOT NULL AND chunks.retired IS NULL
+            ORDER BY bm25(chunks_fts)
+            LIMIT ?
+        """, (match, limit)).fetchall()
+        return [Document(page_content=text, metadata=json.loads(metadata)) for text, metadata in rows]
+
+
+def get_chunk_store(db_path: str = CHUNK_STORE_PATH) -> ChunkStore:
+    """Chunk store dùng chung cho cả process."""
+    from resources import registry
+    return registry.get("chunk_store", os.path.abspath(db_path), lambda: ChunkStore(db_path))
@@ -0,0 +1,128 @@
+# context_packer.py
+import logging
+import os
+from typing import Any, Dict, List, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+logger = logging.getLogger(__name__)
+
+# Ngân sách token cho phần context trong prompt, đếm bằng tokenizer của chính model
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1024))
+# Chunk bị cắt còn ít hơn số token này thì bỏ hẳn thay vì đưa một mẩu vụn vào prompt
+MIN_CHUNK_TOKENS = int(os.getenv('MIN_CHUNK_TOKENS', 32))
+# Độ dài tối đa (ký tự) dùng để dò phần chồng lấn giữa hai chunk liền kề (splitter dùng overlap 50)
+OVERLAP_SEARCH_CHARS = 200
+MIN_OVERLAP_CHARS = 8
+
+
+def strip_overlap(previous: str, current: str) -> str:
+    """Bỏ phần đầu của `current` trùng với phần cuối của `previous`."""
+    for size in range(min(len(previous), len(current), OVERLAP_SEARCH_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(current[:size]):
+            return current[size:]
+    return current
+
+
+def merge_overlapping(documents: Sequence[Document]) -> List[Document]:
+    """Gộp các chunk liền kề của cùng một tài liệu thành một đoạn, bỏ phần chồng lấn và chunk trùng.
+
+    Đoạn gộp giữ vị trí và metadata của chunk xếp hạng cao nhất trong nó; `chunk_ids` trong metadata
+    liệt kê mọi chunk đã gộp vào đoạn (nguồn của câu trả lời, xem SemanticAnswerCache).
+    """
+    spans: List[Dict[str, Any]] = []
+    seen_texts = set()
+    for document in documents:
+        text = document.page_content
+        if text in seen_texts:
+            continue
+        seen_texts.add(text)
+        doc_id = document.metadata.get('doc_id')
+        start = document.metadata.get('start_index')
+        span = None
+        if doc_id is not None and start is not None:
+            end = start + len(text)
+            for candidate in spans:
+                if candidate['doc_id'] != doc_id:
+                    continue
+                if candidate['start'] <= start <= candidate['end']:
+                    # Chunk nối tiếp phía sau đoạn đã có
+                    if end > candidate['end']:
+                        candidate['text'] += strip_overlap(candidate['text'], text)
+                        candidate['end'] = end
+                    span = candidate
+                    break
+                if start <= candidate['start'] <= end:
+                    # Chunk nằm ngay phía trước đoạn đã có
+                    candidate['text'] = text + strip_overlap(text, candidate['text'])
+                    candidate['start'] = start
+                    candidate['end'] = max(end, candidate['end'])
+                    span = candidate
+                    break
+        if span is None:
+            span = {
+                'doc_id': doc_id,
+                'start': start,
+                'end': None if start is None else start + len(text),
+                'text': text,
+                'metadata': dict(document.metadata),
+                'chunk_ids': [],
+            }
+            spans.append(span)
+        if document.metadata.get('chunk_id'):
+            span['chunk_ids'].append(document.metadata['chunk_id'])
+    return [
+        Document(page_content=span['text'], metadata={**span['metadata'], 'chunk_ids': span['chunk_ids']})
+        for span in spans
+    ]
+
+
+class ContextPacker:
+    """Xếp context vào prompt trong một ngân sách token đếm bằng tokenizer thật của model."""
+
+    def __init__(self, llm: Any, budget_tokens: int = CONTEXT_TOKEN_BUDGET, min_chunk_tokens: int = MIN_CHUNK_TOKENS) -> None:
+        # Chỉ giữ tham chiếu tới LLM: tokenizer được lấy khi cần, không chặn warm-up lúc tạo chuỗi QA
+        self.llm = llm
+        self.budget_tokens = budget_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+
+    def pack(self, documents: Sequence[Document]) -> Tuple[List[Document], Dict[str, Any]]:
+        """Gộp chunk chồng lấn rồi lấy lần lượt theo thứ tự xếp hạng cho tới khi hết ngân sách."""
+        tokenizer = self.llm.tokenizer
+        merged = merge_overlapping(documents)
+        # Một lần gọi tokenizer cho cả lượt (một request khi model chạy trên server suy luận)
+        token_lists = tokenizer.tokenize_many([document.page_content for document in merged], add_bos_token=False)
+        packed, used, truncated = [], 0, 0
+        for document, tokens in zip(merged, token_lists):
+            remaining = self.budget_tokens - used
+            if remaining < self.min_chunk_tokens:
+                break
+            if len(tokens) > remaining:
+                tokens = tokens[:remaining]
+                document = Document(page_content=tokenizer.detokenize(tokens), metadata=document.metadata)
+                truncated += 1
+            packed.append(document)
+            used += len(tokens)
+        stats = {
+            'context_tokens': used,
+            'context_chunks': len(packed),
+            'retrieved_chunks': len(documents),
+            'truncated_chunks': truncated,
+        }
+        return packed, stats
+
+
+class PackedRetriever(BaseRetriever):
+    """Bọc retriever: kết quả được ContextPacker gộp và cắt theo ngân sách token trước khi vào prompt."""
+
+    base_retriever: BaseRetriever
+    packer: Any
+
+    def _get_relevant_documents(self, query: str, *, run_manager: Any) -> List[Document]:
+        documents = self.base_retriever.invoke(query, config={'callbacks': run_manager.get_child()})
+        packed, stats = self.packer.pack(documents)
+        logger.info(f"Packed context: {stats}")
+        for document in packed:
+            document.metadata.update(stats)
+        return packed
@@ -0,0 +1,158 @@
+# conversation_memory.py
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bộ nhớ hội thoại của mỗi session, cấu hình qua .env
+# Ngân sách token cho các lượt gần nhất được giữ nguyên văn
+MEMORY_WINDOW_TOKENS = int(os.getenv('MEMORY_WINDOW_TOKENS', 512))
+# Ngân sách token cho bản tóm tắt các lượt cũ hơn
+MEMORY_SUMMARY_TOKENS = int(os.getenv('MEMORY_SUMMARY_TOKENS', 256))
+# Số tin nhắn tối đa giữ trong lịch sử hiển thị của một session
+MEMORY_MAX_MESSAGES = int(os.getenv('MEMORY_MAX_MESSAGES', 40))
+# Câu trả lời được cắt còn chừng này ký tự khi đưa vào bộ nhớ
+TURN_ANSWER_CHARS = 600
+
+# Prompt bắt đầu bằng system prompt cố định của trang chat (`prefix`) để dùng lại KV cache đã prime của nó
+CONDENSE_TEMPLATE = """{prefix}Nhiệm vụ: dựa vào tóm tắt và các lượt hội thoại trước, viết lại câu hỏi cuối cùng của người dùng thành một câu hỏi độc lập, đầy đủ ngữ cảnh. Chỉ trả về câu hỏi, không trả lời nó.\n
+{history}\nuser\n{question}\nassistant"""
+
+SUMMARY_TEMPLATE = """{prefix}Nhiệm vụ: tóm tắt ngắn gọn cuộc hội thoại sau, giữ lại chủ đề, điều luật, mức phạt và con số quan trọng.\n
+user\n{history}\nassistant"""
+
+# Đại từ, từ chỉ định và cách mở đầu câu hỏi tiếp nối ("còn xe máy thì sao?") cần lịch sử mới hiểu được
+REFERENCE_PATTERN = re.compile(
+    r"(?:^|\W)(?:nó|họ|đó|đấy|này|kia|ấy|vậy|nữa|như trên|ở trên|vừa rồi|trước đó|thì sao)(?=\W|$)"
+    r"|^\W*(?:còn|và|thế còn|vậy còn)(?=\W|$)",
+    re.IGNORECASE,
+)
+# Câu hỏi chỉ vài từ ("mức phạt?") thường lược bỏ chủ ngữ đã nói ở lượt trước
+ELLIPTIC_QUESTION_WORDS = 3
+
+
+def refers_back(question: str) -> bool:
+    """Câu hỏi có nhắc lại lượt trước (đại từ, từ chỉ định, câu tỉnh lược) hay không."""
+    return bool(REFERENCE_PATTERN.search(question)) or len(question.split()) <= ELLIPTIC_QUESTION_WORDS
+
+
+@dataclass
+class Turn:
+    question: str
+    answer: str
+    tokens: int
+
+    def render(self) -> str:
+        return f"user: {self.question}\nassistant: {self.answer}"
+
+
+class ConversationMemory:
+    """Bộ nhớ hội thoại có giới hạn: cửa sổ các lượt gần nhất (theo token) cộng một bản tóm tắt chạy.
+
+    Lượt bị đẩy ra khỏi cửa sổ được gộp vào bản tóm tắt ở luồng nền sau khi trả lời xong,
+    nên kích thước prompt viết lại câu hỏi không tăng theo độ dài session.
+    """
+
+    def __init__(self, window_tokens: int = MEMORY_WINDOW_TOKENS, summary_tokens: int = MEMORY_SUMMARY_TOKENS) -> None:
+        self.window_tokens = window_tokens
+        self.summary_tokens = summary_tokens
+        self.turns: Deque[Turn] = deque()
+        self.summary = ""
+        self._evicted: List[Turn] = []
+        self._lock = threading.Lock()
+        # Các lần tóm tắt nối tiếp nhau, lần sau dựa trên kết quả của lần trước
+        self._summarizing = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return bool(self.turns or self.summary)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.turns.clear()
+            self.summary = ""
+            self._evicted = []
+
+    def history(self) -> str:
+        """Tóm tắt và các lượt trong cửa sổ dưới dạng văn bản cho prompt."""
+        with self._lock:
+            parts = [f"Tóm tắt: {self.summary}"] if self.summary else []
+            parts += [turn.render() for turn in self.turns]
+        return "\n".join(parts)
+
+    def add_turn(self, question: str, answer: str, llm: Any) -> None:
+        """Thêm một lượt hỏi đáp; các lượt cũ vượt ngân sách token được chờ tóm tắt."""
+        answer = answer.strip()
+        if len(answer) > TURN_ANSWER_CHARS:
+            answer = answer[:TURN_ANSWER_CHARS].rsplit(' ', 1)[0] + " ..."
+        turn = Turn(question=question, answer=answer, tokens=0)
+        turn.tokens = llm.get_num_tokens(turn.render())
+        with self._lock:
+            self.turns.append(turn)
+            total = sum(item.tokens for item in self.turns)
+            # Luôn giữ lượt mới nhất dù riêng nó đã vượt ngân sách
+            while total > self.window_tokens and len(self.turns) > 1:
+                evicted = self.turns.popleft()
+                self._evicted.append(evicted)
+                total -= evicted.tokens
+
+    def condense(self, question: str, llm: Any, prefix: str = "") -> Tuple[str, Dict[str, Any]]:
+        """Viết lại câu hỏi tiếp nối thành câu hỏi độc lập để tìm kiếm.
+
+        Không có lịch sử, hoặc câu hỏi không nhắc tới lượt trước, thì giữ nguyên và không gọi LLM.
+        """
+        if not self or not refers_back(question):
+            return question, {}
+        started_at = time.perf_counter()
+        try:
+            standalone = llm.invoke(CONDENSE_TEMPLATE.format(prefix=prefix, history=self.history(), question=question))
+            standalone = standalone.strip().splitlines()[0].strip() if standalone.strip() else ""
+        except Exception as e:
+            logger.error(f"Failed to condense follow-up question: {e}")
+            standalone = ""
+        # Kết quả rỗng hoặc dài bất thường (model trả lời luôn) thì dùng câu hỏi gốc
+        if not standalone or len(standalone) > 4 * len(question) + 200:
+            standalone = question
+        return standalone, {'condense_ms': round((time.perf_counter() - started_at) * 1000, 2)}
+
+    def summarize(self, llm: Any, prefix: str = "") -> None:
+        """Gộp các lượt đã rời cửa sổ vào bản tóm tắt, giữ nó trong ngân sách token."""
+        with self._summarizing:
+            self._summarize(llm, prefix)
+
+    def _summarize(self, llm: Any, prefix: str) -> None:
+        with self._lock:
+            evicted, self._evicted = self._evicted, []
+            summary = self.summary
+        if not evicted:
+            return
+        history = "\n".join(([f"Tóm tắt: {summary}"] if summary else []) + [turn.render() for turn in evicted])
+        try:
+            summary = llm.invoke(SUMMARY_TEMPLATE.format(prefix=prefix, history=history)).strip()
+        except Exception as e:
+            logger.error(f"Failed to summarize conversation: {e}")
+            # Không tóm tắt được: giữ lại các câu hỏi cũ làm tóm tắt tối thiểu
+            summary = " ".join([summary] + [turn.question for turn in evicted]).strip()
+        while summary and llm.get_num_tokens(summary) > self.summary_tokens:
+            # Bỏ dần phần đầu (cũ nhất) cho tới khi vừa ngân sách
+            summary = summary[max(1, len(summary) // 4):].split(' ', 1)[-1]
+        with self._lock:
+            self.summary = summary
+
+    def summarize_async(self, llm: Any, prefix: str = "") -> None:
+        """Tóm tắt ở luồng nền, ngoài đường đi của câu trả lời."""
+        with self._lock:
+            if not self._evicted:
+                return
+        threading.Thread(target=self.summarize, args=(llm, prefix), name='memory-summary', daemon=True).start()
+
+
+def cap_messages(messages: List[Dict[str, Any]], limit: int = MEMORY_MAX_MESSAGES) -> None:
+    """Chỉ giữ `limit` tin nhắn gần nhất trong lịch sử hiển thị (sửa tại chỗ)."""
+    if len(messages) > limit:
+        del messages[:len(messages) - limit]
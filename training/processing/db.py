@@ -27,6 +27,7 @@ class News(Base):
     hash = Column(String, nullable=False, unique=True)  # Unique per article
     title = Column(String, nullable=False)
     content = Column(String, nullable=False)
+    preview = Column(String, nullable=True)  # Filled by a trigger (news_repository.py)
 
     __table_args__ = (
         Index('idx_hash', 'hash'),
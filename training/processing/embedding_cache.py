@@ -0,0 +1,185 @@
+# embedding_cache.py
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Cache embedding nằm cạnh news_data.db, giới hạn dung lượng cấu hình qua .env
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', os.path.join(BASE_DIR, 'db', 'embedding_cache.db'))
+EMBEDDING_CACHE_MAX_MB = float(os.getenv('EMBEDDING_CACHE_MAX_MB', 1024))
+
+# Khi vượt giới hạn, xoá bớt các vector lâu không dùng cho tới khi còn tỉ lệ này
+EVICT_TARGET_RATIO = 0.9
+SQLITE_MAX_VARIABLES = 900
+
+
+def chunk_key(model_id: str, text: str) -> str:
+    """Khoá cache: hash của model id và nội dung chunk."""
+    return hashlib.sha1(f"{model_id}\0{text}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Cache vector float32 trên đĩa (SQLite BLOB), có đếm dung lượng và loại bỏ theo LRU."""
+
+    def __init__(self, db_path: str = EMBEDDING_CACHE_PATH, max_bytes: Optional[int] = None) -> None:
+        self.db_path = db_path
+        self.max_bytes = max_bytes if max_bytes is not None else int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model_id TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings (last_access)')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_bytes INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            INSERT OR IGNORE INTO cache_stats (id, total_bytes)
+            SELECT 1, COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings
+        """)
+        self._conn.commit()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._conn.execute('SELECT total_bytes FROM cache_stats WHERE id = 1').fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Lấy các vector có trong cache, cập nhật thời điểm truy cập cho LRU."""
+        found: Dict[str, np.ndarray] = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                batch = list(keys[start:start + SQLITE_MAX_VARIABLES])
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+                if rows:
+                    self._conn.execute(
+                        f'UPDATE embeddings SET last_access = ? WHERE key IN ({placeholders})', [now, *batch]
+                    )
+            self._conn.commit()
+        return found
+
+    def put_many(self, model_id: str, items: Dict[str, np.ndarray]) -> None:
+        """Lưu các vector mới rồi loại bỏ bớt nếu vượt giới hạn dung lượng."""
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (key, model_id, int(vector.shape[0]), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in items.items()
+        ]
+        with self._lock:
+            added_bytes = 0
+            for row in rows:
+                cursor = self._conn.execute("""
+                    INSERT OR IGNORE INTO embeddings (key, model_id, dim, vector, last_access)
+                    VALUES (?, ?, ?, ?, ?)
+                """, row)
+                if cursor.rowcount:
+                    added_bytes += len(row[3])
+            self._conn.execute('UPDATE cache_stats SET total_bytes = total_bytes + ? WHERE id = 1', (added_bytes,))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        total = self.total_bytes
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * EVICT_TARGET_RATIO)
+        freed, evicted = 0, 0
+        rows = self._conn.execute('SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_access ASC')
+        victims = []
+        for key, size in rows:
+            if total - freed <= target:
+                break
+            victims.append((key,))
+            freed += size
+            evicted += 1
+        self._conn.executemany('DELETE FROM embeddings WHERE key = ?', victims)
+        self._conn.execute('UPDATE cache_stats SET total_bytes = total_bytes - ? WHERE id = 1', (freed,))
+        logger.info(f"Embedding cache evicted {evicted} vectors ({freed / 1024 / 1024:.1f} MB).")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM embeddings')
+            self._conn.execute('UPDATE cache_stats SET total_bytes = 0 WHERE id = 1')
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """Bọc dịch vụ embedding: chunk nào đã có vector trong cache thì không embed lại."""
+
+    def __init__(self, embeddings, cache: EmbeddingCache) -> None:
+        self.embeddings = embeddings
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def model_id(self) -> str:
+        return self.embeddings.model_id
+
+    def embed_array(self, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        keys = [chunk_key(self.model_id, text) for text in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        missing = list(dict.fromkeys(
+            (key, text) for key, text in zip(keys, texts) if key not in found
+        ))
+        if missing:
+            vectors = self.embeddings.embed_array([text for _, text in missing])
+            new_items = {key: vector for (key, _), vector in zip(missing, vectors)}
+            self.cache.put_many(self.model_id, new_items)
+            found.update(new_items)
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return np.vstack([found[key] for key in keys])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        # Câu hỏi hiếm khi lặp lại nguyên văn, không đưa vào cache
+        return self.embeddings.embed_query(text)
+
+
+def get_cached_embeddings(embeddings=None, db_path: str = EMBEDDING_CACHE_PATH) -> CachedEmbeddings:
+    """Dịch vụ embedding có cache, dùng chung cho cả process."""
+    from resources import registry
+    from embedding_service import get_embedding_service
+
+    cache = registry.get("embedding_cache", os.path.abspath(db_path), lambda: EmbeddingCache(db_path))
+    return CachedEmbeddings(embeddings or get_embedding_service(), cache)
@@ -0,0 +1,196 @@
+# embedding_service.py
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence, Tuple, Type
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# Model embedding duy nhất cho cả ingest lẫn truy vấn, cấu hình qua .env
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'gpt4all')
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2.gguf2.f16.gguf')
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', 5))
+EMBEDDING_MAX_BATCH = int(os.getenv('EMBEDDING_MAX_BATCH', 64))
+
+INDEX_METADATA_FILE = 'embedding.json'
+
+
+class EmbeddingBackend(ABC):
+    """Backend tính embedding cho một danh sách văn bản, trả về ma trận float32."""
+
+    name = ''
+
+    def __init__(self, model_name: str) -> None:
+        self.model_name = model_name
+
+    @property
+    def model_id(self) -> str:
+        return f"{self.name}:{self.model_name}"
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embedding của các văn bản, mỗi dòng một vector."""
+
+
+class GPT4AllBackend(EmbeddingBackend):
+    """GPT4All (all-MiniLM-L6-v2), model mặc định mà chỉ mục hiện tại được build."""
+
+    name = 'gpt4all'
+
+    def __init__(self, model_name: str) -> None:
+        super().__init__(model_name)
+        from langchain_community.embeddings import GPT4AllEmbeddings
+        self._model = GPT4AllEmbeddings(model_name=model_name, gpt4all_kwargs={'allow_download': True})
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self._model.embed_documents(texts), dtype=np.float32)
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """SentenceTransformer, ví dụ bi-encoder pháp luật tiếng Việt."""
+
+    name = 'sentence_transformers'
+
+    def __init__(self, model_name: str) -> None:
+        super().__init__(model_name)
+        from sentence_transformers import SentenceTransformer
+        self._model = SentenceTransformer(model_name)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(
+            self._model.encode(texts, batch_size=len(texts), convert_to_numpy=True),
+            dtype=np.float32
+        )
+
+
+BACKENDS: Dict[str, Type[EmbeddingBackend]] = {
+    GPT4AllBackend.name: GPT4AllBackend,
+    SentenceTransformerBackend.name: SentenceTransformerBackend,
+}
+
+
+def create_backend(backend: str = EMBEDDING_BACKEND, model_name: str = EMBEDDING_MODEL) -> EmbeddingBackend:
+    """Tạo backend theo tên đã đăng ký trong BACKENDS."""
+    try:
+        backend_cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {sorted(BACKENDS)}")
+    return backend_cls(model_name)
+
+
+class EmbeddingService(Embeddings):
+    """Dịch vụ embedding dùng chung, gom các yêu cầu đồng thời thành một batch.
+
+    Mọi lời gọi được đưa vào hàng đợi; một worker thread chờ tối đa
+    `batch_window_ms` để gom thêm yêu cầu rồi embed tất cả thành một ma trận.
+    """
+
+    def __init__(
+        self,
+        backend: EmbeddingBackend,
+        batch_window_ms: float = EMBEDDING_BATCH_WINDOW_MS,
+        max_batch_size: int = EMBEDDING_MAX_BATCH,
+    ) -> None:
+        self.backend = backend
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='embedding-service', daemon=True)
+        self._worker.start()
+
+    @property
+    def model_id(self) -> str:
+        return self.backend.model_id
+
+    def _run(self) -> None:
+        while True:
+            pending = [self._queue.get()]
+            size = len(pending[0][0])
+            deadline = time.perf_counter() + self.batch_window
+            while size < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+            self._process(pending)
+
+    def _process(self, pending: List[Tuple[List[str], Future]]) -> None:
+        texts = [text for item_texts, _ in pending for text in item_texts]
+        try:
+            vectors = self._embed_batches(texts)
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+
+        offset = 0
+        for item_texts, future in pending:
+            future.set_result(vectors[offset:offset + len(item_texts)])
+            offset += len(item_texts)
+
+    def _embed_batches(self, texts: List[str]) -> np.ndarray:
+        batches = [
+            self.backend.embed(texts[start:start + self.max_batch_size])
+            for start in range(0, len(texts), self.max_batch_size)
+        ]
+        return np.vstack(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+
+    def embed_array(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed và trả về ma trận float32 (n, dim)."""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        future: Future = Future()
+        self._queue.put((texts, future))
+        return future.result()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+
+def get_embedding_service(backend: str = EMBEDDING_BACKEND, model_name: str = EMBEDDING_MODEL) -> EmbeddingService:
+    """Dịch vụ embedding dùng chung cho cả process."""
+    from resources import registry
+    return registry.get(
+        "embedding_service",
+        (backend, model_name),
+        lambda: EmbeddingService(create_backend(backend, model_name))
+    )
+
+
+def read_index_model_id(index_path: str) -> Optional[str]:
+    """Đọc model embedding của chỉ mục (manifest, hoặc embedding.json của chỉ mục cũ)."""
+    for file_name in ('manifest.json', INDEX_METADATA_FILE):
+        metadata_path = os.path.join(index_path, file_name)
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('model_id')
+    return None
+
+
+def check_index_model_id(index_path: str, model_id: str) -> None:
+    """Đảm bảo embedding truy vấn và embedding tài liệu cùng một model."""
+    index_model_id = read_index_model_id(index_path)
+    if index_model_id is None:
+        logger.warning(f"Index at {index_path} has no recorded embedding model; assuming {model_id}.")
+    elif index_model_id != model_id:
+        raise ValueError(
+            f"Index at {index_path} was built with '{index_model_id}' but queries use '{model_id}'. "
+            f"Rebuild the index or set EMBEDDING_BACKEND/EMBEDDING_MODEL to match."
+        )
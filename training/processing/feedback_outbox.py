@@ -0,0 +1,273 @@
+# feedback_outbox.py
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Hàng đợi phản hồi nằm cùng bảng news trong news_data.db
+FEEDBACK_DB_PATH = os.getenv('FEEDBACK_DB_PATH', os.path.join(BASE_DIR, 'db', 'news_data.db'))
+FEEDBACK_INDEX_PATH = os.path.join(BASE_DIR, 'data', 'vectorstores', 'db_faiss')
+# Chờ thêm chừng này giây sau phản hồi đầu tiên để gom các phản hồi tới liên tiếp vào một lô
+FEEDBACK_BATCH_WINDOW_SECONDS = float(os.getenv('FEEDBACK_BATCH_WINDOW_SECONDS', 2))
+FEEDBACK_MAX_BATCH = int(os.getenv('FEEDBACK_MAX_BATCH', 64))
+# Chu kỳ quét lại hàng đợi (phản hồi do process khác ghi, hoặc còn sót sau khi khởi động lại)
+FEEDBACK_POLL_SECONDS = 30
+FEEDBACK_MAX_ATTEMPTS = 3
+# Giá trị cột url của bài viết đến từ phản hồi người dùng
+FEEDBACK_URL = 'feedback://reinforcement'
+
+
+def feedback_hash(title: str, content: str) -> str:
+    """Hash của một phản hồi (cột hash của news là UNIQUE): gửi lại cùng nội dung không tạo bài trùng."""
+    return hashlib.sha1(f"{FEEDBACK_URL}\n{title}\n{content}".encode('utf-8')).hexdigest()
+
+
+class FeedbackOutbox:
+    """Bảng outbox `feedback_outbox` trong news_data.db: mỗi phản hồi là một bài trong news kèm một dòng chờ index.
+
+    Bài viết và dòng outbox được ghi trong cùng một transaction nên phản hồi đã lưu không bao giờ bị
+    bỏ sót khi index; trạng thái: queued -> indexed, hoặc failed sau FEEDBACK_MAX_ATTEMPTS lần lỗi.
+    """
+
+    def __init__(self, db_path: str = FEEDBACK_DB_PATH) -> None:
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Cùng lược đồ với model News (db.py) khi trang chạy trước crawler
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS news (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url VARCHAR NOT NULL,
+                    hash VARCHAR NOT NULL UNIQUE,
+                    title VARCHAR NOT NULL,
+                    content VARCHAR NOT NULL,
+                    preview VARCHAR
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS feedback_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    news_id INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    indexed_at REAL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_feedback_outbox_status ON feedback_outbox (status, id)')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def enqueue(self, title: str, content: str) -> Tuple[int, bool]:
+        """Lưu phản hồi thành bài viết mới và xếp nó vào hàng đợi index.
+
+        Trả về (id dòng outbox, True nếu là phản hồi mới); phản hồi trùng trả về dòng outbox đã có.
+        """
+        digest = feedback_hash(title, content)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO news (url, hash, title, content) VALUES (?, ?, ?, ?)',
+                (FEEDBACK_URL, digest, title, content)
+            )
+            if cursor.rowcount:
+                outbox_id = conn.execute(
+                    'INSERT INTO feedback_outbox (news_id, created_at) VALUES (?, ?)', (cursor.lastrowid, time.time())
+                ).lastrowid
+                return outbox_id, True
+            row = conn.execute("""
+                SELECT feedback_outbox.id FROM feedback_outbox JOIN news ON news.id = feedback_outbox.news_id
+                WHERE news.hash = ? ORDER BY feedback_outbox.id DESC LIMIT 1
+            """, (digest,)).fetchone()
+        return (row[0] if row else 0), False
+
+    def pending(self, limit: int = FEEDBACK_MAX_BATCH) -> List[Tuple[int, int, str, str]]:
+        """Các phản hồi đang chờ: (id outbox, id bài viết, tiêu đề, nội dung), cũ nhất trước."""
+        with self._connect() as conn:
+            return conn.execute("""
+                SELECT feedback_outbox.id, news.id, news.title, news.content
+                FROM feedback_outbox JOIN news ON news.id = feedback_outbox.news_id
+                WHERE feedback_outbox.status = 'queued'
+                ORDER BY feedback_outbox.id
+                LIMIT ?
+            """, (limit,)).fetchall()
+
+    def mark_indexed(self, outbox_ids: Sequence[int]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE feedback_outbox SET status = 'indexed', indexed_at = ?, error = NULL WHERE id = ?",
+                [(time.time(), outbox_id) for outbox_id in outbox_ids]
+            )
+
+    def mark_failed(self, outbox_ids: Sequence[int], error: str) -> None:
+        """Ghi lỗi; phản hồi được thử lại ở lô sau cho tới FEEDBACK_MAX_ATTEMPTS lần."""
+        with self._connect() as conn:
+            conn.executemany("""
+                UPDATE feedback_outbox
+                SET attempts = attempts + 1, error = ?,
+                    status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'queued' END
+                WHERE id = ?
+            """, [(error, FEEDBACK_MAX_ATTEMPTS, outbox_id) for outbox_id in outbox_ids])
+
+    def status(self, outbox_ids: Sequence[int]) -> Dict[int, Dict[str, Any]]:
+        """Trạng thái của các phản hồi theo id outbox."""
+        outbox_ids = list(outbox_ids)
+        if not outbox_ids:
+            return {}
+        with self._connect() as conn:
+            rows = conn.execute(f"""
+                SELECT feedback_outbox.id, news.title, feedback_outbox.status, feedback_outbox.error,
+                       feedback_outbox.created_at, feedback_outbox.indexed_at
+                FROM feedback_outbox JOIN news ON news.id = feedback_outbox.news_id
+                WHERE feedback_outbox.id IN ({','.join('?' * len(outbox_ids))})
+            """, outbox_ids).fetchall()
+        return {
+            row[0]: {'title': row[1], 'status': row[2], 'error': row[3], 'created_at': row[4], 'indexed_at': row[5]}
+            for row in rows
+        }
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute('SELECT status, COUNT(*) FROM feedback_outbox GROUP BY status').fetchall()
+        return {'queued': 0, 'indexed': 0, 'failed': 0, **dict(rows)}
+
+
+def feedback_chunks(rows: Sequence[Tuple[int, int, str, str]]) -> List[Document]:
+    """Chia bài viết phản hồi thành chunk giống vectordb.py: doc_id 'news:<id>', chunk_id '<doc_id>#<thứ tự>'.
+
+    Cùng chunk_id với lần chạy vectordb.py sau đó, nên bài được index lại thay thế chứ không nhân đôi.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50, add_start_index=True)
+    chunks = []
+    for _, news_id, title, content in rows:
+        doc_id = f"news:{news_id}"
+        document = Document(
+            page_content=content.strip(),
+            metadata={
+                'doc_id': doc_id,
+                'source': FEEDBACK_URL,
+                'title': title,
+                'content_hash': hashlib.sha1(content.strip().encode('utf-8')).hexdigest(),
+            }
+        )
+        for i, chunk in enumerate(text_splitter.split_documents([document])):
+            chunk.metadata['chunk_id'] = f"{doc_id}#{i}"
+            chunks.append(chunk)
+    return chunks
+
+
+class FeedbackIndexer:
+    """Một worker nền duy nhất trong process: gom phản hồi đang chờ thành lô, embed một lần và thêm vào chỉ mục.
+
+    Với chỉ mục FAISS, mỗi lô được ghi thành một delta segment (chi phí theo số chunk mới, không
+    ghi lại cả chỉ mục); khi delta vượt ngưỡng LSM_*, worker gộp chúng vào base ngay trên luồng nền.
+    Mọi thao tác chạy dưới khoá ghi của chỉ mục nên không đè lên lần chạy vectordb.py hay bộ index
+    của process khác; phản hồi được lấy ra bên trong khoá nên không bị index hai lần.
+    """
+
+    def __init__(self, outbox: FeedbackOutbox, index_path: str = FEEDBACK_INDEX_PATH,
+                 batch_window: float = FEEDBACK_BATCH_WINDOW_SECONDS) -> None:
+        self.outbox = outbox
+        self.index_path = index_path
+        self.batch_window = batch_window
+        self.last_error: Optional[str] = None
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='feedback-indexer', daemon=True)
+        self._thread.start()
+
+    def notify(self) -> None:
+        """Báo có phản hồi mới trong outbox."""
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(FEEDBACK_POLL_SECONDS)
+            if self._wakeup.is_set():
+                # Gom thêm các phản hồi tới ngay sau đó vào cùng một lô
+                time.sleep(self.batch_window)
+            self._wakeup.clear()
+            try:
+                while self.index_pending():
+                    pass
+            except Exception as e:
+                logger.error(f"Feedback indexer failed: {e}")
+
+    def index_pending(self) -> int:
+        """Index một lô phản hồi đang chờ; trả về số phản hồi đã xử lý."""
+        from embedding_cache import get_cached_embeddings
+        from embedding_service import check_index_model_id
+        from vector_index import (BACKENDS, FaissFlatIndex, append_segment, compact_index, index_exists,
+                                  load_or_create_index, needs_compaction, read_manifest, writer_lock)
+
+        if not self.outbox.pending(limit=1):
+            return 0
+        with writer_lock(self.index_path):
+            rows = self.outbox.pending()
+            if not rows:
+                return 0
+            outbox_ids = [row[0] for row in rows]
+            started_at = time.perf_counter()
+            try:
+                chunks = feedback_chunks(rows)
+                embeddings = get_cached_embeddings()
+                if index_exists(self.index_path):
+                    check_index_model_id(self.index_path, embeddings.model_id)
+                texts = [chunk.page_content for chunk in chunks]
+                metadatas = [chunk.metadata for chunk in chunks]
+                ids = [chunk.metadata['chunk_id'] for chunk in chunks]
+                manifest = read_manifest(self.index_path)
+                # Một lần embed cho cả lô; chỉ mục FAISS nhận một delta segment thay vì một thế hệ mới
+                if manifest is not None and issubclass(BACKENDS[manifest['backend']], FaissFlatIndex):
+                    append_segment(self.index_path, embeddings, texts, metadatas=metadatas, ids=ids)
+                else:
+                    db = load_or_create_index(self.index_path, embeddings)
+                    try:
+                        db.add_texts(texts, metadatas=metadatas, ids=ids)
+                        db.save(self.index_path)
+                    finally:
+                        db.close()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Failed to index {len(rows)} feedback items: {e}")
+                self.outbox.mark_failed(outbox_ids, str(e))
+                return 0
+            self.outbox.mark_indexed(outbox_ids)
+            logger.info(
+                f"Indexed {len(rows)} feedback items ({len(chunks)} chunks) "
+                f"in {(time.perf_counter() - started_at) * 1000:.0f} ms"
+            )
+            if needs_compaction(read_manifest(self.index_path)):
+                try:
+                    compact_index(self.index_path, embeddings)
+                except Exception as e:
+                    # Delta vẫn dùng được; lần sau (hoặc vectordb.py --compact) sẽ gộp lại
+                    logger.error(f"Failed to compact {self.index_path}: {e}")
+        self.last_error = None
+        return len(rows)
+
+
+def get_feedback_outbox(db_path: str = FEEDBACK_DB_PATH) -> FeedbackOutbox:
+    from resources import registry
+    return registry.get("feedback_outbox", os.path.abspath(db_path), lambda: FeedbackOutbox(db_path))
+
+
+def get_feedback_indexer(db_path: str = FEEDBACK_DB_PATH, index_path: str = FEEDBACK_INDEX_PATH) -> FeedbackIndexer:
+    """Worker index phản hồi dùng chung cho cả process (khởi động ở lần gọi đầu tiên)."""
+    from resources import registry
+    return registry.get(
+        "feedback_indexer",
+        os.path.abspath(index_path),
+        lambda: FeedbackIndexer(get_feedback_outbox(db_path), index_path)
+    )
@@ -0,0 +1,110 @@
+# hybrid_search.py
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+logger = logging.getLogger(__name__)
+
+# Kết hợp tìm theo từ khoá (FTS5/bm25) với tìm vector, cấu hình qua .env
+HYBRID_SEARCH = os.getenv('HYBRID_SEARCH', '1') == '1'
+# Số ứng viên lấy từ mỗi nhánh trước khi hợp nhất
+HYBRID_FETCH_K = int(os.getenv('HYBRID_FETCH_K', 20))
+# Hằng số k của Reciprocal Rank Fusion
+RRF_K = int(os.getenv('RRF_K', 60))
+
+# Hai nhánh của mọi truy vấn chạy song song trên pool dùng chung cho cả process
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='hybrid-search')
+
+
+def document_key(document: Document) -> str:
+    return document.metadata.get('chunk_id') or document.page_content
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Document]], rrf_k: int = RRF_K) -> List[Document]:
+    """Hợp nhất nhiều danh sách xếp hạng: điểm = tổng 1 / (rrf_k + hạng) trên các danh sách."""
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            key = document_key(document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            documents.setdefault(key, document)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    for key in ordered:
+        documents[key].metadata['rrf_score'] = round(scores[key], 6)
+    return [documents[key] for key in ordered]
+
+
+class HybridRetriever(BaseRetriever):
+    """Retriever lai: nhánh vector (VectorIndex) và nhánh từ khoá (FTS5 trên ChunkStore) chạy song song,
+    kết quả được hợp nhất bằng Reciprocal Rank Fusion.
+
+    Nhánh từ khoá bắt được các cụm chính xác như "khoản 5 Điều 57" mà embedding MiniLM làm mờ.
+    """
+
+    index: Any
+    chunk_store: Any
+    k: int = 5
+    fetch_k: int = HYBRID_FETCH_K
+    rrf_k: int = RRF_K
+    search_kwargs: dict = {}
+
+    def _vector_search(self, query: str) -> List[Document]:
+        vector = self.index.embeddings.embed_query(query)
+        hits = self.index.similarity_search_with_score_by_vector(vector, self.fetch_k, **self.search_kwargs)
+        return [document for document, _ in hits]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: Any) -> List[Document]:
+        started_at = time.perf_counter()
+        vector_future = _executor.submit(self._vector_search, query)
+        lexical_future = _executor.submit(self.chunk_store.search_text, query, self.fetch_k)
+        vector_hits = vector_future.result()
+        try:
+            lexical_hits = lexical_future.result()
+        except Exception as e:
+            # Câu hỏi có cú pháp FTS5 lạ không được làm hỏng cả truy vấn: dùng riêng nhánh vector
+            logger.warning(f"Keyword search failed, using vector results only: {e}")
+            lexical_hits = []
+        documents = reciprocal_rank_fusion([vector_hits, lexical_hits], self.rrf_k)[:self.k]
+        logger.debug(
+            f"Hybrid search: {len(vector_hits)} vector + {len(lexical_hits)} keyword hits "
+            f"in {(time.perf_counter() - started_at) * 1000:.1f} ms"
+        )
+        return documents
+
+
+def create_retriever(index: Any, k: int = 5, search_kwargs: Optional[dict] = None,
+                     hybrid: bool = HYBRID_SEARCH, rerank: Optional[bool] = None) -> BaseRetriever:
+    """Retriever cho chuỗi QA: lai (vector + từ khoá) nếu bật HYBRID_SEARCH, ngược lại chỉ vector.
+
+    Tìm từ khoá chạy trên chunk store của chính chỉ mục; chỉ mục không có (Chroma) chỉ dùng vector.
+
+    Khi bật rerank (mặc định theo RERANK_ENABLED), lấy RERANK_TOP_N ứng viên rồi để cross-encoder giữ lại k.
+    """
+    from reranker import RERANK_ENABLED, RERANK_TOP_N, RerankRetriever, get_reranker
+
+    rerank = RERANK_ENABLED if rerank is None else rerank
+    fetch = max(k, RERANK_TOP_N) if rerank else k
+    chunk_store = getattr(index, 'chunk_store', None)
+    if hybrid and chunk_store is None:
+        # Chỉ mục giữ text ở nơi khác (Chroma): bảng chunks dùng chung không phải của nó, tìm từ khoá sẽ ra chunk lạ
+        logger.warning(f"{index.backend} index has no chunk store of its own; hybrid search disabled.")
+        hybrid = False
+    if not hybrid:
+        retriever = index.as_retriever(search_kwargs={"k": fetch, **(search_kwargs or {})})
+    else:
+        retriever = HybridRetriever(
+            index=index,
+            chunk_store=chunk_store,
+            k=fetch,
+            fetch_k=max(HYBRID_FETCH_K, fetch),
+            search_kwargs=dict(search_kwargs or {}),
+        )
+    if rerank:
+        retriever = RerankRetriever(base_retriever=retriever, reranker=get_reranker(), k=k)
+    return retriever
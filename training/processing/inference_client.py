@@ -0,0 +1,195 @@
+# inference_client.py
+import json
+import logging
+import os
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import requests
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+logger = logging.getLogger(__name__)
+
+# Địa chỉ server suy luận (inference_server.py); để trống thì load model ngay trong process giao diện
+INFERENCE_SERVER_URL = os.getenv('INFERENCE_SERVER_URL', '').rstrip('/')
+INFERENCE_TIMEOUT = float(os.getenv('INFERENCE_TIMEOUT', 600))
+
+
+def _post(base_url: str, path: str, payload: Dict[str, Any], **kwargs: Any) -> requests.Response:
+    response = requests.post(f"{base_url}{path}", json=payload, timeout=kwargs.pop('timeout', INFERENCE_TIMEOUT), **kwargs)
+    response.raise_for_status()
+    return response
+
+
+class RemoteTokenizer:
+    """Tokenizer của model trên server, cùng giao diện tokenize/detokenize với model CTransformers."""
+
+    def __init__(self, base_url: str) -> None:
+        self.base_url = base_url
+
+    def tokenize(self, text: str, add_bos_token: Optional[bool] = None) -> List[int]:
+        return _post(self.base_url, '/tokenize', {'content': text, 'add_special': add_bos_token}).json()['tokens']
+
+    def tokenize_many(self, texts: List[str], add_bos_token: Optional[bool] = None) -> List[List[int]]:
+        """Token của nhiều văn bản trong một request."""
+        texts = list(texts)
+        if not texts:
+            return []
+        return _post(self.base_url, '/tokenize', {'content': texts, 'add_special': add_bos_token}).json()['tokens']
+
+    def detokenize(self, tokens: List[int]) -> str:
+        return _post(self.base_url, '/detokenize', {'tokens': list(tokens)}).json()['content']
+
+
+class RemoteLLM(LLM):
+    """LLM sinh trên server suy luận qua `/v1/completions` (streaming SSE).
+
+    Cùng giao diện với LocalLLM (tokenizer, prime_prefix, get_num_tokens, queue_stats)
+    nên trang ChatBot dùng được cả hai mà không đổi chuỗi QA.
+    """
+
+    base_url: str = INFERENCE_SERVER_URL
+    model: str = ""
+    temperature: float = 0.75
+    top_p: float = 0.9
+    max_new_tokens: int = 1024
+    session_id: str = "default"
+
+    @property
+    def _llm_type(self) -> str:
+        return "remote_completions"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "model": self.model,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "max_new_tokens": self.max_new_tokens,
+        }
+
+    @property
+    def tokenizer(self) -> RemoteTokenizer:
+        return RemoteTokenizer(self.base_url)
+
+    def prime_prefix(self, prefix: str) -> int:
+        """Đăng ký system prompt cố định trên server để KV cache của nó được dùng lại."""
+        return _post(self.base_url, '/prefix', {'prefix': prefix}).json()['tokens']
+
+    def get_num_tokens(self, text: str) -> int:
+        return len(self.tokenizer.tokenize(text))
+
+    def queue_stats(self) -> Dict[str, Any]:
+        response = requests.get(f"{self.base_url}/health", timeout=5)
+        response.raise_for_status()
+        return response.json()['queue']
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        """Nhận từng phần văn bản từ server; đóng stream giữa chừng sẽ huỷ request trên server."""
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "max_tokens": self.max_new_tokens,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "stop": stop or [],
+            "stream": True,
+            "user": self.session_id,
+        }
+        with _post(self.base_url, '/v1/completions', payload, stream=True) as response:
+            for line in response.iter_lines(decode_unicode=False):
+                if not line.startswith(b'data: '):
+                    continue
+                data = line[len(b'data: '):]
+                if data == b'[DONE]':
+                    break
+                event = json.loads(data)
+                if 'error' in event:
+                    raise RuntimeError(f"Inference server error: {event['error']['message']}")
+                text = event['choices'][0]['text']
+                if not text:
+                    continue
+                chunk = GenerationChunk(text=text, generation_info=event.get('metrics'))
+                if run_manager:
+                    run_manager.on_llm_new_token(text, chunk=chunk, verbose=self.verbose)
+                yield chunk
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+
+class RemoteEmbeddings(Embeddings):
+    """Embedding tính trên server suy luận qua `/v1/embeddings`, cùng giao diện với EmbeddingService."""
+
+    def __init__(self, base_url: str = INFERENCE_SERVER_URL) -> None:
+        self.base_url = base_url
+        self._model_id: Optional[str] = None
+
+    @property
+    def model_id(self) -> str:
+        if self._model_id is None:
+            response = requests.get(f"{self.base_url}/health", timeout=INFERENCE_TIMEOUT)
+            response.raise_for_status()
+            self._model_id = response.json()['embedding_model_id']
+        return self._model_id
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        data = _post(self.base_url, '/v1/embeddings', {'input': texts}).json()['data']
+        return np.asarray([item['embedding'] for item in sorted(data, key=lambda item: item['index'])], dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+
+def create_llm(model: str, temperature: float, max_new_tokens: int = 1024, top_p: float = 0.9,
+               session_id: str = "default") -> LLM:
+    """LLM cho trang ChatBot: qua server nếu đặt INFERENCE_SERVER_URL, ngược lại load trong process."""
+    if INFERENCE_SERVER_URL:
+        return RemoteLLM(
+            base_url=INFERENCE_SERVER_URL,
+            model=os.path.splitext(os.path.basename(model))[0],
+            temperature=temperature,
+            max_new_tokens=max_new_tokens,
+            top_p=top_p,
+            session_id=session_id,
+        )
+    from llm import LocalLLM
+    return LocalLLM(
+        model=model,
+        model_type="llama",
+        temperature=temperature,
+        max_new_tokens=max_new_tokens,
+        top_p=top_p,
+        session_id=session_id,
+    )
+
+
+def get_embeddings() -> Embeddings:
+    """Embedder cho truy vấn: qua server nếu đặt INFERENCE_SERVER_URL, ngược lại dịch vụ embedding trong process."""
+    from resources import registry
+    if INFERENCE_SERVER_URL:
+        return registry.get("remote_embeddings", INFERENCE_SERVER_URL, lambda: RemoteEmbeddings(INFERENCE_SERVER_URL))
+    from embedding_service import get_embedding_service
+    return get_embedding_service()
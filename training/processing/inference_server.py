@@ -0,0 +1,243 @@
+# inference_server.py
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+# Nạp cấu hình từ .env trước khi import các module đọc biến môi trường
+load_dotenv()
+
+from embedding_service import EMBEDDING_BACKEND, EMBEDDING_MODEL, get_embedding_service
+from llm import LocalLLM, SlotTokenizer, load_slot_model
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Server suy luận dùng chung cho mọi worker giao diện trên cùng máy, cấu hình qua .env
+INFERENCE_SERVER_HOST = os.getenv('INFERENCE_SERVER_HOST', '127.0.0.1')
+INFERENCE_SERVER_PORT = int(os.getenv('INFERENCE_SERVER_PORT', 8088))
+INFERENCE_MODEL_PATH = os.getenv(
+    'INFERENCE_MODEL_PATH', os.path.join(BASE_DIR, '..', 'models', 'vinallama-7b-chat_q5_0.gguf')
+)
+
+
+def _error(status: int, message: str, error_type: str = 'invalid_request_error') -> web.Response:
+    return web.json_response({'error': {'message': message, 'type': error_type}}, status=status)
+
+
+def _completion_payload(completion_id: str, model_name: str, text: str,
+                        finish_reason: Optional[str], created: int) -> Dict[str, Any]:
+    return {
+        'id': completion_id,
+        'object': 'text_completion',
+        'created': created,
+        'model': model_name,
+        'choices': [{'text': text, 'index': 0, 'logprobs': None, 'finish_reason': finish_reason}],
+    }
+
+
+class InferenceServer:
+    """Server HTTP (asyncio) giữ model sinh và model embedding cho mọi tiến trình giao diện.
+
+    API tương thích OpenAI: `/v1/completions` (có streaming SSE), `/v1/embeddings`, `/v1/models`;
+    thêm `/tokenize` (content là chuỗi hoặc danh sách chuỗi), `/detokenize` (như server llama.cpp), `/prefix` để đăng ký system prompt
+    cố định và `/health`. Việc sinh đi qua hàng đợi chung của LocalLLM, `user` là khoá xoay vòng.
+    """
+
+    def __init__(self, model_path: str = INFERENCE_MODEL_PATH, model_type: str = 'llama',
+                 embedding_backend: str = EMBEDDING_BACKEND, embedding_model: str = EMBEDDING_MODEL) -> None:
+        self.model_path = os.path.abspath(model_path)
+        self.model_type = model_type
+        self.model_name = os.path.splitext(os.path.basename(self.model_path))[0]
+        # tokenize/detokenize giữ khoá của slot: không chạy song song với việc sinh trên cùng model
+        self.tokenizer = SlotTokenizer(self.model_path, self.model_type)
+        self.embeddings = None
+        self.embedding_backend = embedding_backend
+        self.embedding_model = embedding_model
+
+    @property
+    def client(self) -> Any:
+        return load_slot_model(self.model_path, self.model_type)
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.on_startup.append(self._load)
+        app.router.add_get('/health', self.health)
+        app.router.add_get('/v1/models', self.models)
+        app.router.add_post('/v1/completions', self.completions)
+        app.router.add_post('/v1/embeddings', self.embed)
+        app.router.add_post('/tokenize', self.tokenize)
+        app.router.add_post('/detokenize', self.detokenize)
+        app.router.add_post('/prefix', self.prefix)
+        return app
+
+    async def _load(self, app: web.Application) -> None:
+        # Load model trước khi nhận request để request đầu tiên không phải chờ đọc trọng số
+        loop = asyncio.get_running_loop()
+        started_at = time.perf_counter()
+        await loop.run_in_executor(None, lambda: self.client)
+        self.embeddings = await loop.run_in_executor(
+            None, get_embedding_service, self.embedding_backend, self.embedding_model
+        )
+        logger.info(f"Inference server loaded {self.model_name} in {time.perf_counter() - started_at:.2f}s")
+
+    def _llm(self, body: Dict[str, Any], session_id: str) -> LocalLLM:
+        return LocalLLM(
+            model=self.model_path,
+            model_type=self.model_type,
+            temperature=float(body.get('temperature', 0.75)),
+            top_p=float(body.get('top_p', 0.9)),
+            max_new_tokens=int(body.get('max_tokens', 1024)),
+            session_id=session_id,
+        )
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'status': 'ok',
+            'model': self.model_name,
+            'embedding_model_id': self.embeddings.model_id if self.embeddings else None,
+            'queue': self._llm({}, 'health').queue_stats(),
+        })
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'object': 'list',
+            'data': [{'id': self.model_name, 'object': 'model', 'owned_by': 'local'}],
+        })
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        prompt = body.get('prompt')
+        if isinstance(prompt, list) and len(prompt) == 1:
+            prompt = prompt[0]
+        if not isinstance(prompt, str):
+            return _error(400, "'prompt' must be a string")
+        stop = body.get('stop') or []
+        stop = [stop] if isinstance(stop, str) else list(stop)
+
+        llm = self._llm(body, str(body.get('user') or request.remote))
+        ticket = llm.submit(prompt, stop)
+        loop = asyncio.get_running_loop()
+        completion_id = f"cmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        texts: List[str] = []
+        response: Optional[web.StreamResponse] = None
+        try:
+            if body.get('stream'):
+                response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+                await response.prepare(request)
+            # Chờ trên event loop: request xếp hàng không chiếm thread của executor
+            async for chunk in ticket.aresults():
+                texts.append(chunk.text)
+                if response is not None:
+                    payload = _completion_payload(completion_id, self.model_name, chunk.text, None, created)
+                    if len(texts) == 1:
+                        # Số đo của request (hàng đợi, prefix dùng lại), trường mở rộng ngoài chuẩn OpenAI
+                        payload['metrics'] = {**(chunk.generation_info or {}), 'queue_depth': ticket.queue_depth,
+                                              'queue_wait_ms': ticket.wait_ms}
+                    await response.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8'))
+        except (ConnectionResetError, asyncio.CancelledError):
+            logger.info(f"Client of {completion_id} disconnected, cancelling generation")
+            raise
+        except Exception as e:
+            logger.error(f"Completion {completion_id} failed: {e}")
+            if response is None:
+                return _error(500, str(e), 'server_error')
+            await response.write(f"data: {json.dumps({'error': {'message': str(e), 'type': 'server_error'}})}\n\n".encode('utf-8'))
+            await response.write_eof()
+            return response
+        finally:
+            ticket.cancel()
+
+        text = ''.join(texts)
+        usage = await loop.run_in_executor(None, self._usage, prompt, text)
+        finish_reason = 'length' if usage['completion_tokens'] >= llm.max_new_tokens else 'stop'
+        payload = _completion_payload(completion_id, self.model_name, '' if response is not None else text,
+                                      finish_reason, created)
+        payload['usage'] = usage
+        if response is None:
+            return web.json_response(payload)
+        await response.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8'))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def _usage(self, prompt: str, text: str) -> Dict[str, int]:
+        prompt_tokens = len(self.tokenizer.tokenize(prompt))
+        completion_tokens = len(self.tokenizer.tokenize(text, add_bos_token=False)) if text else 0
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        }
+
+    async def embed(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        texts = body.get('input')
+        texts = [texts] if isinstance(texts, str) else texts
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return _error(400, "'input' must be a string or a list of strings")
+        vectors = await asyncio.get_running_loop().run_in_executor(None, self.embeddings.embed_array, texts)
+        return web.json_response({
+            'object': 'list',
+            'model': self.embeddings.model_id,
+            'data': [
+                {'object': 'embedding', 'index': position, 'embedding': vector.tolist()}
+                for position, vector in enumerate(vectors)
+            ],
+        })
+
+    async def tokenize(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        content = body.get('content', '')
+        add_special = body.get('add_special')
+        if isinstance(content, str):
+            tokens = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: self.tokenizer.tokenize(content, add_bos_token=add_special)
+            )
+        elif isinstance(content, list) and all(isinstance(text, str) for text in content):
+            tokens = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: self.tokenizer.tokenize_many(content, add_bos_token=add_special)
+            )
+        else:
+            return _error(400, "'content' must be a string or a list of strings")
+        return web.json_response({'tokens': tokens})
+
+    async def detokenize(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        content = await asyncio.get_running_loop().run_in_executor(
+            None, self.tokenizer.detokenize, body.get('tokens', [])
+        )
+        return web.json_response({'content': content})
+
+    async def prefix(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        tokens = await asyncio.get_running_loop().run_in_executor(
+            None, self._llm({}, 'prefix').prime_prefix, body.get('prefix', '')
+        )
+        return web.json_response({'tokens': tokens})
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Server suy luận local (API tương thích OpenAI) dùng chung cho các worker giao diện.")
+    parser.add_argument('--host', default=INFERENCE_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=INFERENCE_SERVER_PORT)
+    parser.add_argument('--model', default=INFERENCE_MODEL_PATH, help="File GGUF của model sinh")
+    parser.add_argument('--model-type', default='llama')
+    args = parser.parse_args()
+
+    server = InferenceServer(args.model, args.model_type)
+    web.run_app(server.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
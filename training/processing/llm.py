@@ -0,0 +1,342 @@
+# llm.py
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+from resources import get_llm_model, registry
+from scheduler import LLM_MAX_CONCURRENCY, InferenceScheduler, Ticket
+
+logger = logging.getLogger(__name__)
+
+# Một slot là một replica của model: (đường dẫn file model, model_type, số thứ tự slot)
+SlotKey = Tuple[str, str, int]
+
+_model_locks: Dict[SlotKey, threading.Lock] = {}
+_model_locks_guard = threading.Lock()
+
+
+def slot_key(model: str, model_type: str, slot: int = 0) -> SlotKey:
+    return os.path.abspath(model), model_type, slot
+
+
+def model_lock(key: SlotKey) -> threading.Lock:
+    """Khoá theo từng slot: CTransformers không an toàn khi nhiều thread cùng dùng một model."""
+    with _model_locks_guard:
+        lock = _model_locks.get(key)
+        if lock is None:
+            lock = _model_locks[key] = threading.Lock()
+        return lock
+
+
+@dataclass
+class PrefixState:
+    """KV cache của `client` đang chứa đúng phần prefix cố định (system prompt) hay không."""
+
+    client: Any
+    tokens: List[int]
+    primed: bool = False
+    eval_ms: float = 0.0
+
+
+# Prefix đã đăng ký theo từng slot, chỉ đọc/ghi khi giữ model_lock của slot
+_prefix_states: Dict[SlotKey, PrefixState] = {}
+# Prefix theo file model, dùng để prime các replica của worker khi chúng được load
+_registered_prefixes: Dict[Tuple[str, str], str] = {}
+# Mỗi slot một luồng prime lại prefix, các yêu cầu dồn lại trong lúc nó bận được gộp làm một
+_reprime_events: Dict[SlotKey, threading.Event] = {}
+
+
+def _forget_slot(kind: str, key: Any, event: str) -> None:
+    """Model bị evict/load lại: trạng thái KV cache và khoá của client cũ không áp dụng cho client mới."""
+    if kind != "llm" or event == "loaded":
+        return
+    model_path, model_type, replica = key[:3]
+    with _model_locks_guard:
+        _prefix_states.pop((model_path, model_type, replica), None)
+        _model_locks.pop((model_path, model_type, replica), None)
+
+
+registry.add_listener(_forget_slot)
+
+
+def load_slot_model(model: str, model_type: str, slot: int = 0) -> Any:
+    """Model của một slot worker; khi chạy song song, chia đều số thread CPU cho các slot."""
+    if LLM_MAX_CONCURRENCY == 1:
+        return get_llm_model(model, model_type)
+    threads = max(1, (os.cpu_count() or 1) // LLM_MAX_CONCURRENCY)
+    return get_llm_model(model, model_type, replica=slot, threads=threads)
+
+
+class SlotTokenizer:
+    """tokenize/detokenize của model, chạy khi đang giữ model_lock của một slot.
+
+    Gọi tokenizer trên model đang sinh ở thread khác không an toàn, nên lấy slot đang rảnh
+    (mọi replica dùng chung từ vựng); không có slot rảnh thì chờ slot 0.
+    """
+
+    def __init__(self, model: str, model_type: str = "llama") -> None:
+        self.model = model
+        self.model_type = model_type
+
+    @contextmanager
+    def _client(self) -> Iterator[Any]:
+        for slot in range(LLM_MAX_CONCURRENCY):
+            lock = model_lock(slot_key(self.model, self.model_type, slot))
+            if lock.acquire(blocking=False):
+                break
+        else:
+            slot = 0
+            lock = model_lock(slot_key(self.model, self.model_type, slot))
+            lock.acquire()
+        try:
+            yield load_slot_model(self.model, self.model_type, slot)
+        finally:
+            lock.release()
+
+    def tokenize(self, text: str, add_bos_token: Optional[bool] = None) -> List[int]:
+        return self.tokenize_many([text], add_bos_token)[0]
+
+    def tokenize_many(self, texts: Sequence[str], add_bos_token: Optional[bool] = None) -> List[List[int]]:
+        """Token của nhiều văn bản trong một lần giữ khoá."""
+        with self._client() as client:
+            return [client.tokenize(text, add_bos_token=add_bos_token) for text in texts]
+
+    def detokenize(self, tokens: Sequence[int]) -> str:
+        with self._client() as client:
+            return client.detokenize(list(tokens))
+
+
+def get_scheduler(model: str, model_type: str = "llama") -> InferenceScheduler:
+    """Hàng đợi sinh dùng chung cho mọi session của cùng một file model."""
+    key = (os.path.abspath(model), model_type)
+    return registry.get("llm_scheduler", key, lambda: InferenceScheduler(LLM_MAX_CONCURRENCY))
+
+
+def _prime(client: Any, state: PrefixState) -> None:
+    """Đưa KV cache về trạng thái ngay sau prefix (gọi khi đang giữ model_lock)."""
+    started_at = time.perf_counter()
+    client.reset()
+    client.eval(state.tokens)
+    state.eval_ms = round((time.perf_counter() - started_at) * 1000, 2)
+    state.primed = True
+
+
+def _reprime_worker(key: SlotKey, event: threading.Event) -> None:
+    while True:
+        event.wait()
+        event.clear()
+        try:
+            with model_lock(key):
+                state = _prefix_states.get(key)
+                if state is not None and not state.primed:
+                    _prime(state.client, state)
+        except Exception as e:
+            logger.error(f"Failed to re-prime prefix of slot {key[2]}: {e}")
+
+
+def _request_reprime(key: SlotKey) -> None:
+    """Nhờ luồng prime của slot đưa KV cache về trạng thái prefix khi model rảnh."""
+    with _model_locks_guard:
+        event = _reprime_events.get(key)
+        if event is None:
+            event = _reprime_events[key] = threading.Event()
+            threading.Thread(target=_reprime_worker, args=(key, event), name=f'prefix-reprime-{key[2]}',
+                             daemon=True).start()
+    event.set()
+
+
+def _restore_prefix(key: SlotKey, client: Any, tokens: List[int]) -> Tuple[List[int], int, float]:
+    """Nếu KV cache đang giữ đúng prefix của prompt thì chỉ còn phải đánh giá phần sau prefix.
+
+    Trả về (token cần đánh giá, số token prefix dùng lại, thời gian prompt-eval tiết kiệm được).
+    """
+    state = _prefix_states.get(key)
+    if state is None or state.client is not client or not state.primed:
+        return tokens, 0, 0.0
+    # Từ đây KV cache sẽ bị ghi tiếp sau prefix (hoặc reset), không còn là trạng thái "sạch"
+    state.primed = False
+    size = len(state.tokens)
+    if len(tokens) <= size or tokens[:size] != state.tokens:
+        return tokens, 0, 0.0
+    return tokens[size:], size, state.eval_ms
+
+
+def _generate_text(client: Any, tokens: List[int], reset: bool, stop: Optional[List[str]],
+                   max_new_tokens: int, **sampling: Any) -> Iterator[str]:
+    """Sinh văn bản từ danh sách token, xử lý ký tự UTF-8 nhiều byte và chuỗi dừng như CTransformers."""
+    stop = [s for s in (stop or []) if s]
+    hold = max((len(s) - 1 for s in stop), default=0)
+    text, emitted, pending = "", 0, b""
+    for count, token in enumerate(client.generate(tokens, reset=reset, **sampling), start=1):
+        pending += client.detokenize([token], decode=False)
+        try:
+            text += pending.decode('utf-8')
+        except UnicodeDecodeError:
+            if count < max_new_tokens:
+                continue
+            text += pending.decode('utf-8', errors='ignore')
+        pending = b""
+
+        positions = [text.find(s) for s in stop if s in text]
+        if positions:
+            if min(positions) > emitted:
+                yield text[emitted:min(positions)]
+            return
+        # Giữ lại phần cuối có thể là đầu của một chuỗi dừng
+        safe = len(text) - hold
+        if safe > emitted:
+            yield text[emitted:safe]
+            emitted = safe
+        if count >= max_new_tokens:
+            break
+    if len(text) > emitted:
+        yield text[emitted:]
+
+
+class LocalLLM(LLM):
+    """LLM CTransformers chạy local, dùng chung trọng số qua registry của process.
+
+    Khác với `CTransformers` của langchain, mỗi instance chỉ giữ tham số sinh,
+    nên đổi temperature trên sidebar không làm load lại model.
+
+    Prefix cố định (system prompt) được đánh giá sẵn vào KV cache bằng `prime_prefix`;
+    prompt bắt đầu bằng prefix đó chỉ phải đánh giá phần còn lại, và sau mỗi request
+    KV cache được đưa về trạng thái prefix ở luồng nền, ngoài đường đi của request.
+
+    Việc sinh không chạy trên thread của session mà được xếp vào hàng đợi chung
+    (`InferenceScheduler`), xoay vòng công bằng giữa các session theo `session_id`.
+    """
+
+    model: str
+    model_type: str = "llama"
+    session_id: str = "default"
+    temperature: float = 0.75
+    top_p: float = 0.9
+    max_new_tokens: int = 1024
+
+    @property
+    def _llm_type(self) -> str:
+        return "local_ctransformers"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "model_type": self.model_type,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "max_new_tokens": self.max_new_tokens,
+        }
+
+    @property
+    def client(self) -> Any:
+        return load_slot_model(self.model, self.model_type)
+
+    @property
+    def tokenizer(self) -> SlotTokenizer:
+        return SlotTokenizer(self.model, self.model_type)
+
+    def prime_prefix(self, prefix: str) -> int:
+        """Đăng ký prefix cố định của model và đánh giá sẵn nó vào KV cache. Trả về số token prefix."""
+        client = self.client
+        key = slot_key(self.model, self.model_type)
+        _registered_prefixes[key[:2]] = prefix
+        with model_lock(key):
+            state = _prefix_states[key] = PrefixState(client=client, tokens=client.tokenize(prefix))
+            _prime(client, state)
+        logger.info(f"Primed {len(state.tokens)} prefix tokens in {state.eval_ms} ms")
+        return len(state.tokens)
+
+    def get_num_tokens(self, text: str) -> int:
+        """Đếm token bằng tokenizer của chính model (langchain mặc định dùng tokenizer GPT-2)."""
+        return len(self.tokenizer.tokenize(text))
+
+    def _generation_kwargs(self) -> Dict[str, Any]:
+        return {
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "max_new_tokens": self.max_new_tokens,
+        }
+
+    def queue_stats(self) -> Dict[str, Any]:
+        return get_scheduler(self.model, self.model_type).stats()
+
+    def submit(self, prompt: str, stop: Optional[List[str]] = None) -> Ticket:
+        """Xếp request sinh vào hàng đợi của model; `ticket.results()` trả về các GenerationChunk."""
+        return get_scheduler(self.model, self.model_type).submit(
+            self.session_id, lambda slot: self._generate_on_slot(slot, prompt, stop)
+        )
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        """Xếp request vào hàng đợi của model rồi nhận từng token ngay khi worker sinh ra."""
+        ticket = self.submit(prompt, stop)
+
+        def on_wait(waiting: Ticket) -> None:
+            # Gọi định kỳ trên thread của session trong lúc chờ tới lượt
+            if run_manager:
+                run_manager.on_text(
+                    f"Đang chờ tới lượt ({waiting.queue_depth} yêu cầu phía trước)...",
+                    queue_wait_ms=waiting.wait_ms,
+                )
+
+        try:
+            queue_info = {"queue_depth": ticket.queue_depth}
+            for chunk in ticket.results(on_wait):
+                if queue_info is not None:
+                    queue_info["queue_wait_ms"] = ticket.wait_ms
+                    chunk.generation_info = {**(chunk.generation_info or {}), **queue_info}
+                    queue_info = None
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk, verbose=self.verbose)
+                yield chunk
+        finally:
+            # Session ngừng nhận (rời trang, hỏi câu mới): worker dừng ở token kế tiếp
+            ticket.cancel()
+
+    def _generate_on_slot(self, slot: int, prompt: str, stop: Optional[List[str]]) -> Iterator[GenerationChunk]:
+        """Sinh trên model của slot (chạy trong worker), dùng lại KV cache của prefix nếu có."""
+        client = load_slot_model(self.model, self.model_type, slot)
+        key = slot_key(self.model, self.model_type, slot)
+        prefix = _registered_prefixes.get(key[:2])
+        diverged = False
+        try:
+            with model_lock(key):
+                tokens = client.tokenize(prompt)
+                state = _prefix_states.get(key)
+                if prefix is not None and (state is None or state.client is not client):
+                    # Replica chưa có prefix (hoặc vừa load lại): lần này đánh giá cả prompt, prefix được prime sau request
+                    _prefix_states[key] = PrefixState(client=client, tokens=client.tokenize(prefix))
+                diverged = key in _prefix_states
+                tokens, reused, saved_ms = _restore_prefix(key, client, tokens)
+                # Số đo được gắn vào chunk đầu tiên để callback ghi vào metrics của request
+                info = {"prefix_tokens_reused": reused, "prompt_eval_saved_ms": saved_ms}
+                for text in _generate_text(client, tokens, reset=not reused, stop=stop, **self._generation_kwargs()):
+                    yield GenerationChunk(text=text, generation_info=info)
+                    info = None
+        finally:
+            # KV cache đã bị ghi tiếp sau prefix (hoặc reset) nên phải prime lại trước request sau
+            if diverged:
+                _request_reprime(key)
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
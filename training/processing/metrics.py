@@ -0,0 +1,106 @@
+# metrics.py
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+METRICS_PATH = os.getenv('CHAT_METRICS_PATH', os.path.join(BASE_DIR, 'logs', 'chat_metrics.jsonl'))
+
+
+@dataclass
+class RequestMetrics:
+    """Số đo độ trễ cảm nhận được của một câu hỏi: TTFT, tokens/s và tổng thời gian."""
+
+    question: str = ""
+    started_at: float = field(default_factory=time.perf_counter)
+    first_token_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    token_count: int = 0
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def mark_token(self) -> None:
+        """Ghi nhận một token vừa được sinh ra."""
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.token_count += 1
+
+    def finish(self) -> None:
+        """Đánh dấu kết thúc request."""
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+
+    @property
+    def ttft_ms(self) -> Optional[float]:
+        if self.first_token_at is None:
+            return None
+        return (self.first_token_at - self.started_at) * 1000
+
+    @property
+    def total_ms(self) -> Optional[float]:
+        if self.finished_at is None:
+            return None
+        return (self.finished_at - self.started_at) * 1000
+
+    @property
+    def tokens_per_sec(self) -> Optional[float]:
+        if self.first_token_at is None or self.finished_at is None or self.token_count < 2:
+            return None
+        generation_time = self.finished_at - self.first_token_at
+        if generation_time <= 0:
+            return None
+        # Token đầu tiên thuộc về TTFT, tốc độ sinh tính từ token thứ hai
+        return (self.token_count - 1) / generation_time
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "timestamp": time.time(),
+            "question": self.question,
+            "ttft_ms": _round(self.ttft_ms),
+            "total_ms": _round(self.total_ms),
+            "tokens": self.token_count,
+            "tokens_per_sec": _round(self.tokens_per_sec),
+            **self.extra,
+        }
+
+    def summary(self) -> str:
+        """Chuỗi ngắn gọn để hiển thị dưới câu trả lời."""
+        parts = []
+        if self.extra.get('prompt_tokens') is not None:
+            parts.append(f"prompt {self.extra['prompt_tokens']} tokens")
+        if self.extra.get('queue_wait_ms'):
+            parts.append(f"chờ {self.extra['queue_wait_ms']:.0f} ms (hàng đợi {self.extra.get('queue_depth', 0)})")
+        if self.extra.get('prefix_tokens_reused'):
+            parts.append(
+                f"dùng lại {self.extra['prefix_tokens_reused']} token prefix "
+                f"(-{self.extra.get('prompt_eval_saved_ms', 0):.0f} ms)"
+            )
+        if self.ttft_ms is not None:
+            parts.append(f"TTFT {self.ttft_ms:.0f} ms")
+        if self.tokens_per_sec is not None:
+            parts.append(f"{self.tokens_per_sec:.1f} tokens/s")
+        if self.total_ms is not None:
+            parts.append(f"tổng {self.total_ms:.0f} ms")
+        if self.extra.get('rerank_ms') is not None:
+            parts.append(f"rerank {self.extra['rerank_ms']:.0f} ms ({self.extra.get('rerank_status')})")
+        return " · ".join(parts)
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 2)
+
+
+def record_metrics(metrics: RequestMetrics, path: str = METRICS_PATH) -> None:
+    """Ghi số đo của request vào file JSONL để theo dõi độ trễ theo thời gian."""
+    record = metrics.as_dict()
+    logger.info(f"Request metrics: {record}")
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    except IOError as e:
+        logger.error(f"Failed to write request metrics to {path}: {e}")
@@ -0,0 +1,223 @@
+# news_repository.py
+import logging
+import os
+import re
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+NEWS_DB_PATH = os.getenv('NEWS_DB_PATH', os.path.join(BASE_DIR, 'db', 'news_data.db'))
+# Số kết quả tìm kiếm mỗi trang
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 10))
+# Số bài mỗi trang của danh sách tin trên trang Home
+NEWS_PAGE_SIZE = int(os.getenv('NEWS_PAGE_SIZE', 5))
+# Độ dài đoạn xem trước lưu sẵn trong cột preview
+PREVIEW_CHARS = 200
+# Trọng số bm25 của cột title so với content: khớp ở tiêu đề được xếp trên
+SEARCH_TITLE_WEIGHT = 10.0
+SNIPPET_TOKENS = 24
+
+# unicode61 không bỏ dấu được đ/Đ (không phải ký tự tổ hợp): văn bản và truy vấn được đổi sẵn sang d/D.
+# Số token và vị trí không đổi nên snippet() vẫn đánh dấu đúng trên văn bản gốc của news.
+def _fold_sql(column: str) -> str:
+    return f"replace(replace({column}, 'đ', 'd'), 'Đ', 'D')"
+
+
+def fold_text(text: str) -> str:
+    return text.replace('đ', 'd').replace('Đ', 'D')
+
+
+# Chỉ mục toàn văn ngoài (external content) trên news: không lưu bản sao văn bản, chỉ lưu chỉ mục.
+# remove_diacritics 2: "phat nguoi" khớp "phạt nguội"
+FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS news_fts USING fts5(
+        title, content, content='news', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS news_fts_ai AFTER INSERT ON news BEGIN
+        INSERT INTO news_fts (rowid, title, content)
+        VALUES (new.id, {_fold_sql('new.title')}, {_fold_sql('new.content')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS news_fts_ad AFTER DELETE ON news BEGIN
+        INSERT INTO news_fts (news_fts, rowid, title, content)
+        VALUES ('delete', old.id, {_fold_sql('old.title')}, {_fold_sql('old.content')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS news_fts_au AFTER UPDATE OF title, content ON news BEGIN
+        INSERT INTO news_fts (news_fts, rowid, title, content)
+        VALUES ('delete', old.id, {_fold_sql('old.title')}, {_fold_sql('old.content')});
+        INSERT INTO news_fts (rowid, title, content)
+        VALUES (new.id, {_fold_sql('new.title')}, {_fold_sql('new.content')});
+    END
+    """,
+]
+# Nạp các bài có từ trước khi tạo chỉ mục (không dùng 'rebuild' vì nó đọc văn bản chưa đổi đ/Đ)
+FTS_BACKFILL = f"INSERT INTO news_fts (rowid, title, content) SELECT id, {_fold_sql('title')}, {_fold_sql('content')} FROM news"
+
+# Cột preview và bộ đếm số bài được trigger cập nhật khi ghi, trang Home không phải đọc content
+# hay COUNT(*) cả bảng ở mỗi lần chạy lại
+LISTING_SCHEMA = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS news_preview_ai AFTER INSERT ON news BEGIN
+        UPDATE news SET preview = substr(new.content, 1, {PREVIEW_CHARS}) WHERE id = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS news_preview_au AFTER UPDATE OF content ON news BEGIN
+        UPDATE news SET preview = substr(new.content, 1, {PREVIEW_CHARS}) WHERE id = new.id;
+    END
+    """,
+    "CREATE TABLE IF NOT EXISTS news_counter (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    """
+    CREATE TRIGGER IF NOT EXISTS news_count_ai AFTER INSERT ON news BEGIN
+        UPDATE news_counter SET value = value + 1 WHERE name = 'news';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS news_count_ad AFTER DELETE ON news BEGIN
+        UPDATE news_counter SET value = value - 1 WHERE name = 'news';
+    END
+    """,
+]
+
+
+def fts_query(text: str) -> str:
+    """Chuyển chuỗi người dùng nhập thành truy vấn FTS5: mọi từ đều phải có, từ cuối khớp theo tiền tố.
+
+    Mỗi từ được đặt trong ngoặc kép nên ký tự đặc biệt của cú pháp FTS5 (", *, -, :, ...) không gây lỗi.
+    """
+    words = re.findall(r'\w+', fold_text(text))
+    if not words:
+        return ''
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class NewsRepository:
+    """Truy cập bảng news của news_data.db cho các trang giao diện.
+
+    Khởi tạo lần đầu chạy migration: tạo bảng FTS5 `news_fts`, cột `preview` và bảng `news_counter`
+    cùng các trigger giữ chúng đồng bộ với news (crawler và phản hồi ghi vào news như cũ),
+    rồi nạp lại dữ liệu cho các bài đã có từ trước.
+    """
+
+    def __init__(self, db_path: str = NEWS_DB_PATH) -> None:
+        self.db_path = db_path
+        self.migrated = False
+        self._ensure_migrated()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _ensure_migrated(self) -> bool:
+        if not self.migrated:
+            # Autocommit để tự điều khiển transaction: cả migration nằm trong một BEGIN IMMEDIATE,
+            # process khởi động cùng lúc chờ khoá ghi rồi kiểm tra lại và thấy mọi thứ đã có
+            conn = self._connect()
+            conn.isolation_level = None
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    self.migrated = self._migrate(conn)
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+                conn.execute('COMMIT')
+            finally:
+                conn.close()
+        return self.migrated
+
+    def _migrate(self, conn: sqlite3.Connection) -> bool:
+        """Tạo/nạp các bảng phụ; gọi trong transaction đang giữ khoá ghi nên kiểm tra rồi ghi không bị chen ngang."""
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'news'").fetchone():
+            # Crawler (db.py) chưa chạy: migration được thử lại ở lần truy cập sau
+            logger.warning(f"Table news does not exist yet in {self.db_path}; full-text search is unavailable")
+            return False
+        created = not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'news_fts'").fetchone()
+        for statement in FTS_SCHEMA:
+            conn.execute(statement)
+        if created:
+            conn.execute(FTS_BACKFILL)
+            logger.info(f"Created full-text index news_fts and backfilled it from news in {self.db_path}")
+
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(news)')}
+        if 'preview' not in columns:
+            conn.execute('ALTER TABLE news ADD COLUMN preview VARCHAR')
+        # Bài ghi trước khi có trigger (hoặc bởi bản cũ của crawler) chưa có preview
+        conn.execute(f'UPDATE news SET preview = substr(content, 1, {PREVIEW_CHARS}) WHERE preview IS NULL')
+        for statement in LISTING_SCHEMA:
+            conn.execute(statement)
+        conn.execute("INSERT OR IGNORE INTO news_counter (name, value) SELECT 'news', COUNT(*) FROM news")
+        return True
+
+    def search(self, text: str, limit: int = SEARCH_PAGE_SIZE, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """Tìm bài viết theo tiêu đề và nội dung, xếp theo bm25.
+
+        Trả về (một trang kết quả: id, title, url, snippet, score; tổng số bài khớp).
+        """
+        query = fts_query(text)
+        if not query or not self._ensure_migrated():
+            return [], 0
+        with self._connect() as conn:
+            total = conn.execute('SELECT COUNT(*) FROM news_fts WHERE news_fts MATCH ?', (query,)).fetchone()[0]
+            rows = conn.execute(f"""
+                SELECT news.id, news.title, news.url,
+                       snippet(news_fts, 1, '**', '**', '...', {SNIPPET_TOKENS}) AS snippet,
+                       bm25(news_fts, {SEARCH_TITLE_WEIGHT}, 1.0) AS score
+                FROM news_fts JOIN news ON news.id = news_fts.rowid
+                WHERE news_fts MATCH ?
+                ORDER BY score
+                LIMIT ? OFFSET ?
+            """, (query, limit, offset)).fetchall()
+        return [dict(row) for row in rows], total
+
+    def latest(self, before_id: Optional[int] = None, limit: int = NEWS_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], bool]:
+        """Một trang bài mới nhất theo keyset: các bài có id nhỏ hơn `before_id` (None = trang đầu).
+
+        Trả về (id, title, url, preview của tối đa `limit` bài; còn trang sau hay không).
+        Trang sau bắt đầu từ id của bài cuối cùng, chi phí không phụ thuộc đang ở trang thứ mấy.
+        """
+        if not self._ensure_migrated():
+            return [], False
+        with self._connect() as conn:
+            if before_id is None:
+                rows = conn.execute(
+                    'SELECT id, title, url, preview FROM news ORDER BY id DESC LIMIT ?', (limit + 1,)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    'SELECT id, title, url, preview FROM news WHERE id < ? ORDER BY id DESC LIMIT ?',
+                    (before_id, limit + 1)
+                ).fetchall()
+        return [dict(row) for row in rows[:limit]], len(rows) > limit
+
+    def count(self) -> int:
+        """Tổng số bài viết, đọc từ bộ đếm do trigger duy trì."""
+        if not self._ensure_migrated():
+            return 0
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM news_counter WHERE name = 'news'").fetchone()
+        return row[0] if row else 0
+
+    def get(self, news_id: int) -> Dict[str, Any]:
+        """Một bài viết đầy đủ theo id, {} nếu không có."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT id, title, url, content FROM news WHERE id = ?', (news_id,)).fetchone()
+        return dict(row) if row else {}
+
+
+def get_news_repository(db_path: str = NEWS_DB_PATH) -> NewsRepository:
+    from resources import registry
+    return registry.get("news_repository", os.path.abspath(db_path), lambda: NewsRepository(db_path))
@@ -0,0 +1,126 @@
+# parallel_embed.py
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from embedding_service import EMBEDDING_BACKEND, EMBEDDING_MODEL, EMBEDDING_MAX_BATCH, create_backend
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_WORKERS = int(os.getenv('EMBEDDING_WORKERS', 1))
+
+# Model của từng worker process, được load một lần trong initializer
+_worker_backend = None
+
+
+def _init_worker(backend: str, model_name: str, threads: int) -> None:
+    """Khởi tạo worker: giới hạn số thread BLAS/torch rồi load model riêng của worker."""
+    global _worker_backend
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_backend = create_backend(backend, model_name)
+
+
+def _probe_dim() -> int:
+    return int(_worker_backend.embed(["dim"]).shape[1])
+
+
+def _embed_shard(shm_name: str, shape: tuple, start: int, texts: List[str], batch_size: int) -> int:
+    """Embed một shard và ghi thẳng vào vùng shared memory tại đúng vị trí các dòng."""
+    # Worker dùng chung resource_tracker với process cha, process cha chịu trách nhiệm unlink
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        output = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        for offset in range(0, len(texts), batch_size):
+            vectors = _worker_backend.embed(texts[offset:offset + batch_size])
+            output[start + offset:start + offset + len(vectors)] = vectors
+        del output
+    finally:
+        shm.close()
+    return len(texts)
+
+
+class ParallelEmbedder(Embeddings):
+    """Embed song song trên nhiều process CPU, mỗi worker giữ model riêng.
+
+    Vector được worker ghi trực tiếp vào một khối shared memory do process cha cấp phát,
+    nên không phải pickle danh sách float, và thứ tự dòng luôn khớp thứ tự đầu vào.
+    """
+
+    def __init__(
+        self,
+        workers: int = EMBEDDING_WORKERS,
+        backend: str = EMBEDDING_BACKEND,
+        model_name: str = EMBEDDING_MODEL,
+        batch_size: int = EMBEDDING_MAX_BATCH,
+        threads_per_worker: Optional[int] = None,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self._model_id = f"{backend}:{model_name}"
+        threads = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(backend, model_name, threads),
+        )
+        self._dim: Optional[int] = None
+
+    @property
+    def model_id(self) -> str:
+        return self._model_id
+
+    @property
+    def dim(self) -> int:
+        if self._dim is None:
+            self._dim = self._pool.submit(_probe_dim).result()
+        return self._dim
+
+    def embed_array(self, texts: Sequence[str]) -> np.ndarray:
+        """Chia texts thành shard liên tiếp cho từng worker và gộp kết quả theo đúng thứ tự."""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        shape = (len(texts), self.dim)
+        shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+        try:
+            shard_size = math.ceil(len(texts) / self.workers)
+            futures = [
+                self._pool.submit(_embed_shard, shm.name, shape, start, texts[start:start + shard_size], self.batch_size)
+                for start in range(0, len(texts), shard_size)
+            ]
+            for future in futures:
+                future.result()
+            return np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+    def close(self) -> None:
+        self._pool.shutdown()
+
+    def __enter__(self) -> "ParallelEmbedder":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
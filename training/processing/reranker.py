@@ -0,0 +1,92 @@
+# reranker.py
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+logger = logging.getLogger(__name__)
+
+# Xếp hạng lại bằng cross-encoder sau bước tìm kiếm, cấu hình qua .env
+RERANK_ENABLED = os.getenv('RERANK_ENABLED', '0') == '1'
+RERANK_MODEL = os.getenv('RERANK_MODEL', 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
+# Số ứng viên đưa vào cross-encoder
+RERANK_TOP_N = int(os.getenv('RERANK_TOP_N', 20))
+# Quá ngân sách thì giữ nguyên thứ tự tìm kiếm ban đầu
+RERANK_BUDGET_MS = float(os.getenv('RERANK_BUDGET_MS', 300))
+
+# Một luồng chấm điểm duy nhất: các truy vấn đồng thời không tranh nhau CPU của model
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reranker')
+
+
+class CrossEncoderReranker:
+    """Chấm điểm cặp (câu hỏi, chunk) bằng cross-encoder trong một lần forward theo batch."""
+
+    def __init__(self, model_name: str = RERANK_MODEL, budget_ms: float = RERANK_BUDGET_MS) -> None:
+        from sentence_transformers import CrossEncoder
+        self.model_name = model_name
+        self.budget_ms = budget_ms
+        self._model = CrossEncoder(model_name)
+
+    def score(self, query: str, documents: Sequence[Document], deadline: Optional[float] = None) -> Optional[List[float]]:
+        """Điểm của từng chunk; None nếu tới lượt chạy thì truy vấn đã hết ngân sách (bỏ qua, không tốn CPU)."""
+        if deadline is not None and time.perf_counter() >= deadline:
+            return None
+        pairs = [(query, document.page_content) for document in documents]
+        return [float(score) for score in self._model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)]
+
+    def rerank(self, query: str, documents: Sequence[Document], k: int) -> Tuple[List[Document], Dict[str, Any]]:
+        """Giữ k chunk điểm cao nhất; quá ngân sách hoặc lỗi thì trả về k chunk đầu theo thứ tự cũ."""
+        documents = list(documents)
+        if len(documents) <= 1:
+            return documents[:k], {'rerank_ms': 0.0, 'rerank_status': 'skipped'}
+
+        started_at = time.perf_counter()
+        deadline = started_at + self.budget_ms / 1000
+        future = _executor.submit(self.score, query, documents, deadline)
+        try:
+            scores = future.result(timeout=self.budget_ms / 1000)
+            status = 'ok' if scores is not None else 'timeout'
+        except TimeoutError:
+            # Job còn xếp hàng thì huỷ hẳn; job đã chạy thì chạy nốt, kết quả bị bỏ qua
+            future.cancel()
+            scores, status = None, 'timeout'
+        except Exception as e:
+            logger.error(f"Reranking failed, keeping retrieval order: {e}")
+            scores, status = None, 'error'
+        elapsed_ms = round((time.perf_counter() - started_at) * 1000, 2)
+
+        if scores is None:
+            return documents[:k], {'rerank_ms': elapsed_ms, 'rerank_status': status}
+        ranked = sorted(zip(scores, range(len(documents))), reverse=True)[:k]
+        for score, position in ranked:
+            documents[position].metadata['rerank_score'] = round(score, 4)
+        return [documents[position] for _, position in ranked], {'rerank_ms': elapsed_ms, 'rerank_status': status}
+
+
+def get_reranker(model_name: str = RERANK_MODEL) -> CrossEncoderReranker:
+    """Cross-encoder dùng chung cho cả process."""
+    from resources import registry
+    return registry.get("reranker", model_name, lambda: CrossEncoderReranker(model_name))
+
+
+class RerankRetriever(BaseRetriever):
+    """Lấy top-N ứng viên từ retriever gốc rồi giữ k chunk được cross-encoder chấm cao nhất.
+
+    Thời gian rerank được ghi vào metadata của các chunk trả về (rerank_ms, rerank_status).
+    """
+
+    base_retriever: BaseRetriever
+    reranker: Any
+    k: int = 5
+
+    def _get_relevant_documents(self, query: str, *, run_manager: Any) -> List[Document]:
+        candidates = self.base_retriever.invoke(query, config={'callbacks': run_manager.get_child()})
+        documents, stats = self.reranker.rerank(query, candidates, self.k)
+        logger.info(f"Reranked {len(candidates)} candidates in {stats['rerank_ms']} ms ({stats['rerank_status']})")
+        for document in documents:
+            document.metadata.update(stats)
+        return documents
@@ -0,0 +1,244 @@
+# resources.py
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Chu kỳ (giây) stat manifest của chỉ mục vector để tự nạp thế hệ mới; 0 = tắt (nạp lại bằng tay)
+VECTOR_INDEX_WATCH_SECONDS = float(os.getenv('VECTOR_INDEX_WATCH_SECONDS', 2))
+
+ResourceKey = Tuple[str, Hashable]
+
+
+class ResourceRegistry:
+    """Registry tài nguyên nặng (LLM, embedder, vector store) dùng chung cho cả process.
+
+    Mỗi khoá chỉ được load đúng một lần, kể cả khi nhiều session Streamlit
+    (mỗi session là một thread) cùng yêu cầu một lúc.
+    """
+
+    def __init__(self) -> None:
+        self._resources: Dict[ResourceKey, Any] = {}
+        self._loaders: Dict[ResourceKey, Callable[[], Any]] = {}
+        self._locks: Dict[ResourceKey, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self._listeners: List[Callable[[str, Hashable, str], None]] = []
+
+    def _lock_for(self, full_key: ResourceKey) -> threading.Lock:
+        with self._guard:
+            lock = self._locks.get(full_key)
+            if lock is None:
+                lock = self._locks[full_key] = threading.Lock()
+            return lock
+
+    def _notify(self, kind: str, key: Hashable, event: str) -> None:
+        for listener in list(self._listeners):
+            try:
+                listener(kind, key, event)
+            except Exception as e:
+                logger.error(f"Resource listener failed for {kind}:{key}: {e}")
+
+    def add_listener(self, listener: Callable[[str, Hashable, str], None]) -> None:
+        """Đăng ký callback(kind, key, event) được gọi khi tài nguyên load/reload/evict."""
+        self._listeners.append(listener)
+
+    def get(self, kind: str, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Trả về tài nguyên đã load, hoặc gọi loader đúng một lần nếu chưa có."""
+        full_key = (kind, key)
+        resource = self._resources.get(full_key)
+        if resource is not None:
+            return resource
+
+        with self._lock_for(full_key):
+            resource = self._resources.get(full_key)
+            if resource is None:
+                start = time.perf_counter()
+                resource = loader()
+                self._resources[full_key] = resource
+                self._loaders[full_key] = loader
+                logger.info(f"Loaded {kind} {key} in {time.perf_counter() - start:.2f}s")
+                self._notify(kind, key, "loaded")
+        return resource
+
+    def peek(self, kind: str, key: Hashable) -> Optional[Any]:
+        """Lấy tài nguyên nếu đã load, không kích hoạt việc load."""
+        return self._resources.get((kind, key))
+
+    def reload(self, kind: str, key: Hashable) -> Optional[Any]:
+        """Load lại tài nguyên bằng loader cũ rồi mới thay thế, reader không thấy khoảng trống."""
+        full_key = (kind, key)
+        loader = self._loaders.get(full_key)
+        if loader is None:
+            return None
+
+        with self._lock_for(full_key):
+            start = time.perf_counter()
+            resource = loader()
+            self._resources[full_key] = resource
+            logger.info(f"Reloaded {kind} {key} in {time.perf_counter() - start:.2f}s")
+        self._notify(kind, key, "reloaded")
+        return resource
+
+    def evict(self, kind: str, key: Optional[Hashable] = None) -> int:
+        """Giải phóng một tài nguyên (hoặc mọi tài nguyên cùng loại nếu key=None)."""
+        with self._guard:
+            targets = [
+                full_key for full_key in self._resources
+                if full_key[0] == kind and (key is None or full_key[1] == key)
+            ]
+            for full_key in targets:
+                self._resources.pop(full_key, None)
+                self._loaders.pop(full_key, None)
+        for _, evicted_key in targets:
+            logger.info(f"Evicted {kind} {evicted_key}")
+            self._notify(kind, evicted_key, "evicted")
+        return len(targets)
+
+    def keys(self, kind: Optional[str] = None) -> List[ResourceKey]:
+        """Danh sách khoá đang được giữ trong registry."""
+        return [full_key for full_key in self._resources if kind is None or full_key[0] == kind]
+
+
+# Registry dùng chung cho toàn bộ process
+registry = ResourceRegistry()
+
+
+def get_llm_model(model_path: str, model_type: str = "llama", replica: int = 0, **load_config) -> Any:
+    """Load trọng số CTransformers một lần cho mỗi file model.
+
+    Các tham số sinh (temperature, top_p, max_new_tokens) không thuộc khoá,
+    chúng được truyền theo từng lần gọi nên mọi session dùng chung một bản trọng số.
+    `replica` > 0 tạo thêm context (KV cache) riêng cho worker sinh song song;
+    file GGUF được mmap nên các replica dùng chung trang trọng số của hệ điều hành.
+    """
+    model_path = os.path.abspath(model_path)
+    key = (model_path, model_type, replica, tuple(sorted(load_config.items())))
+
+    def _load():
+        from ctransformers import AutoModelForCausalLM
+        return AutoModelForCausalLM.from_pretrained(model_path, model_type=model_type, **load_config)
+
+    return registry.get("llm", key, _load)
+
+
+def index_signature(index_path: str) -> Tuple:
+    """Chữ ký rẻ của chỉ mục trên đĩa, dùng để phát hiện thay đổi.
+
+    Chỉ mục có manifest: một lần stat manifest.json (được thay bằng rename nên mỗi thế hệ, kể cả
+    delta segment, đổi inode). Bố cục cũ: (mtime, size) của mọi file trong thư mục.
+    """
+    from vector_index import MANIFEST_FILE
+    try:
+        stat = os.stat(os.path.join(index_path, MANIFEST_FILE))
+        return ((MANIFEST_FILE, stat.st_ino, stat.st_mtime_ns, stat.st_size),)
+    except FileNotFoundError:
+        pass
+    signature = []
+    if os.path.isdir(index_path):
+        for name in sorted(os.listdir(index_path)):
+            file_path = os.path.join(index_path, name)
+            if os.path.isfile(file_path):
+                stat = os.stat(file_path)
+                signature.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+_loaded_signatures: Dict[str, Tuple] = {}
+
+
+def get_vector_store(index_path: str, embeddings: Any, mmap: Optional[bool] = None) -> Any:
+    """Load chỉ mục vector (SearchIndex) một lần cho mỗi đường dẫn chỉ mục.
+
+    Mặc định (VECTOR_INDEX_MMAP) chỉ mục FAISS được load chỉ đọc bằng mmap.
+    Với VECTOR_INDEX_WATCH_SECONDS > 0, thế hệ mới trên đĩa được nạp tự động (xem IndexWatcher).
+    """
+    index_path = os.path.abspath(index_path)
+
+    def _load():
+        from vector_index import VECTOR_INDEX_MMAP, load_index
+        # Chữ ký lấy trước khi load: thế hệ ghi xong trong lúc load sẽ được nạp ở lần kiểm tra sau
+        signature = index_signature(index_path)
+        db = load_index(index_path, embeddings, mmap=VECTOR_INDEX_MMAP if mmap is None else mmap)
+        _loaded_signatures[index_path] = signature
+        return db
+
+    db = registry.get("vector_store", index_path, _load)
+    if VECTOR_INDEX_WATCH_SECONDS > 0:
+        registry.get("index_watcher", index_path, lambda: IndexWatcher(index_path, VECTOR_INDEX_WATCH_SECONDS))
+    return db
+
+
+def vector_store_changed(index_path: str) -> bool:
+    """Kiểm tra chỉ mục trên đĩa đã thay đổi so với bản đang giữ trong bộ nhớ hay chưa."""
+    index_path = os.path.abspath(index_path)
+    if registry.peek("vector_store", index_path) is None:
+        return False
+    return index_signature(index_path) != _loaded_signatures.get(index_path)
+
+
+def reload_vector_store(index_path: str) -> Any:
+    """Hook load lại chỉ mục sau khi file trên đĩa được cập nhật."""
+    return registry.reload("vector_store", os.path.abspath(index_path))
+
+
+class IndexWatcher:
+    """Luồng nền stat manifest của chỉ mục và nạp thế hệ mới mà không dừng việc truy vấn.
+
+    Double buffer: thế hệ mới được load ở luồng này trong khi các session tiếp tục dùng bản cũ,
+    rồi registry đổi sang bản mới trong một phép gán; truy vấn đang chạy giữ tham chiếu tới bản cũ
+    (file của thế hệ trước còn được giữ trên đĩa, xem VectorIndex.save). Load lỗi thì giữ bản cũ
+    và chỉ thử lại khi manifest đổi tiếp.
+    """
+
+    def __init__(self, index_path: str, interval: float = VECTOR_INDEX_WATCH_SECONDS) -> None:
+        self.index_path = index_path
+        self.interval = interval
+        self.swaps = 0
+        self.last_swap_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._failed_signature: Optional[Tuple] = None
+        self._thread = threading.Thread(target=self._run, name='index-watcher', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Index watcher failed for {self.index_path}: {e}")
+
+    def check(self) -> bool:
+        """Nạp thế hệ mới nếu manifest đã đổi; trả về True nếu đã đổi sang bản mới."""
+        if not vector_store_changed(self.index_path):
+            return False
+        signature = index_signature(self.index_path)
+        if signature == self._failed_signature:
+            return False
+        started_at = time.perf_counter()
+        try:
+            db = reload_vector_store(self.index_path)
+        except Exception as e:
+            self._failed_signature = signature
+            self.last_error = str(e)
+            logger.error(f"Failed to load new generation of {self.index_path}, keeping the current one: {e}")
+            return False
+        self._failed_signature = None
+        self.last_error = None
+        self.swaps += 1
+        self.last_swap_ms = round((time.perf_counter() - started_at) * 1000, 2)
+        logger.info(
+            f"Swapped to generation {getattr(db, 'generation', None)} of {self.index_path} "
+            f"({self.last_swap_ms} ms in background)"
+        )
+        return True
+
+
+def evict_vector_store(index_path: str) -> int:
+    """Hook giải phóng chỉ mục khỏi bộ nhớ; lần truy cập sau sẽ load lại từ đĩa."""
+    index_path = os.path.abspath(index_path)
+    _loaded_signatures.pop(index_path, None)
+    return registry.evict("vector_store", index_path)
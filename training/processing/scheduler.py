@@ -0,0 +1,226 @@
+# scheduler.py
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Số request được sinh đồng thời trên model local (mỗi slot là một context riêng, trọng số dùng chung qua mmap)
+LLM_MAX_CONCURRENCY = max(1, int(os.getenv('LLM_MAX_CONCURRENCY', 1)))
+# Chu kỳ (giây) báo trạng thái chờ cho session đang xếp hàng
+QUEUE_POLL_SECONDS = 0.5
+
+# Job nhận số thứ tự slot và trả về generator các phần kết quả
+Job = Callable[[int], Iterator[Any]]
+
+_DONE = object()
+
+
+class Ticket:
+    """Một request trong hàng đợi: kết quả được worker đẩy sang session qua queue riêng."""
+
+    def __init__(self, session_id: str, job: Job, queue_depth: int) -> None:
+        self.session_id = session_id
+        self.job = job
+        self.queue_depth = queue_depth
+        self.enqueued_at = time.perf_counter()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancelled = threading.Event()
+        self._output: queue.Queue = queue.Queue()
+        # Khi có sink (aresults), kết quả được đẩy thẳng sang event loop thay vì vào queue
+        self._sink: Optional[Callable[[Any], None]] = None
+        self._sink_lock = threading.Lock()
+
+    def _put(self, item: Any) -> None:
+        with self._sink_lock:
+            if self._sink is None:
+                self._output.put(item)
+                return
+            try:
+                self._sink(item)
+            except RuntimeError:
+                # Event loop của người nhận đã đóng: không còn ai chờ kết quả
+                pass
+
+    @property
+    def wait_ms(self) -> float:
+        """Thời gian nằm trong hàng đợi (tới lúc này nếu chưa được chạy)."""
+        started_at = self.started_at if self.started_at is not None else time.perf_counter()
+        return round((started_at - self.enqueued_at) * 1000, 2)
+
+    def cancel(self) -> None:
+        """Huỷ request: bỏ khỏi hàng đợi hoặc dừng sinh ở token kế tiếp."""
+        if self.cancelled.is_set():
+            return
+        self.cancelled.set()
+        if self.started_at is None:
+            # Người đang chờ kết quả không phải đợi tới lượt của ticket mới biết nó đã bị huỷ
+            self._put(_DONE)
+
+    def results(self, on_wait: Optional[Callable[['Ticket'], None]] = None) -> Iterator[Any]:
+        """Nhận lần lượt các phần kết quả; `on_wait` được gọi định kỳ khi request còn xếp hàng."""
+        while True:
+            try:
+                item = self._output.get(timeout=QUEUE_POLL_SECONDS)
+            except queue.Empty:
+                if on_wait is not None and self.started_at is None:
+                    on_wait(self)
+                continue
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    async def aresults(self) -> AsyncIterator[Any]:
+        """Như `results` cho coroutine: chờ trên asyncio.Queue nên không giữ thread nào trong lúc xếp hàng."""
+        loop = asyncio.get_running_loop()
+        output: asyncio.Queue = asyncio.Queue()
+        with self._sink_lock:
+            # Chuyển các phần đã có sẵn trong queue rồi mới nhận trực tiếp
+            while True:
+                try:
+                    output.put_nowait(self._output.get_nowait())
+                except queue.Empty:
+                    break
+            self._sink = lambda item: loop.call_soon_threadsafe(output.put_nowait, item)
+        while True:
+            item = await output.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+
+class InferenceScheduler:
+    """Hàng đợi request cho model local, phục vụ bởi `max_concurrency` worker.
+
+    Mỗi session có hàng đợi riêng, các worker lấy request xoay vòng giữa các session
+    nên một session gửi nhiều câu hỏi liên tiếp không chặn các session khác.
+    Request bị huỷ (người dùng rời trang, hỏi câu mới) được bỏ qua hoặc dừng giữa chừng.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, name: str = 'llm') -> None:
+        self.max_concurrency = max_concurrency
+        self._cond = threading.Condition()
+        self._queues: Dict[str, Deque[Ticket]] = {}
+        self._order: Deque[str] = deque()
+        self._queued = 0
+        self._running = 0
+        self._active: Dict[int, Ticket] = {}
+        self._started = 0
+        self._served = 0
+        self._cancelled = 0
+        self._total_wait_ms = 0.0
+        self._workers = [
+            threading.Thread(target=self._work, args=(slot,), name=f'{name}-worker-{slot}', daemon=True)
+            for slot in range(max_concurrency)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, session_id: str, job: Job) -> Ticket:
+        """Đưa job vào hàng đợi của session, trả về ticket để nhận kết quả hoặc huỷ."""
+        with self._cond:
+            ticket = Ticket(session_id, job, queue_depth=self._queued + self._running)
+            pending = self._queues.get(session_id)
+            if pending is None:
+                pending = self._queues[session_id] = deque()
+                self._order.append(session_id)
+            pending.append(ticket)
+            self._queued += 1
+            self._cond.notify()
+        return ticket
+
+    def cancel_session(self, session_id: str) -> int:
+        """Huỷ mọi request còn chờ hoặc đang chạy của một session."""
+        cancelled = 0
+        with self._cond:
+            tickets = list(self._queues.get(session_id, ())) + list(self._active.values())
+            for ticket in tickets:
+                if ticket.session_id == session_id and not ticket.cancelled.is_set():
+                    ticket.cancel()
+                    cancelled += 1
+        return cancelled
+
+    def _next_ticket(self) -> Ticket:
+        # Gọi khi đang giữ self._cond
+        while True:
+            while self._order:
+                session_id = self._order.popleft()
+                pending = self._queues[session_id]
+                ticket = pending.popleft()
+                self._queued -= 1
+                if pending:
+                    # Session còn request: xếp xuống cuối vòng
+                    self._order.append(session_id)
+                else:
+                    del self._queues[session_id]
+                if ticket.cancelled.is_set():
+                    self._cancelled += 1
+                    ticket._put(_DONE)
+                    continue
+                return ticket
+            self._cond.wait()
+
+    def _work(self, slot: int) -> None:
+        while True:
+            with self._cond:
+                ticket = self._next_ticket()
+                ticket.started_at = time.perf_counter()
+                self._active[slot] = ticket
+                self._running += 1
+                self._started += 1
+                self._total_wait_ms += ticket.wait_ms
+            completed = False
+            try:
+                completed = self._run(ticket, slot)
+            finally:
+                ticket.finished_at = time.perf_counter()
+                with self._cond:
+                    self._active.pop(slot, None)
+                    self._running -= 1
+                    if completed:
+                        self._served += 1
+                    else:
+                        self._cancelled += 1
+
+    def _run(self, ticket: Ticket, slot: int) -> bool:
+        """Chạy job của ticket; trả về False nếu bị huỷ hoặc lỗi giữa chừng."""
+        try:
+            results = ticket.job(slot)
+            try:
+                for item in results:
+                    if ticket.cancelled.is_set():
+                        logger.info(f"Cancelled request of session {ticket.session_id} after {ticket.wait_ms} ms wait")
+                        return False
+                    ticket._put(item)
+            finally:
+                results.close()
+            return True
+        except Exception as e:
+            logger.error(f"Inference job of session {ticket.session_id} failed: {e}")
+            ticket._put(e)
+            return False
+        finally:
+            ticket._put(_DONE)
+
+    def stats(self) -> Dict[str, Any]:
+        """Độ sâu hàng đợi, số request đang chạy và thời gian chờ trung bình."""
+        with self._cond:
+            return {
+                'queued': self._queued,
+                'running': self._running,
+                'max_concurrency': self.max_concurrency,
+                'sessions_waiting': len(self._queues),
+                'served': self._served,
+                'cancelled': self._cancelled,  # gồm cả request lỗi giữa chừng
+                'avg_wait_ms': round(self._total_wait_ms / self._started, 2) if self._started else 0.0,
+            }
@@ -0,0 +1,6 @@
+# conftest.py
+import os
+import sys
+
+# Các module của training/processing được import trực tiếp như khi chạy script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,56 @@
+# test_answer_cache.py
+import numpy as np
+import pytest
+
+from answer_cache import SemanticAnswerCache
+from chunk_store import ChunkStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ChunkStore(str(tmp_path / 'db' / 'chunks.db'))
+    store.add(['a', 'b', 'c'], ['a', 'b', 'c'], [{}, {}, {}], 'w1')
+    store.publish(1, 'w1')
+    return store
+
+
+@pytest.fixture
+def cache(tmp_path, store):
+    cache = SemanticAnswerCache(str(tmp_path / 'db' / 'answer_cache.db'), threshold=0.99)
+    cache.set_index_version('build-1', 1, store)
+    cache.put('q1', [1.0, 0.0, 0.0], 'dựa trên a', ['a'])
+    cache.put('q2', [0.0, 1.0, 0.0], 'dựa trên b và c', ['b', 'c'])
+    cache.put('q3', [0.0, 0.0, 1.0], 'không rõ nguồn')
+    return cache
+
+
+def answers(cache):
+    return [cache.lookup(vector) and cache.lookup(vector)[0] for vector in np.eye(3)]
+
+
+def test_new_generation_only_drops_answers_on_changed_chunks(cache, store):
+    # Delta thay chunk c: chỉ câu trả lời dựa trên c (và câu không rõ nguồn) bị xoá
+    store.retire([store.labels(['c'], 'w2')['c']], 'w2')
+    store.add(['c'], ['c mới'], [{}], 'w2')
+    store.publish(2, 'w2')
+    cache.set_index_version('build-1', 2, store)
+    assert answers(cache) == ['dựa trên a', None, None]
+
+    # Compaction (cùng build, không chunk nào đổi) giữ nguyên cache
+    cache.set_index_version('build-1', 3, store)
+    assert answers(cache) == ['dựa trên a', None, None]
+
+    # Chunk a bị xoá hẳn
+    store.retire([store.labels(['a'], 'w4')['a']], 'w4')
+    store.publish(4, 'w4')
+    cache.set_index_version('build-1', 4, store)
+    assert len(cache) == 0
+
+
+def test_rebuild_or_missing_chunk_store_drops_everything(cache, store):
+    cache.set_index_version('build-1', 2, None)
+    assert answers(cache) == [None, None, None]
+
+    cache.put('q1', [1.0, 0.0, 0.0], 'dựa trên a', ['a'])
+    cache.set_index_version('build-2', 1, store)
+    assert len(cache) == 0
@@ -0,0 +1,58 @@
+# test_chunk_store.py
+import pytest
+
+from chunk_store import ChunkStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChunkStore(str(tmp_path / 'db' / 'chunks.db'))
+
+
+def rows(store):
+    return store._conn.execute('SELECT chunk_id, generation, retired FROM chunks ORDER BY id').fetchall()
+
+
+def test_replaced_rows_stay_readable_until_old_generation_is_gone(store):
+    old = store.add(['a', 'b'], ['phạt nguội cũ', 'b'], [{}, {}], 'w1')
+    store.publish(1, 'w1', retained_generation=None)
+
+    # Thế hệ 2 thay chunk a; trước khi publish, reader thế hệ 1 và tìm từ khoá vẫn thấy bản cũ
+    store.retire([store.labels(['a'], 'w2')['a']], 'w2')
+    new = store.add(['a'], ['phạt nguội mới'], [{}], 'w2')
+    assert store.labels(['a'], 'w2') == {'a': new[0]}
+    assert store.labels(['a'], 'other') == {'a': old[0]}
+    assert [doc.page_content for doc in store.search_text('phat nguoi')] == ['phạt nguội cũ']
+
+    store.publish(2, 'w2', retained_generation=1)
+    assert store.get(old)[0].page_content == 'phạt nguội cũ'
+    assert [doc.page_content for doc in store.search_text('phat nguoi')] == ['phạt nguội mới']
+    assert len(store) == 2
+
+    # Thế hệ 1 đã bị dọn khỏi đĩa: bản cũ được xoá hẳn
+    store.publish(3, 'w3', retained_generation=2)
+    assert store.get(old)[0] is None
+    assert rows(store) == [('b', 1, None), ('a', 2, None)]
+
+
+def test_publish_is_idempotent_and_cleans_up_dead_writers(store):
+    store.add(['a'], ['a'], [{}], 'w1')
+    store.publish(1, 'w1')
+    # Tiến trình ghi w2 chết trước khi đổi manifest
+    store.retire(list(store.labels(['a'], 'w2').values()), 'w2')
+    store.add(['b'], ['b'], [{}], 'w2')
+
+    assert not store.publish(1, 'w1')
+    store.add(['c'], ['c'], [{}], 'w3')
+    assert store.publish(2, 'w3')
+    assert rows(store) == [('a', 1, None), ('c', 2, None)]
+
+
+def test_replace_all_retires_previous_rows(store):
+    store.add(['a', 'b'], ['a', 'b'], [{}, {}], 'w1')
+    store.publish(1, 'w1')
+    store.add(['a'], ['a2'], [{}], 'w2')
+    store.publish(2, 'w2', replace_all=True, retained_generation=1)
+
+    assert rows(store) == [('a', 1, 2), ('b', 1, 2), ('a', 2, None)]
+    assert len(store) == 1
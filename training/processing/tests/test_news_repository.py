@@ -0,0 +1,84 @@
+# test_news_repository.py
+import sqlite3
+
+import pytest
+
+from news_repository import NewsRepository, fold_text, fts_query
+
+
+def test_fold_text_only_replaces_d_stroke():
+    assert fold_text('Đường đi được') == 'Dường di dược'
+    assert fold_text('phạt nguội') == 'phạt nguội'
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('phạt nguội', '"phạt" "nguội"*'),
+    ('đăng ký', '"dăng" "ký"*'),
+    ('"xe" OR -máy* title:ô NEAR(tô)', '"xe" "OR" "máy" "title" "ô" "NEAR" "tô"*'),
+    ('  ', ''),
+    ('"*-:()', ''),
+])
+def test_fts_query_quotes_every_word(text, expected):
+    assert fts_query(text) == expected
+
+
+@pytest.fixture
+def repository(tmp_path):
+    db_path = str(tmp_path / 'news.db')
+    with sqlite3.connect(db_path) as conn:
+        conn.execute('CREATE TABLE news (id INTEGER PRIMARY KEY, url VARCHAR, hash VARCHAR, title VARCHAR, content VARCHAR)')
+        conn.executemany('INSERT INTO news (url, title, content) VALUES (?, ?, ?)', [
+            ('u1', 'Mức phạt nguội mới', 'Xử phạt vi phạm giao thông qua camera.'),
+            ('u2', 'Đăng ký xe máy', 'Thủ tục đăng ký xe tại công an xã.'),
+        ])
+    return NewsRepository(db_path)
+
+
+def test_search_ignores_diacritics_and_d_stroke(repository):
+    rows, total = repository.search('phat nguoi')
+    assert total == 1 and rows[0]['url'] == 'u1'
+
+    rows, total = repository.search('dang ky')
+    assert total == 1 and rows[0]['url'] == 'u2'
+    # snippet đánh dấu trên văn bản gốc, vẫn giữ chữ đ
+    assert '**đăng**' in rows[0]['snippet']
+
+
+def test_search_with_fts_syntax_does_not_raise(repository):
+    rows, total = repository.search('"xe* -(máy')
+    assert total == 1 and rows[0]['url'] == 'u2'
+    assert repository.search('-') == ([], 0)
+
+
+def test_search_matches_prefix_of_last_word(repository):
+    _, total = repository.search('giao thô')
+    assert total == 1
+
+
+def test_new_rows_are_indexed(repository):
+    with sqlite3.connect(repository.db_path) as conn:
+        conn.execute("INSERT INTO news (url, title, content) VALUES ('u3', 'Đèn đỏ', 'Vượt đèn đỏ bị phạt.')")
+
+    rows, _ = repository.search('den do')
+    assert [row['url'] for row in rows] == ['u3']
+
+
+def test_latest_pages_by_keyset(repository):
+    first, more = repository.latest(limit=1)
+    assert [row['url'] for row in first] == ['u2'] and more
+    second, more = repository.latest(before_id=first[-1]['id'], limit=1)
+    assert [row['url'] for row in second] == ['u1'] and not more
+    assert second[0]['preview'] == 'Xử phạt vi phạm giao thông qua camera.'
+
+
+def test_count_and_preview_follow_writes(repository):
+    with sqlite3.connect(repository.db_path) as conn:
+        conn.execute("INSERT INTO news (url, title, content) VALUES ('u3', 'Đèn đỏ', 'Vượt đèn đỏ bị phạt.')")
+        conn.execute("DELETE FROM news WHERE url = 'u1'")
+        conn.execute("UPDATE news SET content = 'Nội dung mới' WHERE url = 'u2'")
+
+    assert repository.count() == 2
+    assert repository.latest() == ([
+        {'id': 3, 'title': 'Đèn đỏ', 'url': 'u3', 'preview': 'Vượt đèn đỏ bị phạt.'},
+        {'id': 2, 'title': 'Đăng ký xe máy', 'url': 'u2', 'preview': 'Nội dung mới'},
+    ], False)
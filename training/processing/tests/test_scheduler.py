@@ -0,0 +1,98 @@
+# test_scheduler.py
+import asyncio
+import threading
+
+import pytest
+
+from scheduler import InferenceScheduler
+
+
+def blocking_job(started, release):
+    def job(slot):
+        started.set()
+        release.wait(5)
+        yield 'blocker'
+    return job
+
+
+def recording_job(order, name):
+    def job(slot):
+        order.append(name)
+        yield name
+    return job
+
+
+@pytest.fixture
+def busy_scheduler():
+    """Scheduler một worker đang bận, để các request sau cùng nằm trong hàng đợi."""
+    scheduler = InferenceScheduler(max_concurrency=1, name='test')
+    started, release = threading.Event(), threading.Event()
+    blocker = scheduler.submit('blocker', blocking_job(started, release))
+    assert started.wait(5)
+    yield scheduler, release
+    release.set()
+    list(blocker.results())
+
+
+def test_round_robin_between_sessions(busy_scheduler):
+    scheduler, release = busy_scheduler
+    order = []
+    tickets = [scheduler.submit(session, recording_job(order, name))
+               for session, name in [('a', 'a1'), ('a', 'a2'), ('a', 'a3'), ('b', 'b1'), ('c', 'c1'), ('b', 'b2')]]
+    release.set()
+    for ticket in tickets:
+        list(ticket.results())
+
+    assert order == ['a1', 'b1', 'c1', 'a2', 'b2', 'a3']
+    assert scheduler.stats()['served'] == 7
+
+
+def test_cancel_before_start_skips_job(busy_scheduler):
+    scheduler, release = busy_scheduler
+    order = []
+    cancelled = scheduler.submit('a', recording_job(order, 'a1'))
+    kept = scheduler.submit('b', recording_job(order, 'b1'))
+
+    cancelled.cancel()
+    # Người chờ được trả về ngay, không đợi tới lượt của ticket
+    assert list(cancelled.results()) == []
+    release.set()
+    assert list(kept.results()) == ['b1']
+    assert order == ['b1']
+
+
+def test_cancel_session_only_touches_that_session(busy_scheduler):
+    scheduler, release = busy_scheduler
+    order = []
+    tickets = [scheduler.submit(session, recording_job(order, name))
+               for session, name in [('a', 'a1'), ('b', 'b1'), ('a', 'a2')]]
+
+    assert scheduler.cancel_session('a') == 2
+    release.set()
+    assert [list(ticket.results()) for ticket in tickets] == [[], ['b1'], []]
+    assert order == ['b1']
+
+
+def test_aresults_streams_and_raises():
+    scheduler = InferenceScheduler(max_concurrency=1, name='test')
+
+    def succeeding(slot):
+        yield from ['x', 'y']
+
+    def failing(slot):
+        yield 'partial'
+        raise RuntimeError('boom')
+
+    async def collect(ticket):
+        return [item async for item in ticket.aresults()]
+
+    assert asyncio.run(collect(scheduler.submit('a', succeeding))) == ['x', 'y']
+    received = []
+
+    async def collect_until_error(ticket):
+        async for item in ticket.aresults():
+            received.append(item)
+
+    with pytest.raises(RuntimeError, match='boom'):
+        asyncio.run(collect_until_error(scheduler.submit('a', failing)))
+    assert received == ['partial']
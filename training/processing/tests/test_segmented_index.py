@@ -0,0 +1,111 @@
+# test_segmented_index.py
+import numpy as np
+import pytest
+
+from vector_index import (MMAP_LABELS_FILE, MMAP_NORMS_FILE, MMAP_VECTORS_FILE, FaissAnnIndex, MmapFaissIndex,
+                          SegmentedIndex, _flat_top_k, needs_compaction)
+
+DIM = 8
+
+
+def write_base(directory, vectors, labels):
+    np.save(directory / MMAP_VECTORS_FILE, vectors)
+    np.save(directory / MMAP_NORMS_FILE, (vectors ** 2).sum(axis=1))
+    np.save(directory / MMAP_LABELS_FILE, labels)
+    # search_vectors không đọc chunk store
+    return MmapFaissIndex(None, str(directory), chunk_store=object())
+
+
+def brute_force(vectors, labels, queries, k):
+    """Top-k chính xác trên tập vector còn sống, pad -1 như faiss."""
+    distances = ((queries[:, None, :] - vectors[None, :, :]) ** 2).sum(axis=2)
+    order = np.argsort(distances, axis=1)[:, :k]
+    missing = k - order.shape[1]
+    scores = np.pad(np.take_along_axis(distances, order, axis=1), ((0, 0), (0, missing)), constant_values=np.inf)
+    return scores, np.pad(labels[order], ((0, 0), (0, missing)), constant_values=-1)
+
+
+@pytest.mark.parametrize('k', [1, 5, 40])
+def test_merge_matches_brute_force(tmp_path, k):
+    rng = np.random.default_rng(k)
+    base_vectors = rng.normal(size=(30, DIM)).astype(np.float32)
+    base_labels = np.arange(1, 31, dtype=np.int64)
+    delta_vectors = rng.normal(size=(6, DIM)).astype(np.float32)
+    delta_labels = np.arange(31, 37, dtype=np.int64)
+    # Tombstone trên cả base lẫn một vector delta đã bị delta sau thay thế
+    tombstones = np.array([2, 5, 17, 29, 33], dtype=np.int64)
+
+    index = SegmentedIndex(write_base(tmp_path, base_vectors, base_labels), delta_vectors, delta_labels, tombstones)
+    queries = rng.normal(size=(4, DIM)).astype(np.float32)
+    scores, labels = index.search_vectors(queries, k)
+
+    all_vectors = np.vstack([base_vectors, delta_vectors])
+    all_labels = np.concatenate([base_labels, delta_labels])
+    live = ~np.isin(all_labels, tombstones)
+    expected_scores, expected_labels = brute_force(all_vectors[live], all_labels[live], queries, k)
+
+    assert index.count == live.sum()
+    np.testing.assert_array_equal(labels, expected_labels)
+    found = labels >= 0
+    np.testing.assert_allclose(scores[found], expected_scores[found], rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize('k, block', [(1, 7), (5, 4), (12, 100)])
+def test_blocked_flat_scan_matches_brute_force(tmp_path, monkeypatch, k, block):
+    rng = np.random.default_rng(block)
+    vectors = rng.normal(size=(50, DIM)).astype(np.float32)
+    labels = np.arange(100, 150, dtype=np.int64)
+    monkeypatch.setattr(_flat_top_k, '__defaults__', (block,))
+    queries = rng.normal(size=(3, DIM)).astype(np.float32)
+
+    scores, found = write_base(tmp_path, vectors, labels).search_vectors(queries, k)
+
+    expected_scores, expected_labels = brute_force(vectors, labels, queries, k)
+    np.testing.assert_array_equal(found, expected_labels)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-4, atol=1e-4)
+
+
+def test_tombstoned_base_never_returned(tmp_path):
+    vectors = np.eye(DIM, dtype=np.float32)
+    labels = np.arange(1, DIM + 1, dtype=np.int64)
+    index = SegmentedIndex(write_base(tmp_path, vectors, labels), np.zeros((0, DIM), dtype=np.float32),
+                           np.zeros(0, dtype=np.int64), labels[:DIM - 1])
+
+    _, found = index.search_vectors(vectors[:1], 3)
+
+    assert found.tolist() == [[DIM, -1, -1]]
+
+
+def test_needs_compaction_thresholds(monkeypatch):
+    import vector_index
+    monkeypatch.setattr(vector_index, 'LSM_MAX_DELTAS', 3)
+    monkeypatch.setattr(vector_index, 'LSM_MAX_DELTA_RATIO', 0.5)
+    monkeypatch.setattr(vector_index, 'LSM_MAX_TOMBSTONES', 10)
+
+    def manifest(*deltas):
+        count = 100 + sum(added - removed for added, removed in deltas)
+        return {'count': count, 'deltas': [{'count': added, 'tombstones': removed} for added, removed in deltas]}
+
+    assert not needs_compaction(None)
+    assert not needs_compaction(manifest())
+    assert not needs_compaction(manifest((5, 1), (5, 1)))
+    assert needs_compaction(manifest((1, 0), (1, 0), (1, 0)))
+    assert needs_compaction(manifest((60, 0)))
+    assert needs_compaction(manifest((1, 10)))
+
+
+def test_folding_into_hnsw_rebuilds_without_tombstones():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(300, DIM)).astype(np.float32)
+    index = FaissAnnIndex(None, params={'kind': 'hnsw', 'M': 8}, chunk_store=object())
+    index.add_vectors(vectors, np.arange(1, 301))
+    index.train()
+    assert not index.supports_delete
+
+    replacement = rng.normal(size=(1, DIM)).astype(np.float32)
+    index.fold_segments(replacement, np.array([301]), np.array([5, 17]))
+
+    assert index.count == 299 and index.is_trained
+    _, found = index.search_vectors(np.vstack([vectors[4], vectors[16], replacement[0]]), 1)
+    assert 5 not in found and 17 not in found
+    assert found[2, 0] == 301
@@ -0,0 +1,975 @@
+# vector_index.py
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import weakref
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+
+from filelock import FileLock
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from chunk_store import get_chunk_store
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 2
+LOCK_FILE = '.lock'
+# Khoá cho cả chu trình load - sửa - lưu của tiến trình ghi (vectordb.py, bộ index phản hồi)
+WRITER_LOCK_FILE = '.writer.lock'
+GENERATION_PREFIX = 'gen-'
+# Delta segment: vector thêm mới sau base, cùng tập tombstone (nhãn bị xoá/thay thế)
+DELTA_PREFIX = 'delta-'
+TOMBSTONES_FILE = 'tombstones.npy'
+
+VECTOR_INDEX_BACKEND = os.getenv('VECTOR_INDEX_BACKEND', 'faiss_flat')
+# Tham số build của backend dạng JSON, ví dụ {"kind": "ivf_pq", "nlist": 1024, "m": 48}
+VECTOR_INDEX_PARAMS = json.loads(os.getenv('VECTOR_INDEX_PARAMS', '{}'))
+# Số vector tối đa dùng để huấn luyện quantizer IVF/PQ
+ANN_TRAIN_SIZE = int(os.getenv('ANN_TRAIN_SIZE', 100000))
+# Phía truy vấn load chỉ mục FAISS ở chế độ mmap chỉ đọc (dùng chung page cache giữa các worker)
+VECTOR_INDEX_MMAP = os.getenv('VECTOR_INDEX_MMAP', '1') == '1'
+# Số vector mỗi khối khi quét vét cạn chỉ mục phẳng mmap: bộ nhớ tạm theo khối thay vì theo cả chỉ mục
+FLAT_SCAN_BLOCK = int(os.getenv('FLAT_SCAN_BLOCK', 16384))
+# Ngưỡng gộp delta segment vào base: số segment, tỉ lệ vector delta so với base, số tombstone
+LSM_MAX_DELTAS = int(os.getenv('LSM_MAX_DELTAS', 16))
+LSM_MAX_DELTA_RATIO = float(os.getenv('LSM_MAX_DELTA_RATIO', 0.1))
+LSM_MAX_TOMBSTONES = int(os.getenv('LSM_MAX_TOMBSTONES', 4096))
+# Số lần đọc lại manifest khi thế hệ đang load bị thay và dọn mất giữa chừng
+LOAD_ATTEMPTS = 3
+
+FAISS_INDEX_FILE = 'index.faiss'
+# Docstore pickle của LangChain FAISS (bố cục cũ, chỉ còn đọc để chuyển sang ChunkStore)
+LANGCHAIN_DOCSTORE_FILE = 'index.pkl'
+# File phụ của mỗi thế hệ FAISS phẳng cho chế độ mmap
+MMAP_VECTORS_FILE = 'vectors.npy'
+MMAP_NORMS_FILE = 'norms.npy'
+MMAP_LABELS_FILE = 'labels.npy'
+
+
+class SearchIndex(ABC):
+    """Giao diện tìm kiếm chung của mọi chỉ mục vector, kể cả chỉ mục load chỉ đọc (mmap, delta segment)."""
+
+    backend = ''
+
+    def __init__(self, embeddings: Any, params: Optional[Dict[str, Any]] = None) -> None:
+        self.embeddings = embeddings
+        self.params = dict(params or {})
+        self.generation = 0
+        # Đổi chỉ khi chỉ mục được build lại từ đầu; delta segment, compaction và cập nhật tăng dần giữ nguyên
+        self.build_id = uuid.uuid4().hex
+
+    @property
+    def model_id(self) -> Optional[str]:
+        return getattr(self.embeddings, 'model_id', None)
+
+    @property
+    @abstractmethod
+    def count(self) -> int:
+        """Số vector trong chỉ mục."""
+
+    @property
+    @abstractmethod
+    def dim(self) -> Optional[int]:
+        """Số chiều vector, None nếu chỉ mục còn rỗng."""
+
+    @abstractmethod
+    def similarity_search_with_score_by_vector(
+        self, vector: Sequence[float], k: int = 4, **search_params: Any
+    ) -> List[Tuple[Document, float]]:
+        """Tìm k chunk gần nhất với vector truy vấn; search_params là tham số riêng của backend (nprobe, ef_search)."""
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **search_params: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embeddings.embed_query(query), k, **search_params)
+
+    def as_retriever(self, search_kwargs: Optional[Dict[str, Any]] = None, **kwargs: Any) -> "VectorIndexRetriever":
+        return VectorIndexRetriever(index=self, search_kwargs=dict(search_kwargs or {}), **kwargs)
+
+    def close(self) -> None:
+        """Giải phóng tài nguyên ngoài bộ nhớ (thư mục tạm); mặc định không có gì."""
+
+
+class VectorIndex(SearchIndex):
+    """Chỉ mục vector sửa được (FAISS flat, FAISS IVF/HNSW, Chroma).
+
+    Mỗi lần `save` ghi một thế hệ (generation) mới vào thư mục riêng rồi mới đổi
+    `manifest.json` bằng `os.replace`, nên reader không bao giờ load phải chỉ mục ghi dở.
+
+    Bố cục trên đĩa:
+        <path>/manifest.json       backend, model_id, dim, count, params, generation hiện tại, deltas
+        <path>/gen-000007/         file của backend cho thế hệ 7 (base, bất biến)
+        <path>/delta-000008/       vector thêm sau base và tombstone (xem `append_segment`)
+
+    Với backend FAISS, thay đổi nhỏ được ghi thành delta segment thay vì ghi lại cả base;
+    `save` một chỉ mục load ở chế độ ghi sẽ gộp các delta vào base mới (compaction).
+    """
+
+    def __init__(self, embeddings: Any, store: Any = None, params: Optional[Dict[str, Any]] = None) -> None:
+        super().__init__(embeddings, params)
+        self.store = store
+
+    @property
+    def supports_delete(self) -> bool:
+        """`delete` xoá được vector (HNSW đã huấn luyện thì không, phải build lại)."""
+        return True
+
+    @abstractmethod
+    def add_embeddings(
+        self,
+        texts: Sequence[str],
+        vectors: Sequence[Sequence[float]],
+        metadatas: Optional[Sequence[dict]] = None,
+        ids: Optional[Sequence[str]] = None,
+    ) -> List[str]:
+        """Thêm vector đã tính sẵn; id đã tồn tại sẽ bị ghi đè."""
+
+    @abstractmethod
+    def delete(self, ids: Sequence[str]) -> None:
+        """Xoá vector theo id, bỏ qua id không tồn tại."""
+
+    @abstractmethod
+    def _write(self, directory: str) -> None:
+        """Ghi file của backend vào thư mục (rỗng) được chỉ định."""
+
+    @classmethod
+    @abstractmethod
+    def _read(cls, directory: str, embeddings: Any, params: Dict[str, Any]) -> "VectorIndex":
+        """Đọc chỉ mục từ thư mục của một thế hệ."""
+
+    def add_texts(
+        self,
+        texts: Sequence[str],
+        metadatas: Optional[Sequence[dict]] = None,
+        ids: Optional[Sequence[str]] = None,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_embeddings(texts, self.embeddings.embed_documents(texts), metadatas, ids)
+
+    def add_documents(self, documents: Sequence[Document], ids: Optional[Sequence[str]] = None) -> List[str]:
+        return self.add_texts(
+            [document.page_content for document in documents],
+            [document.metadata for document in documents],
+            ids,
+        )
+
+    def _recover(self, manifest: Dict[str, Any]) -> None:
+        """Hoàn tất thay đổi của tiến trình ghi trước nếu nó dừng giữa lúc đổi manifest và publish (mặc định không có)."""
+
+    def _publish(self, manifest: Dict[str, Any]) -> None:
+        """Gọi ngay sau khi manifest của thế hệ mới đã được đổi (mặc định không có gì phải publish)."""
+
+    def manifest(self) -> Dict[str, Any]:
+        return {
+            'version': MANIFEST_VERSION,
+            'backend': self.backend,
+            'model_id': self.model_id,
+            'dim': self.dim,
+            'count': self.count,
+            'params': self.params,
+        }
+
+    def save(self, path: str) -> int:
+        """Lưu nguyên tử: ghi vào thư mục tạm, đổi tên thành thế hệ mới, rồi mới đổi manifest."""
+        os.makedirs(path, exist_ok=True)
+        with FileLock(os.path.join(path, LOCK_FILE)):
+            current = read_manifest(path) or {}
+            self._recover(current)
+            generation = int(current.get('generation', 0)) + 1
+            name = f"{GENERATION_PREFIX}{generation:06d}"
+
+            tmp_dir = tempfile.mkdtemp(prefix=f".tmp-{name}-", dir=path)
+            try:
+                self._write(tmp_dir)
+                _fsync_tree(tmp_dir)
+                os.rename(tmp_dir, os.path.join(path, name))
+            except Exception:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+
+            manifest = {
+                **self.manifest(),
+                'generation': generation,
+                'build_id': self.build_id,
+                # Thế hệ cũ nhất còn đủ file sau lần dọn dưới đây: base của thế hệ liền trước
+                'retained_generation': _base_generation(current),
+                'current': name,
+                'created_at': time.time(),
+            }
+            _write_json_atomic(os.path.join(path, MANIFEST_FILE), manifest)
+            self.generation = generation
+            self._publish(manifest)
+            # Giữ lại thế hệ liền trước (base và delta của nó) để reader đang load dở không bị xoá mất file
+            _remove_old_generations(path, {name, current.get('current')} | set(_delta_names(current)))
+        logger.info(f"Saved {self.backend} index generation {generation} ({self.count} vectors) to {path}")
+        return generation
+
+
+class FaissFlatIndex(VectorIndex):
+    """FAISS tìm kiếm chính xác (IndexFlatL2 bọc trong IndexIDMap2).
+
+    Nhãn của mỗi vector là id của chunk trong ChunkStore (bảng chunks của news_data.db):
+    chỉ mục chỉ giữ vector, text/metadata được đọc theo id sau khi tìm.
+    Chunk thêm/xoá trong bộ nhớ mang `token` của chỉ mục và chỉ được publish sau khi `save` đổi manifest,
+    nên reader của thế hệ đang phục vụ vẫn đọc được chunk cũ trong lúc build.
+    """
+
+    backend = 'faiss_flat'
+
+    def __init__(self, embeddings: Any, store: Any = None, params: Optional[Dict[str, Any]] = None,
+                 chunk_store: Any = None) -> None:
+        super().__init__(embeddings, store, params)
+        self.chunk_store = chunk_store or get_chunk_store()
+        self.token = uuid.uuid4().hex
+        # Chỉ mục tạo mới (không load từ đĩa) thay toàn bộ chunk của thế hệ trước khi được lưu
+        self.replaces_all = store is None
+
+    @property
+    def count(self) -> int:
+        return self.store.ntotal if self.store is not None else 0
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self.store.d if self.store is not None else None
+
+    @property
+    def faiss_index(self) -> Any:
+        return self.store
+
+    def _new_faiss_index(self, dim: int) -> Any:
+        import faiss
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+
+    def add_vectors(self, vectors: Any, labels: Any) -> None:
+        """Thêm vector với nhãn cho trước, không ghi chunk store (dùng cho benchmark, di chuyển dữ liệu)."""
+        import numpy as np
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.store is None:
+            self.store = self._new_faiss_index(vectors.shape[1])
+        self.store.add_with_ids(vectors, np.asarray(labels, dtype=np.int64))
+
+    def export_vectors(self) -> Tuple[Any, Any]:
+        """Toàn bộ (nhãn, vector) của chỉ mục phẳng theo thứ tự lưu trữ."""
+        import faiss
+        flat = faiss.downcast_index(self.store.index)
+        return faiss.vector_to_array(self.store.id_map), flat.reconstruct_n(0, flat.ntotal)
+
+    def add_embeddings(self, texts, vectors, metadatas=None, ids=None):
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        # Chunk đã tồn tại được thay bằng bản mới (id mới), vector cũ bị xoá khỏi chỉ mục
+        self.delete(ids)
+        labels = self.chunk_store.add(ids, list(texts), metadatas, self.token)
+        self.add_vectors(vectors, labels)
+        return ids
+
+    def delete(self, ids):
+        if not ids:
+            return
+        labels = list(self.chunk_store.labels(ids, self.token).values())
+        if not labels:
+            return
+        if self.store is not None:
+            self._remove_vectors(labels)
+        self.chunk_store.retire(labels, self.token)
+
+    def manifest(self):
+        return {**super().manifest(), 'chunks': {'token': self.token, 'replace_all': self.replaces_all}}
+
+    def _recover(self, manifest):
+        publish_chunks(self.chunk_store, manifest, cleanup=False)
+
+    def _publish(self, manifest):
+        publish_chunks(self.chunk_store, manifest)
+        self.token, self.replaces_all = uuid.uuid4().hex, False
+
+    def _remove_vectors(self, labels: List[int]) -> None:
+        import numpy as np
+        self.store.remove_ids(np.asarray(labels, dtype=np.int64))
+
+    def fold_segments(self, vectors: Any, labels: Any, tombstones: Any) -> None:
+        """Gộp delta segment vào chỉ mục trong bộ nhớ; lần `save` sau ghi chúng thành base mới."""
+        if len(labels):
+            self.add_vectors(vectors, labels)
+        if len(tombstones) and self.store is not None:
+            self._remove_vectors([int(label) for label in tombstones])
+
+    def search_vectors(self, queries: Any, k: int, **search_params: Any) -> Tuple[Any, Any]:
+        """Tìm trên ma trận truy vấn (n, dim), trả về (khoảng cách, nhãn) như faiss.Index.search."""
+        return self.store.search(queries, k)
+
+    def similarity_search_with_score_by_vector(self, vector, k=4, **search_params):
+        if self.count == 0:
+            return []
+        import numpy as np
+        scores, labels = self.search_vectors(np.asarray([vector], dtype=np.float32), k, **search_params)
+        return _documents_for_hits(self.chunk_store, labels[0], scores[0])
+
+    def _write(self, directory):
+        if self.store is None:
+            raise ValueError("Cannot save an empty FAISS index.")
+        import faiss
+        faiss.write_index(self.store, os.path.join(directory, FAISS_INDEX_FILE))
+        self._write_mmap_files(directory)
+
+    def _write_mmap_files(self, directory: str) -> None:
+        """File phụ cho chế độ mmap của chỉ mục phẳng: vector thô, bình phương chuẩn và nhãn."""
+        import numpy as np
+        labels, vectors = self.export_vectors()
+        np.save(os.path.join(directory, MMAP_VECTORS_FILE), vectors)
+        np.save(os.path.join(directory, MMAP_NORMS_FILE), (vectors ** 2).sum(axis=1))
+        np.save(os.path.join(directory, MMAP_LABELS_FILE), labels)
+
+    @classmethod
+    def _read(cls, directory, embeddings, params):
+        if os.path.exists(os.path.join(directory, LANGCHAIN_DOCSTORE_FILE)):
+            return cls._migrate_langchain(directory, embeddings, params)
+        import faiss
+        return cls(embeddings, faiss.read_index(os.path.join(directory, FAISS_INDEX_FILE)), params)
+
+    @classmethod
+    def _migrate_langchain(cls, directory: str, embeddings: Any, params: Dict[str, Any]) -> "FaissFlatIndex":
+        """Chuyển chỉ mục LangChain FAISS cũ (docstore pickle) sang ChunkStore; chỉ cần chạy một lần."""
+        from langchain_community.vectorstores import FAISS
+        logger.warning(f"Migrating pickled LangChain FAISS docstore at {directory} into the chunk store")
+        store = FAISS.load_local(directory, embeddings, allow_dangerous_deserialization=True)
+        try:
+            vectors = store.index.reconstruct_n(0, store.index.ntotal)
+        except RuntimeError:
+            raise ValueError(f"Cannot migrate the approximate index at {directory}; rebuild it with vectordb.py --rebuild.")
+        ids = [store.index_to_docstore_id[position] for position in range(store.index.ntotal)]
+        documents = [store.docstore.search(doc_id) for doc_id in ids]
+        index = cls(embeddings, params={key: value for key, value in params.items() if key != 'trained'})
+        index.add_embeddings(
+            [document.page_content for document in documents],
+            vectors,
+            [document.metadata for document in documents],
+            ids,
+        )
+        return index
+
+
+class FaissAnnIndex(FaissFlatIndex):
+    """FAISS xấp xỉ: IVF-Flat, IVF-PQ hoặc HNSW (params['kind']).
+
+    Vector được gom vào một chỉ mục phẳng tạm cho đến khi `train` (tự gọi khi save),
+    nên quantizer được huấn luyện trên mẫu của toàn bộ dữ liệu chứ không chỉ lô đầu tiên.
+    Sau khi huấn luyện, vector mới được thêm thẳng vào chỉ mục xấp xỉ.
+
+    Tham số build: nlist, nprobe (IVF), m, nbits (PQ), M, ef_construction, ef_search (HNSW).
+    Tham số truy vấn: nprobe, ef_search; mặc định lấy theo params đã lưu trong manifest.
+    """
+
+    backend = 'faiss_ann'
+    kinds = ('ivf_flat', 'ivf_pq', 'hnsw')
+
+    @property
+    def kind(self) -> str:
+        return self.params.setdefault('kind', 'ivf_flat')
+
+    @property
+    def is_trained(self) -> bool:
+        return self.store is not None and bool(self.params.get('trained'))
+
+    def train(self) -> None:
+        """Huấn luyện quantizer trên các vector đã gom và chuyển sang chỉ mục xấp xỉ."""
+        if self.is_trained or self.count == 0:
+            return
+        import faiss
+        started_at = time.perf_counter()
+        labels, vectors = self.export_vectors()
+        index = self._build_ann_index(vectors)
+        if self.kind == 'hnsw':
+            # HNSW tự đánh số theo thứ tự thêm: bọc IndexIDMap để giữ nhãn là id chunk
+            index = faiss.IndexIDMap(index)
+        index.add_with_ids(vectors, labels)
+        self.store = index
+        self.params['trained'] = True
+        logger.info(
+            f"Trained {self.kind} index on {min(len(vectors), ANN_TRAIN_SIZE)} of {len(vectors)} vectors "
+            f"in {time.perf_counter() - started_at:.1f}s"
+        )
+
+    def _build_ann_index(self, vectors: Any) -> Any:
+        import faiss
+        count, dim = vectors.shape
+        kind = self.kind
+        if kind == 'hnsw':
+            index = faiss.IndexHNSWFlat(dim, int(self.params.setdefault('M', 32)))
+            index.hnsw.efConstruction = int(self.params.setdefault('ef_construction', 200))
+            index.hnsw.efSearch = int(self.params.setdefault('ef_search', 64))
+            return index
+
+        # FAISS cần khoảng 39 điểm/cụm để huấn luyện ổn định
+        nlist = max(1, min(int(self.params.setdefault('nlist', 256)), count // 39))
+        self.params['nlist'] = nlist
+        quantizer = faiss.IndexFlatL2(dim)
+        if kind == 'ivf_flat':
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        elif kind == 'ivf_pq':
+            m = int(self.params.setdefault('m', 48))
+            if dim % m:
+                raise ValueError(f"IVF-PQ needs m dividing the vector dimension ({dim}), got m={m}")
+            # Mỗi codebook PQ cần ít nhất 2^nbits điểm huấn luyện
+            nbits = min(int(self.params.setdefault('nbits', 8)), max(1, count.bit_length() - 1))
+            self.params['nbits'] = nbits
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, nbits)
+        else:
+            raise ValueError(f"Unknown FAISS ANN kind '{kind}', expected one of {self.kinds}")
+        index.train(self._training_sample(vectors))
+        index.nprobe = int(self.params.setdefault('nprobe', 8))
+        return index
+
+    def _training_sample(self, vectors: Any) -> Any:
+        if len(vectors) <= ANN_TRAIN_SIZE:
+            return vectors
+        import numpy as np
+        rng = np.random.default_rng(0)
+        return vectors[rng.choice(len(vectors), ANN_TRAIN_SIZE, replace=False)]
+
+    def export_vectors(self):
+        if self.is_trained:
+            raise NotImplementedError("Vectors of a trained approximate index cannot be exported exactly.")
+        return super().export_vectors()
+
+    def search_vectors(self, queries, k, nprobe=None, ef_search=None, **search_params):
+        if not self.is_trained:
+            return super().search_vectors(queries, k)
+        return self.store.search(queries, k, params=_faiss_search_params(self.params, nprobe, ef_search))
+
+    @property
+    def supports_delete(self) -> bool:
+        return not (self.is_trained and self.kind == 'hnsw')
+
+    def _remove_vectors(self, labels):
+        if not self.supports_delete:
+            raise NotImplementedError("FAISS HNSW does not support deletions; rebuild the index instead.")
+        super()._remove_vectors(labels)
+
+    def fold_segments(self, vectors, labels, tombstones):
+        if self.supports_delete or not len(tombstones):
+            return super().fold_segments(vectors, labels, tombstones)
+        # HNSW không xoá được vector: dựng lại đồ thị từ các vector còn sống, như vectordb khi build lại.
+        # HNSW Flat giữ nguyên vector gốc nên không phải embed lại
+        import faiss
+        import numpy as np
+        hnsw = faiss.downcast_index(self.store.index)
+        all_labels = np.concatenate([faiss.vector_to_array(self.store.id_map), np.asarray(labels, dtype=np.int64)])
+        all_vectors = np.vstack([hnsw.reconstruct_n(0, hnsw.ntotal), np.asarray(vectors, dtype=np.float32).reshape(-1, hnsw.d)])
+        live = ~np.isin(all_labels, tombstones)
+        logger.info(f"Rebuilding {self.kind} graph without {int((~live).sum())} tombstoned vectors")
+        self.store = None
+        self.params['trained'] = False
+        if live.any():
+            self.add_vectors(all_vectors[live], all_labels[live])
+            self.train()
+
+    def _write(self, directory):
+        self.train()
+        import faiss
+        faiss.write_index(self.store, os.path.join(directory, FAISS_INDEX_FILE))
+
+
+class MmapFaissIndex(SearchIndex):
+    """Chế độ load chỉ đọc của chỉ mục FAISS: vector được memory-map, chunk đọc từ ChunkStore theo id.
+
+    Nhiều worker Streamlit trên cùng máy dùng chung page cache thay vì mỗi process
+    deserialize một bản riêng, và thời gian load không phụ thuộc kích thước chỉ mục.
+    Chỉ mục phẳng được quét theo khối bằng numpy trên vectors.npy; danh sách IVF đọc bằng faiss IO_FLAG_MMAP.
+    Mọi file của thế hệ được mở ngay trong `__init__`: thư mục bị dọn sau đó thì vùng ánh xạ vẫn dùng được.
+    """
+
+    backend = FaissFlatIndex.backend
+
+    def __init__(self, embeddings: Any, directory: str, params: Optional[Dict[str, Any]] = None,
+                 chunk_store: Any = None) -> None:
+        super().__init__(embeddings, params)
+        import numpy as np
+        self.chunk_store = chunk_store or get_chunk_store()
+        vectors_path = os.path.join(directory, MMAP_VECTORS_FILE)
+        if os.path.exists(vectors_path):
+            self._vectors = np.load(vectors_path, mmap_mode='r')
+            self._norms = np.load(os.path.join(directory, MMAP_NORMS_FILE), mmap_mode='r')
+            self._labels = np.load(os.path.join(directory, MMAP_LABELS_FILE), mmap_mode='r')
+            self._faiss_index = None
+        else:
+            import faiss
+            self.backend = FaissAnnIndex.backend
+            self._vectors = None
+            # HNSW không hỗ trợ mmap trong FAISS: đồ thị được đọc vào bộ nhớ
+            io_flags = 0 if self.params.get('kind') == 'hnsw' else faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+            self._faiss_index = faiss.read_index(os.path.join(directory, FAISS_INDEX_FILE), io_flags)
+
+    @property
+    def count(self):
+        return len(self._vectors) if self._vectors is not None else self._faiss_index.ntotal
+
+    @property
+    def dim(self):
+        return self._vectors.shape[1] if self._vectors is not None else self._faiss_index.d
+
+    @property
+    def faiss_index(self) -> Any:
+        return self._faiss_index
+
+    def search_vectors(self, queries: Any, k: int, nprobe=None, ef_search=None, **search_params) -> Tuple[Any, Any]:
+        """Như FaissFlatIndex.search_vectors; chỉ mục phẳng tính khoảng cách L2 bình phương bằng numpy."""
+        if self._vectors is None:
+            return self._faiss_index.search(queries, k, params=_faiss_search_params(self.params, nprobe, ef_search))
+        k = min(k, len(self._vectors))
+        scores, positions = _flat_top_k(queries, self._vectors, self._norms, k)
+        return scores, self._labels[positions]
+
+    def similarity_search_with_score_by_vector(self, vector, k=4, **search_params):
+        if self.count == 0:
+            return []
+        import numpy as np
+        scores, labels = self.search_vectors(np.asarray([vector], dtype=np.float32), k, **search_params)
+        return _documents_for_hits(self.chunk_store, labels[0], scores[0])
+
+
+class SegmentedIndex(SearchIndex):
+    """Chỉ mục dạng LSM phía truy vấn: base bất biến (mmap) cùng các delta segment nhỏ và tập tombstone.
+
+    Base được tìm với k cộng số tombstone rồi bỏ các nhãn đã bị xoá; delta (vài trăm vector)
+    được tìm vét cạn bằng numpy; hai danh sách được trộn theo khoảng cách L2 lấy top-k.
+    """
+
+    def __init__(self, base: MmapFaissIndex, vectors: Any, labels: Any, tombstones: Any) -> None:
+        super().__init__(base.embeddings, base.params)
+        import numpy as np
+        self.base = base
+        self.backend = base.backend
+        self.chunk_store = base.chunk_store
+        self.tombstones = np.unique(np.asarray(tombstones, dtype=np.int64))
+        # Vector delta đã bị delta sau thay thế thì bỏ ngay khi load
+        live = ~np.isin(labels, self.tombstones)
+        self._vectors = np.ascontiguousarray(vectors[live], dtype=np.float32)
+        self._labels = np.asarray(labels[live], dtype=np.int64)
+        self._norms = (self._vectors ** 2).sum(axis=1)
+        self._base_dead = len(np.setdiff1d(self.tombstones, labels))
+
+    @property
+    def count(self):
+        return self.base.count - self._base_dead + len(self._labels)
+
+    @property
+    def dim(self):
+        return self.base.dim
+
+    @property
+    def faiss_index(self) -> Any:
+        return self.base.faiss_index
+
+    def search_vectors(self, queries: Any, k: int, **search_params: Any) -> Tuple[Any, Any]:
+        """Như FaissFlatIndex.search_vectors, trên base và các delta; vị trí không đủ kết quả có nhãn -1."""
+        import numpy as np
+        queries = np.asarray(queries, dtype=np.float32)
+        fetch = min(self.base.count, k + len(self.tombstones))
+        if fetch > 0:
+            scores, labels = self.base.search_vectors(queries, fetch, **search_params)
+            scores = np.where((labels < 0) | np.isin(labels, self.tombstones), np.inf, scores)
+        else:
+            scores = np.zeros((len(queries), 0), dtype=np.float32)
+            labels = np.zeros((len(queries), 0), dtype=np.int64)
+        if len(self._labels):
+            delta_scores = self._norms[None, :] - 2 * (queries @ self._vectors.T) + (queries ** 2).sum(axis=1)[:, None]
+            scores = np.hstack([scores, delta_scores])
+            labels = np.hstack([labels, np.broadcast_to(self._labels, delta_scores.shape)])
+        order = np.argsort(scores, axis=1, kind='stable')[:, :k]
+        scores = np.take_along_axis(scores, order, axis=1)
+        labels = np.take_along_axis(labels, order, axis=1)
+        if scores.shape[1] < k:
+            # Ít vector hơn k: pad như faiss
+            missing = ((0, 0), (0, k - scores.shape[1]))
+            scores, labels = np.pad(scores, missing, constant_values=np.inf), np.pad(labels, missing)
+        return scores, np.where(np.isinf(scores), -1, labels)
+
+    def similarity_search_with_score_by_vector(self, vector, k=4, **search_params):
+        if self.count == 0:
+            return []
+        import numpy as np
+        scores, labels = self.search_vectors(np.asarray([vector], dtype=np.float32), k, **search_params)
+        return _documents_for_hits(self.chunk_store, labels[0], scores[0])
+
+
+class ChromaIndex(VectorIndex):
+    """Chroma: dữ liệu làm việc nằm ở thư mục tạm, mỗi lần save sao chép thành một thế hệ.
+
+    Thư mục tạm bị xoá khi `close` hoặc khi chỉ mục không còn được tham chiếu
+    (bản cũ sau hot reload được dọn khi truy vấn cuối cùng trên nó kết thúc).
+    """
+
+    backend = 'chroma'
+
+    def __init__(self, embeddings, store=None, params=None, workdir=None):
+        super().__init__(embeddings, store, params)
+        self.params.setdefault('collection_name', 'news')
+        self.workdir = workdir or tempfile.mkdtemp(prefix='chroma-')
+        self._cleanup = weakref.finalize(self, shutil.rmtree, self.workdir, True)
+        if self.store is None:
+            self.store = self._open(self.workdir)
+
+    def _open(self, directory):
+        from langchain_community.vectorstores import Chroma
+        return Chroma(
+            collection_name=self.params['collection_name'],
+            persist_directory=directory,
+            embedding_function=self.embeddings,
+        )
+
+    @property
+    def count(self):
+        return self.store._collection.count()
+
+    @property
+    def dim(self):
+        return self.params.get('dim')
+
+    def add_embeddings(self, texts, vectors, metadatas=None, ids=None):
+        vectors = [list(map(float, vector)) for vector in vectors]
+        if vectors:
+            self.params['dim'] = len(vectors[0])
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        self.store._collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            documents=list(texts),
+            metadatas=list(metadatas) if metadatas else None,
+        )
+        return ids
+
+    def delete(self, ids):
+        if ids:
+            self.store.delete(ids=list(ids))
+
+    def similarity_search_with_score_by_vector(self, vector, k=4, **search_params):
+        return self.store.similarity_search_by_vector_with_relevance_scores(list(vector), k=k)
+
+    def _write(self, directory):
+        shutil.copytree(self.workdir, directory, dirs_exist_ok=True)
+
+    def close(self):
+        self.store = None
+        self._cleanup()
+
+    @classmethod
+    def _read(cls, directory, embeddings, params):
+        # Thế hệ trên đĩa là bất biến: làm việc trên một bản sao
+        workdir = tempfile.mkdtemp(prefix='chroma-')
+        shutil.copytree(directory, workdir, dirs_exist_ok=True)
+        return cls(embeddings, params=params, workdir=workdir)
+
+
+class VectorIndexRetriever(BaseRetriever):
+    """Retriever LangChain tìm thẳng trên SearchIndex, truyền được tham số truy vấn như nprobe/ef_search."""
+
+    index: Any
+    search_kwargs: dict = {}
+
+    def _get_relevant_documents(self, query: str, *, run_manager: Any) -> List[Document]:
+        vector = self.index.embeddings.embed_query(query)
+        return [document for document, _ in self.index.similarity_search_with_score_by_vector(vector, **self.search_kwargs)]
+
+
+BACKENDS: Dict[str, Type[VectorIndex]] = {
+    FaissFlatIndex.backend: FaissFlatIndex,
+    FaissAnnIndex.backend: FaissAnnIndex,
+    ChromaIndex.backend: ChromaIndex,
+}
+
+
+def create_index(embeddings: Any, backend: str = VECTOR_INDEX_BACKEND, **params: Any) -> VectorIndex:
+    """Tạo chỉ mục rỗng theo backend đã đăng ký trong BACKENDS.
+
+    Không truyền params thì dùng VECTOR_INDEX_PARAMS khi backend là backend mặc định.
+    """
+    try:
+        index_cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown vector index backend '{backend}', expected one of {sorted(BACKENDS)}")
+    if not params and backend == VECTOR_INDEX_BACKEND:
+        params = VECTOR_INDEX_PARAMS
+    return index_cls(embeddings, params=params)
+
+
+def read_manifest(path: str) -> Optional[Dict[str, Any]]:
+    """Đọc manifest của chỉ mục, None nếu chưa có (chỉ mục cũ hoặc chưa build)."""
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def index_exists(path: str) -> bool:
+    return read_manifest(path) is not None or os.path.exists(os.path.join(path, FAISS_INDEX_FILE))
+
+
+def load_index(path: str, embeddings: Any, mmap: bool = False) -> SearchIndex:
+    """Load thế hệ hiện tại theo manifest; hỗ trợ cả bố cục FAISS cũ (index.faiss ngay trong thư mục).
+
+    mmap=False: trả về VectorIndex sửa được, delta segment được gộp vào base.
+    mmap=True: MmapFaissIndex (hoặc SegmentedIndex nếu có delta) chỉ đọc khi thế hệ có đủ file phụ,
+    ngược lại load vào bộ nhớ như mmap=False.
+    """
+    model_id = getattr(embeddings, 'model_id', None)
+    for attempt in range(LOAD_ATTEMPTS):
+        manifest = read_manifest(path)
+        if manifest is None:
+            if os.path.exists(os.path.join(path, FAISS_INDEX_FILE)):
+                logger.warning(f"Loading legacy FAISS index without manifest from {path}")
+                index = FaissFlatIndex._read(path, embeddings, {})
+                index.build_id = 'legacy'
+                return index
+            raise FileNotFoundError(f"No vector index found at {path}")
+        if manifest.get('model_id') and model_id and manifest['model_id'] != model_id:
+            raise ValueError(
+                f"Index at {path} was built with '{manifest['model_id']}' but queries use '{model_id}'."
+            )
+        try:
+            return _load_generation(path, manifest, embeddings, mmap)
+        except Exception:
+            # Thế hệ vừa đọc trong manifest đã bị dọn (hai lần save nối tiếp) trước khi mở xong file: đọc lại manifest
+            latest = read_manifest(path) or {}
+            if attempt + 1 == LOAD_ATTEMPTS or latest.get('generation') == manifest['generation']:
+                raise
+            logger.info(f"Generation {manifest['generation']} at {path} was replaced while loading; retrying")
+
+
+def _load_generation(path: str, manifest: Dict[str, Any], embeddings: Any, mmap: bool) -> SearchIndex:
+    """Mở base và mọi delta của một manifest; mọi file được mở (hoặc đọc hẳn) trước khi trả về."""
+    index_cls = BACKENDS[manifest['backend']]
+    directory = os.path.join(path, manifest['current'])
+    params = manifest.get('params', {})
+    if mmap and issubclass(index_cls, FaissFlatIndex) and not os.path.exists(os.path.join(directory, LANGCHAIN_DOCSTORE_FILE)):
+        index = MmapFaissIndex(embeddings, directory, params)
+    else:
+        if mmap:
+            logger.info(f"Generation {manifest['current']} at {path} cannot be memory-mapped; loading into memory.")
+        index = index_cls._read(directory, embeddings, params)
+    if manifest.get('deltas'):
+        vectors, labels, tombstones = _read_segments(path, manifest)
+        if isinstance(index, MmapFaissIndex):
+            index = SegmentedIndex(index, vectors, labels, tombstones)
+        else:
+            index.fold_segments(vectors, labels, tombstones)
+    index.generation = manifest['generation']
+    # Manifest cũ chưa có build_id: base của nó đại diện cho lần build
+    index.build_id = manifest.get('build_id') or manifest['current']
+    return index
+
+
+def _base_generation(manifest: Optional[Dict[str, Any]]) -> Optional[int]:
+    name = (manifest or {}).get('current')
+    return int(name[len(GENERATION_PREFIX):]) if name else None
+
+
+def _delta_names(manifest: Optional[Dict[str, Any]]) -> List[str]:
+    return [delta['name'] for delta in (manifest or {}).get('deltas', [])]
+
+
+def _read_segments(path: str, manifest: Dict[str, Any]) -> Tuple[Any, Any, Any]:
+    """Ghép mọi delta segment của manifest: (vector, nhãn, tombstone)."""
+    import numpy as np
+    vectors, labels, tombstones = [], [], []
+    for name in _delta_names(manifest):
+        directory = os.path.join(path, name)
+        vectors.append(np.load(os.path.join(directory, MMAP_VECTORS_FILE)))
+        labels.append(np.load(os.path.join(directory, MMAP_LABELS_FILE)))
+        tombstones.append(np.load(os.path.join(directory, TOMBSTONES_FILE)))
+    dim = int(manifest.get('dim') or 0)
+    return (
+        np.vstack([block.reshape(-1, dim) for block in vectors]).astype(np.float32),
+        np.concatenate(labels).astype(np.int64),
+        np.concatenate(tombstones).astype(np.int64),
+    )
+
+
+def append_segment(path: str, embeddings: Any, texts: Sequence[str], metadatas: Optional[Sequence[dict]] = None,
+                   ids: Optional[Sequence[str]] = None, delete_ids: Sequence[str] = ()) -> int:
+    """Ghi thay đổi thành một delta segment: chi phí theo số chunk thay đổi, base không bị đọc hay ghi lại.
+
+    Chunk có id đã tồn tại (và `delete_ids`) thành tombstone. Chỉ dùng cho backend FAISS;
+    người gọi giữ `writer_lock(path)`. Trả về generation mới.
+    """
+    import numpy as np
+    manifest = read_manifest(path)
+    if manifest is None or not issubclass(BACKENDS[manifest['backend']], FaissFlatIndex):
+        raise ValueError(f"Index at {path} does not support delta segments")
+    texts = list(texts)
+    ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+    metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+    dim = int(manifest['dim'])
+    # Embed trước khi sửa chunk store: lỗi embedding không để lại thay đổi dở dang
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32).reshape(-1, dim) if texts \
+        else np.zeros((0, dim), dtype=np.float32)
+
+    chunk_store = get_chunk_store()
+    publish_chunks(chunk_store, manifest, cleanup=False)
+    # Chunk cũ chỉ được đánh dấu, chunk mới ở trạng thái pending: cả hai chỉ có hiệu lực khi publish
+    # sau khi manifest mới được ghi, nên dừng giữa chừng không làm mất chunk của thế hệ đang phục vụ
+    token = uuid.uuid4().hex
+    replaced = ids + list(delete_ids)
+    tombstones = np.asarray(sorted(chunk_store.labels(replaced, token).values()), dtype=np.int64)
+    chunk_store.retire(tombstones, token)
+    labels = np.asarray(chunk_store.add(ids, texts, metadatas, token) if texts else [], dtype=np.int64)
+
+    with FileLock(os.path.join(path, LOCK_FILE)):
+        current = read_manifest(path)
+        generation = int(current['generation']) + 1
+        name = f"{DELTA_PREFIX}{generation:06d}"
+        tmp_dir = tempfile.mkdtemp(prefix=f".tmp-{name}-", dir=path)
+        try:
+            np.save(os.path.join(tmp_dir, MMAP_VECTORS_FILE), vectors)
+            np.save(os.path.join(tmp_dir, MMAP_LABELS_FILE), labels)
+            np.save(os.path.join(tmp_dir, TOMBSTONES_FILE), tombstones)
+            _fsync_tree(tmp_dir)
+            os.rename(tmp_dir, os.path.join(path, name))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        manifest = {
+            **current,
+            'generation': generation,
+            'count': int(current.get('count') or 0) + len(labels) - len(tombstones),
+            'deltas': current.get('deltas', []) + [{'name': name, 'count': len(labels), 'tombstones': len(tombstones)}],
+            'retained_generation': current.get('retained_generation'),
+            'chunks': {'token': token, 'replace_all': False},
+            'created_at': time.time(),
+        }
+        _write_json_atomic(os.path.join(path, MANIFEST_FILE), manifest)
+        publish_chunks(chunk_store, manifest)
+    logger.info(f"Appended delta segment {name} ({len(labels)} vectors, {len(tombstones)} tombstones) to {path}")
+    return generation
+
+
+def needs_compaction(manifest: Optional[Dict[str, Any]]) -> bool:
+    """Delta segment đã vượt một trong các ngưỡng LSM_* và nên được gộp vào base."""
+    deltas = (manifest or {}).get('deltas', [])
+    if not deltas:
+        return False
+    delta_count = sum(delta['count'] for delta in deltas)
+    tombstones = sum(delta['tombstones'] for delta in deltas)
+    base_count = max(1, int(manifest.get('count') or 0) - delta_count + tombstones)
+    return (
+        len(deltas) >= LSM_MAX_DELTAS
+        or delta_count >= LSM_MAX_DELTA_RATIO * base_count
+        or tombstones >= LSM_MAX_TOMBSTONES
+    )
+
+
+def compact_index(path: str, embeddings: Any) -> Optional[int]:
+    """Gộp mọi delta segment vào một base mới (chạy nền hoặc từ CLI, người gọi giữ `writer_lock(path)`)."""
+    manifest = read_manifest(path)
+    if not manifest or not manifest.get('deltas'):
+        return None
+    started_at = time.perf_counter()
+    index = load_index(path, embeddings)
+    generation = index.save(path)
+    logger.info(
+        f"Compacted {len(manifest['deltas'])} delta segments into generation {generation} "
+        f"in {time.perf_counter() - started_at:.1f}s"
+    )
+    return generation
+
+
+def writer_lock(path: str) -> FileLock:
+    """Chỉ một tiến trình được sửa chỉ mục tại một thời điểm, để thế hệ mới không ghi đè thay đổi của nhau."""
+    os.makedirs(path, exist_ok=True)
+    return FileLock(os.path.join(path, WRITER_LOCK_FILE))
+
+
+def load_or_create_index(path: str, embeddings: Any, backend: str = VECTOR_INDEX_BACKEND, **params: Any) -> VectorIndex:
+    """Chỉ mục để sửa (người gọi giữ `writer_lock(path)`), tạo mới nếu chưa có."""
+    if index_exists(path):
+        index = load_index(path, embeddings)
+        # Tra chunk theo id phải thấy đúng thế hệ vừa load, kể cả khi tiến trình ghi trước chưa kịp publish
+        index._recover(read_manifest(path) or {})
+        return index
+    return create_index(embeddings, backend, **params)
+
+
+def publish_chunks(chunk_store: Any, manifest: Optional[Dict[str, Any]], cleanup: bool = True) -> None:
+    """Publish thay đổi chunk ghi trong manifest (xem `ChunkStore.publish`); gọi lại nhiều lần không sao."""
+    chunks = (manifest or {}).get('chunks')
+    if chunks:
+        chunk_store.publish(
+            int(manifest['generation']), chunks['token'], chunks.get('replace_all', False),
+            manifest.get('retained_generation'), cleanup,
+        )
+
+
+def _documents_for_hits(chunk_store: Any, labels: Any, scores: Any) -> List[Tuple[Document, float]]:
+    """Đọc chunk của các nhãn tìm được; chunk đã bị xoá hẳn (thế hệ quá cũ đã bị dọn) thì bỏ qua."""
+    hits = [(int(label), float(score)) for label, score in zip(labels, scores) if label >= 0]
+    documents = chunk_store.get([label for label, _ in hits])
+    return [(document, score) for document, (_, score) in zip(documents, hits) if document is not None]
+
+
+def _flat_top_k(queries: Any, vectors: Any, norms: Any, k: int, block: int = FLAT_SCAN_BLOCK) -> Tuple[Any, Any]:
+    """Top-k theo L2 bình phương trên `vectors` (thường là mmap), quét từng khối và giữ top-k chạy.
+
+    Bộ nhớ tạm O(số truy vấn × (block + k)) thay vì một ma trận khoảng cách với mọi vector.
+    Trả về (khoảng cách, vị trí trong `vectors`) đã sắp tăng dần.
+    """
+    import numpy as np
+    queries = np.asarray(queries, dtype=np.float32)
+    query_norms = (queries ** 2).sum(axis=1)[:, None]
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    best_positions = np.zeros((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(vectors), block):
+        block_vectors = vectors[start:start + block]
+        scores = norms[None, start:start + len(block_vectors)] - 2 * (queries @ block_vectors.T) + query_norms
+        positions = np.broadcast_to(np.arange(start, start + len(block_vectors), dtype=np.int64), scores.shape)
+        scores = np.hstack([best_scores, scores])
+        positions = np.hstack([best_positions, positions])
+        if scores.shape[1] > k:
+            keep = np.argpartition(scores, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, keep, axis=1)
+            positions = np.take_along_axis(positions, keep, axis=1)
+        best_scores, best_positions = scores, positions
+    order = np.argsort(best_scores, axis=1, kind='stable')
+    return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_positions, order, axis=1)
+
+
+def _faiss_search_params(params: Dict[str, Any], nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> Any:
+    """Tham số tìm kiếm FAISS theo từng truy vấn: các session dùng chung chỉ mục không ảnh hưởng nhau."""
+    import faiss
+    if params.get('kind') == 'hnsw':
+        search_params = faiss.SearchParametersHNSW()
+        search_params.efSearch = int(ef_search or params['ef_search'])
+    else:
+        search_params = faiss.SearchParametersIVF()
+        search_params.nprobe = int(nprobe or params['nprobe'])
+    return search_params
+
+
+def _write_json_atomic(file_path: str, data: Dict[str, Any]) -> None:
+    tmp_path = f"{file_path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def _fsync_tree(directory: str) -> None:
+    for root, _, files in os.walk(directory):
+        for name in files:
+            with open(os.path.join(root, name), 'rb') as f:
+                os.fsync(f.fileno())
+
+
+def _remove_old_generations(path: str, keep: set) -> None:
+    """Xoá thư mục base/delta không thuộc `keep`."""
+    for name in os.listdir(path):
+        if name.startswith((GENERATION_PREFIX, DELTA_PREFIX)) and name not in keep:
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
@@ -1,14 +1,29 @@
 import gc
 import os
 import json
+import hashlib
 import sqlite3
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma  # Đổi từ FAISS sang Chroma
-from langchain_community.embeddings import GPT4AllEmbeddings
 from langchain.docstore.document import Document
-from config import DB_PATH, VECTOR_DB_PATH, METADATA_PATH, OUTPUT_DIR, LOG_PATH
+from config import config
+from embedding_cache import get_cached_embeddings
+from embedding_service import get_embedding_service
+from parallel_embed import EMBEDDING_WORKERS, ParallelEmbedder
+from vector_index import (VECTOR_INDEX_BACKEND, compact_index, create_index, index_exists, load_or_create_index,
+                          read_manifest, writer_lock)
+
+DB_PATH = config.db_path
+VECTOR_DB_PATH = config.vector_db_path
+METADATA_PATH = config.metadata_path
+OUTPUT_DIR = config.output_dir
+LOG_PATH = config.log_path
+
+# Số bản ghi/chunk xử lý mỗi lô, giữ bộ nhớ cố định bất kể kích thước bảng news
+INDEX_BATCH_SIZE = int(os.getenv('INDEX_BATCH_SIZE', 256))
 
 # Cấu hình logging để ghi vào file và console
 logging.basicConfig(
@@ -26,13 +41,20 @@ def load_metadata():
         with open(METADATA_PATH, "r", encoding='utf-8') as f:
             return json.load(f)
     else:
-        return {"processed_files": []}
+        return {"processed_files": [], "documents": {}}
 
 
 def save_metadata(metadata):
-    """Lưu metadata vào file JSON."""
-    with open(METADATA_PATH, "w", encoding='utf-8') as f:
+    """Lưu metadata vào file JSON (ghi file tạm rồi đổi tên để không bị hỏng giữa chừng)."""
+    tmp_path = METADATA_PATH + '.tmp'
+    with open(tmp_path, "w", encoding='utf-8') as f:
         json.dump(metadata, f, ensure_ascii=False)
+    os.replace(tmp_path, METADATA_PATH)
+
+
+def content_hash(text):
+    """Hash nội dung tài liệu, dùng để phát hiện tài liệu mới hoặc đã thay đổi."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
 
 
 def read_text_file(file_path):
@@ -45,91 +67,225 @@ def read_text_file(file_path):
             return f.read()
 
 
-def load_documents_from_db():
-    """Tải tất cả các tài liệu từ cơ sở dữ liệu SQLite."""
-    documents = []
-    if os.path.exists(DB_PATH):
-        try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute('SELECT url, title, content FROM news')
-                rows = cursor.fetchall()
+def batched(iterable, size):
+    """Chia một iterator thành các lô có tối đa `size` phần tử."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_documents_from_db(batch_size=INDEX_BATCH_SIZE):
+    """Đọc bảng news theo từng trang (keyset theo id), không fetchall toàn bộ bảng."""
+    if not os.path.exists(DB_PATH):
+        return
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            last_id = 0
+            while True:
+                rows = conn.execute(
+                    'SELECT id, url, title, content FROM news WHERE id > ? ORDER BY id LIMIT ?',
+                    (last_id, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
                 for row in rows:
-                    # Kiểm tra nếu content hợp lệ (không None hoặc rỗng)
-                    if row[2] and row[2].strip():
-                        documents.append(
-                            Document(page_content=row[2], metadata={'source': row[0], 'title': row[1]}))
-                    else:
-                        logging.warning(f"Skipping document with empty content: {row[0]}")
-        except sqlite3.Error as e:
-            logging.error(f"SQLite Error: {e}")
-    return documents
-
-
-def load_documents_from_files():
-    """Tải tất cả các tài liệu văn bản từ tệp .txt trong thư mục."""
-    documents = []
-    metadata = load_metadata()
+                    yield Document(
+                        page_content=row[3] or '',
+                        metadata={'doc_id': f"news:{row[0]}", 'source': row[1], 'title': row[2]}
+                    )
+                last_id = rows[-1][0]
+    except sqlite3.Error as e:
+        logging.error(f"SQLite Error: {e}")
+
 
+def iter_documents_from_files(batch_size=INDEX_BATCH_SIZE):
+    """Đọc các tệp .txt trong thư mục theo từng lô, các tệp trong một lô được đọc song song."""
     def process_file(file_path):
-        if file_path.endswith('.txt') and os.path.exists(file_path):
-            try:
-                text = read_text_file(file_path)
-                if text and text.strip():  # Kiểm tra nếu nội dung không rỗng
-                    return Document(page_content=text, metadata={'source': file_path})
-                else:
-                    logging.warning(f"Skipping empty file: {file_path}")
-            except Exception as e:
-                logging.error(f"Error loading file {file_path}: {e}")
+        try:
+            text = read_text_file(file_path)
+            doc_id = f"file:{os.path.basename(file_path)}"
+            return Document(page_content=text, metadata={'doc_id': doc_id, 'source': file_path})
+        except Exception as e:
+            logging.error(f"Error loading file {file_path}: {e}")
         return None
 
+    if not os.path.isdir(OUTPUT_DIR):
+        return
+    file_paths = (
+        entry.path for entry in os.scandir(OUTPUT_DIR)
+        if entry.is_file() and entry.name.endswith('.txt')
+    )
     with ThreadPoolExecutor() as executor:
-        future_to_file = {executor.submit(process_file, os.path.join(OUTPUT_DIR, file)): file for file in os.listdir(OUTPUT_DIR) if file.endswith('.txt')}
-        for future in as_completed(future_to_file):
-            result = future.result()
-            if result:
-                documents.append(result)
+        for paths in batched(file_paths, batch_size):
+            for document in executor.map(process_file, paths):
+                if document:
+                    yield document
 
-    return documents
 
+def clean_documents(documents):
+    """Bỏ qua tài liệu rỗng và chuẩn hoá khoảng trắng đầu/cuối."""
+    for document in documents:
+        text = document.page_content.strip() if document.page_content else ''
+        if not text:
+            logging.warning(f"Skipping document with empty content: {document.metadata.get('source')}")
+            continue
+        document.page_content = text
+        yield document
 
-def create_db_from_files_and_db():
-    """Tạo cơ sở dữ liệu vector từ cả file và cơ sở dữ liệu SQLite."""
-    # Tải tài liệu từ tệp .txt
-    text_documents = load_documents_from_files()
 
-    # Tải tài liệu từ cơ sở dữ liệu
-    db_documents = load_documents_from_db()
+def filter_changed_documents(documents, tracked, seen, stale_chunk_ids):
+    """Chỉ cho qua tài liệu mới hoặc đã thay đổi so với hash trong metadata.
 
-    # Kết hợp dữ liệu từ cả hai nguồn
-    documents = text_documents + db_documents
+    Ghi lại doc_id đã gặp vào `seen` và chunk id cũ của tài liệu thay đổi vào `stale_chunk_ids`.
+    """
+    for document in documents:
+        doc_id = document.metadata['doc_id']
+        seen.add(doc_id)
+        digest = content_hash(document.page_content)
+        document.metadata['content_hash'] = digest
+        entry = tracked.get(doc_id)
+        if entry and entry['hash'] == digest:
+            continue
+        if entry:
+            stale_chunk_ids.extend(entry['chunk_ids'])
+        yield document
 
-    if not documents:
-        logging.info("No documents found in either text files or database.")
-        return
 
-    # Embedding
-    model_name = "all-MiniLM-L6-v2.gguf2.f16.gguf"
-    gpt4all_kwargs = {'allow_download': True}
-    embeddings = GPT4AllEmbeddings(
-        model_name=model_name,
-        gpt4all_kwargs=gpt4all_kwargs
-    )
+def split_documents_with_ids(documents, text_splitter, chunk_ids):
+    """Chia từng tài liệu thành chunk với id ổn định dạng '<doc_id>#<thứ tự>'."""
+    for document in documents:
+        doc_id = document.metadata['doc_id']
+        doc_chunks = text_splitter.split_documents([document])
+        chunk_ids[doc_id] = (document.metadata['content_hash'], [f"{doc_id}#{i}" for i in range(len(doc_chunks))])
+        for i, chunk in enumerate(doc_chunks):
+            chunk.metadata['chunk_id'] = f"{doc_id}#{i}"
+            yield chunk
+
 
-    # Split documents into chunks
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50)
-    chunks = text_splitter.split_documents(documents)
+def create_db_from_files_and_db(batch_size=INDEX_BATCH_SIZE, workers=EMBEDDING_WORKERS,
+                                backend=VECTOR_INDEX_BACKEND, rebuild=False):
+    """Cập nhật cơ sở dữ liệu vector từ file và SQLite theo pipeline lô, bộ nhớ không phụ thuộc kích thước bảng.
 
-    # Tạo hoặc tải cơ sở dữ liệu vector từ Chroma
-    if os.path.exists(VECTOR_DB_PATH):
-        db = Chroma.load_local(VECTOR_DB_PATH, embeddings)
-        db.add_documents(chunks)
+    Pipeline: đọc theo trang -> làm sạch -> lọc tài liệu thay đổi -> chia chunk -> embed theo lô -> thêm vào chỉ mục.
+    """
+    # Embedding: cùng model với phía truy vấn, chunk không đổi lấy từ cache.
+    # Với workers > 1, phần embed được chia shard cho nhiều process CPU.
+    embedder = ParallelEmbedder(workers=workers) if workers > 1 else get_embedding_service()
+    try:
+        # Bộ index phản hồi (feedback_outbox.py) chờ tới khi lần cập nhật này lưu xong
+        with writer_lock(VECTOR_DB_PATH):
+            _update_index(get_cached_embeddings(embedder), batch_size, backend, rebuild)
+    finally:
+        if isinstance(embedder, ParallelEmbedder):
+            embedder.close()
+
+
+def compact_vector_db():
+    """Gộp các delta segment do bộ index phản hồi ghi vào base mới, không embed lại gì."""
+    with writer_lock(VECTOR_DB_PATH):
+        generation = compact_index(VECTOR_DB_PATH, get_cached_embeddings(get_embedding_service()))
+    if generation is None:
+        logging.info("No delta segments to compact.")
+
+
+def _update_index(embeddings, batch_size, backend=VECTOR_INDEX_BACKEND, rebuild=False):
+    """Chạy pipeline cập nhật chỉ mục với embedder đã chọn."""
+    metadata = load_metadata()
+    tracked = metadata.get("documents", {})
+    manifest = read_manifest(VECTOR_DB_PATH)
+    tracked_chunks = sum(len(entry['chunk_ids']) for entry in tracked.values())
+    # Đổi model embedding thì toàn bộ vector cũ không còn dùng được; đổi loại chỉ mục
+    # hoặc yêu cầu rebuild thì quantizer được huấn luyện lại trên toàn bộ dữ liệu.
+    # metadata.json chỉ đáng tin khi chỉ mục trên đĩa thật sự chứa các chunk nó ghi nhận: thư mục mất,
+    # chỉ mục không có manifest (Chroma cũ) hay ít vector hơn số chunk đã ghi nhận thì build lại toàn bộ
+    # (nhiều hơn là bình thường: chunk phản hồi được thêm qua delta segment trước khi vectordb ghi nhận).
+    full_rebuild = (
+        rebuild
+        or metadata.get("model_id") != embeddings.model_id
+        or (manifest is not None and manifest.get('backend') != backend)
+        or (tracked_chunks > 0 and not index_exists(VECTOR_DB_PATH))
+        or (manifest is not None and int(manifest.get('count') or 0) < tracked_chunks)
+    )
+    if full_rebuild:
+        tracked = {}
+
+    # Chỉ mục được sửa trong bộ nhớ và chỉ được lưu (nguyên tử) khi pipeline chạy xong
+    if full_rebuild:
+        db = create_index(embeddings, backend)
     else:
-        db = Chroma.from_documents(chunks, embeddings)
+        db = load_or_create_index(VECTOR_DB_PATH, embeddings, backend)
+        if not db.supports_delete:
+            # Chỉ mục không xoá được vector (HNSW): tài liệu thay đổi hay bị xoá sẽ để lại vector cũ
+            logging.info(f"{db.backend} index cannot delete vectors; rebuilding it from scratch.")
+            full_rebuild, tracked = True, {}
+            db = create_index(embeddings, backend)
+    seen, stale_chunk_ids, chunk_ids = set(), [], {}
+    documents = clean_documents(
+        document
+        for source in (iter_documents_from_files(batch_size), iter_documents_from_db(batch_size))
+        for document in source
+    )
+    changed = filter_changed_documents(documents, tracked, seen, stale_chunk_ids)
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50, add_start_index=True)
+    chunks = split_documents_with_ids(changed, text_splitter, chunk_ids)
+
+    added = 0
+    for chunk_batch in batched(chunks, batch_size):
+        # Chunk id cũ của tài liệu thay đổi phải xoá trước khi thêm chunk mới cùng id
+        if stale_chunk_ids:
+            db.delete(stale_chunk_ids)
+            stale_chunk_ids.clear()
+        db.add_texts(
+            [chunk.page_content for chunk in chunk_batch],
+            metadatas=[chunk.metadata for chunk in chunk_batch],
+            ids=[chunk.metadata['chunk_id'] for chunk in chunk_batch],
+        )
+        added += len(chunk_batch)
+        logging.info(f"Indexed {added} chunks...")
+
+    removed = [doc_id for doc_id in tracked if doc_id not in seen]
+    for doc_id in removed:
+        stale_chunk_ids.extend(tracked.pop(doc_id)['chunk_ids'])
+    deleted = len(stale_chunk_ids)
+    for ids in batched(stale_chunk_ids, batch_size):
+        db.delete(ids)
+
+    if full_rebuild and not added:
+        # Build lại mà không có tài liệu nào: không lưu thế hệ rỗng, giữ nguyên chỉ mục và metadata.json đang dùng
+        logging.warning("Full rebuild found no documents; keeping the current index and metadata.")
+        db.close()
+        return
+    if added or deleted:
+        db.save(VECTOR_DB_PATH)
+
+    for doc_id, (digest, ids) in chunk_ids.items():
+        tracked[doc_id] = {'hash': digest, 'chunk_ids': ids}
 
-    logging.info("Vector database created/updated successfully.")
+    metadata["documents"] = tracked
+    metadata["model_id"] = embeddings.model_id
+    metadata["processed_files"] = sorted(doc_id for doc_id in tracked if doc_id.startswith('file:'))
+    save_metadata(metadata)
+    logging.info(
+        f"Vector database updated: {len(seen)} documents scanned, {len(chunk_ids)} new/changed, "
+        f"{len(removed)} removed; {added} chunks added ({embeddings.misses} embedded, "
+        f"{embeddings.hits} from cache), {deleted} stale chunks deleted."
+    )
 
 
 if __name__ == '__main__':
-    create_db_from_files_and_db()
+    parser = argparse.ArgumentParser(description="Cập nhật cơ sở dữ liệu vector từ file và SQLite.")
+    parser.add_argument('--batch-size', type=int, default=INDEX_BATCH_SIZE, help="Số bản ghi/chunk mỗi lô")
+    parser.add_argument('--workers', type=int, default=EMBEDDING_WORKERS, help="Số process embedding song song")
+    parser.add_argument('--backend', default=VECTOR_INDEX_BACKEND, help="Loại chỉ mục (faiss_flat | faiss_ann | chroma)")
+    parser.add_argument('--rebuild', action='store_true', help="Build lại toàn bộ chỉ mục (huấn luyện lại quantizer)")
+    parser.add_argument('--compact', action='store_true', help="Chỉ gộp các delta segment vào base rồi thoát")
+    args = parser.parse_args()
+    if args.compact:
+        compact_vector_db()
+    else:
+        create_db_from_files_and_db(batch_size=args.batch_size, workers=args.workers,
+                                    backend=args.backend, rebuild=args.rebuild)
     gc.collect()  # Explicit garbage collection
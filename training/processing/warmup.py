@@ -0,0 +1,103 @@
+# warmup.py
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Trạng thái khởi động dùng chung cho cả process
+_state: Dict[str, Any] = {
+    'status': 'idle',  # idle | running | ready | failed
+    'steps': {},
+    'error': None,
+    'elapsed_ms': None,
+}
+_state_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+
+TOUCH_BATCH_SIZE = 4096
+
+
+def _set_step(name: str, value: Any) -> None:
+    with _state_lock:
+        _state['steps'][name] = value
+
+
+def touch_index(vector_store: Any) -> int:
+    """Đọc lướt qua toàn bộ vector để các trang của chỉ mục nằm sẵn trong RAM."""
+    index = getattr(vector_store, 'faiss_index', None)
+    if index is None:
+        # Backend không phải FAISS: một truy vấn giả là đủ để nạp dữ liệu
+        if vector_store.dim:
+            vector_store.similarity_search_with_score_by_vector([0.0] * vector_store.dim, k=1)
+        return vector_store.count
+    total = index.ntotal
+    if total == 0:
+        return 0
+    try:
+        for start in range(0, total, TOUCH_BATCH_SIZE):
+            index.reconstruct_n(start, min(TOUCH_BATCH_SIZE, total - start))
+    except RuntimeError:
+        # Một số loại chỉ mục không hỗ trợ reconstruct: thực hiện một truy vấn giả
+        import numpy as np
+        index.search(np.zeros((1, index.d), dtype=np.float32), 1)
+    return total
+
+
+def jit_embedder(embeddings: Any) -> int:
+    """Gọi embedder một lần để nạp model và khởi tạo các kernel."""
+    return len(embeddings.embed_query("khởi động hệ thống hỏi đáp pháp luật giao thông"))
+
+
+def prime_llm(llm: Any, system_prefix: str) -> int:
+    """Nạp trọng số LLM và đăng ký phần system prompt cố định để các request dùng lại KV cache của nó."""
+    return llm.prime_prefix(system_prefix)
+
+
+def _run(vector_store: Any, embeddings: Any, llm: Any, system_prefix: str) -> None:
+    started_at = time.perf_counter()
+    steps = (
+        ('index', lambda: touch_index(vector_store) if vector_store is not None else 0),
+        ('embedder', lambda: jit_embedder(embeddings)),
+        ('llm', lambda: prime_llm(llm, system_prefix)),
+    )
+    try:
+        for name, step in steps:
+            _set_step(name, 'running')
+            step_started_at = time.perf_counter()
+            result = step()
+            _set_step(name, f"{(time.perf_counter() - step_started_at) * 1000:.0f} ms ({result})")
+        status, error = 'ready', None
+    except Exception as e:
+        logger.error(f"Warm-up failed: {e}")
+        status, error = 'failed', str(e)
+
+    with _state_lock:
+        _state['status'] = status
+        _state['error'] = error
+        _state['elapsed_ms'] = round((time.perf_counter() - started_at) * 1000)
+    logger.info(f"Warm-up finished with status {status} in {_state['elapsed_ms']} ms.")
+
+
+def start_warmup(vector_store: Any, embeddings: Any, llm: Any, system_prefix: str) -> bool:
+    """Chạy warm-up nền đúng một lần cho mỗi process. Trả về True nếu lần gọi này khởi động nó."""
+    global _thread
+    with _state_lock:
+        if _state['status'] != 'idle':
+            return False
+        _state['status'] = 'running'
+    _thread = threading.Thread(
+        target=_run,
+        args=(vector_store, embeddings, llm, system_prefix),
+        name='warmup',
+        daemon=True,
+    )
+    _thread.start()
+    return True
+
+
+def warmup_status() -> Dict[str, Any]:
+    """Bản sao trạng thái warm-up để hiển thị trên sidebar."""
+    with _state_lock:
+        return {**_state, 'steps': dict(_state['steps'])}